@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#       aio.py
+#
+#       Copyright 2013-2019 Aaron Krister Johnson <akjmicro@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+"""An asyncio runtime, for driving voices from an event loop (e.g. inside
+an async control service) instead of from threads.
+
+The multicast clock socket is a DatagramProtocol, and every tick is handed
+to a Scheduler, whose timing wheel calls each voice's step logic when it
+has something due. Nothing blocks: `play` and `stop` return at once, and
+awaiting them waits for the cycle boundary (or the next tick, if
+`immediately`) at which the voice actually starts or stops.
+
+    runtime = AsyncRuntime()
+    await runtime.start()
+    a = runtime.voice(0)
+    await runtime.play(a)
+"""
+
+# modules needed:
+import asyncio
+
+# my modules:
+from . import constants
+from .lib import midi_functions
+from .pystepseq import Pystepseq
+from .scheduler import Scheduler
+from .tempotrigger import TICK_PACKET, TICK_VERSION, openmcastsock
+
+
+class TickProtocol(asyncio.DatagramProtocol):
+    """decodes tick packets and passes them on to an AsyncRuntime"""
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def datagram_received(self, data, addr):
+        if len(data) != TICK_PACKET.size or data[0] != TICK_VERSION:
+            return  # not a tick packet we understand
+        _, tick, cycle_len, tempo, timestamp, seq = TICK_PACKET.unpack(data)
+        self.runtime.on_tick(tick, cycle_len, timestamp, seq)
+
+
+class AsyncRuntime:
+    def __init__(self, group="225.0.0.250", port=None):
+        self.group = group
+        self.port = port if port is not None else constants.DEFAULT_MULTICAST_PORT
+        self.scheduler = Scheduler(group, self.port)
+        self.transport = None
+        self.tick = -1
+        self.cycle_len = 0
+
+    async def start(self):
+        """join the multicast group and start stepping voices"""
+        loop = asyncio.get_running_loop()
+        sock = openmcastsock(self.group, self.port)
+        sock.setblocking(False)
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: TickProtocol(self), sock=sock
+        )
+        midi_functions.set_batching(True)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        midi_functions.set_batching(False)
+
+    def voice(self, chn=0, **kwargs):
+        """a new voice, stepped by this runtime"""
+        return Pystepseq(chn, scheduler=self.scheduler, **kwargs)
+
+    def on_tick(self, tick, cycle_len, timestamp, seq):
+        self.tick, self.cycle_len = tick, cycle_len
+        midi_functions.set_batch_time(midi_functions.tick_time(timestamp))
+        self.scheduler.receive(tick, cycle_len, seq)
+
+    def _when_done(self):
+        """a future, and a callback that resolves it"""
+        future = asyncio.get_running_loop().create_future()
+
+        def done():
+            if not future.done():
+                future.set_result(None)
+
+        return future, done
+
+    async def play(self, voice, immediately=False):
+        """start `voice` at the next cycle boundary (or on the next tick)"""
+        future, done = self._when_done()
+        voice.play(immediately, done)
+        await future
+
+    async def stop(self, voice, immediately=False):
+        """stop `voice` at the next cycle boundary (or on the next tick)"""
+        future, done = self._when_done()
+        voice.stop(immediately, done)
+        await future
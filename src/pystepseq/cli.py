@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#       cli.py
+#
+#       Copyright 2013-2019 Aaron Krister Johnson <akjmicro@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+"""The `pystepseq` command. Only the standard library is imported until
+the arguments have been read, so that e.g. `--bench-startup` measures a
+cold start rather than one that has already paid for the imports.
+"""
+
+# modules needed:
+import subprocess
+import sys
+import time
+
+# what each --bench-startup run times, in a fresh interpreter:
+_BENCH_CODE = """
+import time
+start = time.perf_counter()
+import pystepseq.main
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def bench_startup(runs=10):
+    """Start `runs` fresh interpreters that import pystepseq.main, and
+    print how long the import took and how long the whole process took."""
+    imports = []
+    processes = []
+    for i in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", _BENCH_CODE],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        processes.append((time.perf_counter() - start) * 1000)
+        imports.append(float(out.stdout.split()[-1]))
+    for name, times in [("import", imports), ("process", processes)]:
+        times.sort()
+        print(
+            "%s: best %.1fms, median %.1fms, worst %.1fms (%d runs)"
+            % (name, times[0], times[len(times) // 2], times[-1], runs)
+        )
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="pystepseq", description="A commandline MIDI step sequencer"
+    )
+    parser.add_argument(
+        "--bench-startup",
+        action="store_true",
+        help="time how long pystepseq takes to start, and exit",
+    )
+    parser.add_argument(
+        "--script",
+        metavar="FILE",
+        help="run the commands in FILE without the interactive prompt",
+    )
+    args = parser.parse_args(argv)
+    if args.bench_startup:
+        bench_startup()
+        return
+    if args.script:
+        from .script import run_script
+
+        try:
+            run_script(args.script)
+        except (OSError, ValueError) as e:  # a missing or mistaken script
+            parser.error(str(e))
+        return
+    from .main import repl
+
+    repl()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,3 +2,23 @@ import os
 
 PORTMIDI_DEVNUM = int(os.getenv("PORTMIDI_DEVNUM", "0"))
 DEFAULT_MULTICAST_PORT = int(os.getenv("PYSTEPSEQ_MULTICAST_PORT", "8123"))
+# "threads" runs one looper thread per voice, "scheduler" steps every voice
+# from a single Scheduler thread:
+ENGINE = os.getenv("PYSTEPSEQ_ENGINE", "threads")
+# "legacy" or "deadline", see Tempotrigger.trigger:
+CLOCK_MODE = os.getenv("PYSTEPSEQ_CLOCK_MODE", "legacy")
+CLOCK_SPIN_WINDOW = float(os.getenv("PYSTEPSEQ_CLOCK_SPIN_WINDOW", "0.0005"))
+# how ticks get from the Tempotrigger to the voices: "multicast" (works
+# across the network) or "shm", a shared memory block for a single host:
+CLOCK_TRANSPORT = os.getenv("PYSTEPSEQ_CLOCK_TRANSPORT", "multicast")
+CLOCK_SHM_NAME = os.getenv("PYSTEPSEQ_CLOCK_SHM_NAME", "pystepseq_clock")
+# generate contours with NumPy (it must be installed; off unless asked for):
+USE_NUMPY = os.getenv("PYSTEPSEQ_NUMPY", "0") != "0"
+# read the next slot of a loaded song in the background when one is recalled
+# (this starts a thread per recall, so it's off unless asked for):
+PREFETCH_SLOTS = os.getenv("PYSTEPSEQ_PREFETCH_SLOTS", "0") != "0"
+# spread the voices over this many worker processes (0: run them all here):
+WORKERS = int(os.getenv("PYSTEPSEQ_WORKERS", "0"))
+# record timing histograms in the loopers, the clock and the MIDI output
+# (this can also be switched on and off with the 'stats' command):
+INSTRUMENT = os.getenv("PYSTEPSEQ_INSTRUMENT", "0") != "0"
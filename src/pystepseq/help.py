@@ -17,6 +17,11 @@ t\\   # stop a tempotrigger thread (immediately with 't\\\\')
 tt48 # change the default number of ticks per beat to 48 (default 24)
      # can be any number
 t114   # set tempo to QN=114
+ts     # show the clock's drift and tick jitter statistics
+tmdeadline # clock mode: 'deadline' (absolute deadlines) or 'legacy'
+stats  # show the timing histograms of the voices, the clock and MIDI output
+stats on     # start recording them (or 'stats off'; 'stats reset' clears them)
+stats save t.json  # write them all out as JSON
 =a   # adds a new voice, 'a'
 =a4  # adds a new voice called 'a', but on MIDI channel 4 (0-15)
 -a   # stops and deletes 'a'
@@ -34,7 +39,8 @@ a/     # bring in a (immediate with 'a//')
 z/     # if you've established a bass drum voice, bring it in
 x/     # if you've established an 'everything else percussion voice', bring
        # it in
-`a,b,c # call 'change' on the listed voices
+`a,b,c # call 'change' on the listed voices (each as its pattern comes round)
+`a,b,c!  # the same, but all of them switch together at the next cycle start
 asBLAH # set a voice's scale to BLAH (pent, modal, chroma[tic], etc.)
 am48   # minimum note on voice 'a' is 48
 ax62   # maximum note on voice 'a' is 62
@@ -46,6 +52,8 @@ annbrown # a's note noise type (brown, white, pink)
 and5     # a's random note depth is now 5
 arv      # randomize volumes
 arg      # randomize gates (% of rhythm length that holds, for articulation)
+ars1234  # reseed a's random stream, so its randomizing can be repeated exactly
+arp32    # pre-roll 32 variations for '`' (change) to pick from
 ap30     # on next 'rv' call, 30% of notes are rests
 avnpink  # a's volume noise type (brown, white, pink)
 avd16    # a's random volumn depth is now 16
@@ -60,14 +68,27 @@ af[1,5,6,7,3],3,12,0  # fractal noise, takes 3 params:
                       # initial seed list, # layers, length of result, transposition
 an[x^17 - 34 for x in range(32)] # evaluate math to populate an list
                                  # must end up being integers....
+al[6]*2**3   # eight 6s; exponents go up to 64
 ae12     # loop back the cycle after the 12th note.
+ak       # how many clock ticks 'a' lost (and caught up on), got late, or
+         # got twice
 ##################################
 # riff and song save and recall: #
 ##################################
 q4   # save what's going on to slot 4
-4    # replace what's playing with the contents of slot 4
+4    # switch every voice to slot 4, each as its pattern comes round
+4!   # the same, but all of them switch together at the next cycle start
 load mysong # replace all slots with the contents of the file 'mysong'
 save mysong # save all slots to the file 'mysong'
+save mysong.pss  # save in the compact binary format ('.pssz' to compress);
+                 # 'load' tells the formats apart by itself
+render mysong.mid 60 # write 60 seconds of all voices to a MIDI file,
+                     # without playing them (faster than real time)
+record mysong.mid    # record everything played to a MIDI file...
+record               # ...until this stops the recording
+import a 3 tune.mid  # quantize the first track with notes in 'tune.mid' to
+                     # 'a's scale and put it in slot 3 of 'a' (recall it
+                     # with '3'); add a track number to pick another track
 
 To quit pystepseq, hit CTRL-C, then type quit()
 """
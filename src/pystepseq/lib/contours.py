@@ -0,0 +1,148 @@
+"""Vectorized note and volume contour generators, used in place of the
+element-by-element Pystepseq._note_* and _vol_* methods when NumPy is
+installed. Each function builds a whole contour in a handful of array
+operations from a `numpy.random.Generator`, so passing a seeded generator
+makes the result reproducible.
+
+The semantics follow the pure Python versions: white and pink contours
+are reflected back into range, brown contours are random walks (built with
+a cumulative sum) folded back into range, a repeat copies the previous
+value, a tie is -1, and a space is a volume of 0.
+"""
+
+# NumPy is optional, and slow to import, so it is only imported when the
+# first Generator is asked for; every other function here takes one.
+numpy = None
+_looked_for_numpy = False
+
+
+def new_rng(seed=None):
+    """a NumPy random Generator, or None if NumPy isn't installed"""
+    global numpy, _looked_for_numpy
+    if not _looked_for_numpy:
+        _looked_for_numpy = True
+        try:
+            import numpy
+        except ImportError:
+            pass
+    if numpy is None:
+        return None
+    return numpy.random.default_rng(seed)
+
+
+def _reflect(values, top):
+    """bounce values that went over `top` or below 0 back into range once"""
+    values = numpy.where(values > top, 2 * top - values, values)
+    return numpy.abs(values)
+
+
+def _fold(values, top):
+    """fold an unbounded walk into 0..top, as if it bounced off the edges"""
+    if top <= 0:
+        return numpy.zeros_like(values)
+    values = numpy.mod(values, 2 * top)
+    return numpy.where(values > top, 2 * top - values, values)
+
+
+def _last_index(mask):
+    """for each position, the index of the last True in `mask` at or
+    before it, or -1 if there is none"""
+    idx = numpy.where(mask, numpy.arange(len(mask)), -1)
+    return numpy.maximum.accumulate(idx)
+
+
+def _chance(rng, percent, length):
+    """a mask that is True `percent` percent of the time, like the
+    `percent >= randint(1, 100)` tests in the Python versions"""
+    return rng.integers(1, 101, length) <= percent
+
+
+def _repeats_and_ties(rng, values, repeat, tie, prev):
+    """Apply the repeat and tie chances. A repeat copies the previous
+    value (even if that was a repeat itself) and a tie becomes -1; `prev`
+    is the value before the first element."""
+    repeats = _chance(rng, repeat, len(values))
+    ties = repeats & _chance(rng, tie, len(values))
+    values[ties] = -1
+    copies = repeats & ~ties
+    if copies.any():
+        src = _last_index(~copies)
+        values = numpy.where(src >= 0, values[numpy.maximum(src, 0)], prev)
+    return values
+
+
+def pink_noise(rng, number_of_dice, size_of_die):
+    """Voss pink noise, as lib.pink_noise.pink_noise: die `x` is re-rolled
+    every 2 ** x samples, and the sum is re-scaled so that min=0"""
+    length = 2**number_of_dice
+    total = numpy.zeros(length, dtype=numpy.int64)
+    for x in range(number_of_dice):
+        period = 2**x
+        rolls = rng.integers(1, size_of_die + 1, length // period)
+        total += numpy.repeat(rolls, period)
+    return total - total.min()
+
+
+def note_white(rng, length, size, depth, repeat, tie, prev):
+    midpoint = size // 2
+    values = midpoint + rng.integers(-depth, depth + 1, length)
+    values = _reflect(values, size)
+    return _repeats_and_ties(rng, values, repeat, tie, prev).tolist()
+
+
+def note_brown(rng, length, size, depth, repeat, tie, first):
+    """a walk that starts from `first`; repeats don't move and a tie
+    restarts the walk from -1, just like the Python version"""
+    offsets = rng.integers(-depth, depth + 1, length)
+    repeats = _chance(rng, repeat, length)
+    ties = repeats & _chance(rng, tie, length)
+    offsets[repeats] = 0
+    walk = numpy.cumsum(offsets)
+    last_tie = _last_index(ties)
+    walk = numpy.where(
+        last_tie >= 0, -1 + walk - walk[numpy.maximum(last_tie, 0)], first + walk
+    )
+    walk = _fold(walk, size)
+    walk[ties] = -1
+    return walk.tolist()
+
+
+def note_pink(rng, start, finish, size, depth, repeat, tie, prev):
+    number_of_dice = max(1, (finish - 1).bit_length())  # ceil(log2(finish))
+    noise = pink_noise(rng, number_of_dice, depth)
+    offset = -1 * (noise.max() // 2)
+    # (blah - 1) indexing, as in the Python version:
+    picks = noise[numpy.arange(start, finish) - 1]
+    values = _reflect(size // 2 + picks + offset, size)
+    return _repeats_and_ties(rng, values, repeat, tie, prev).tolist()
+
+
+def vol_white(rng, length, depth, space):
+    values = _reflect(64 + rng.integers(-depth, depth + 1, length), 127)
+    values[_chance(rng, space, length)] = 0
+    return values.tolist()
+
+
+def vol_brown(rng, length, depth, space, first):
+    """a walk that starts from `first`; a space is silent and the walk
+    picks up again from 0 after it"""
+    offsets = rng.integers(-depth, depth + 1, length)
+    spaces = _chance(rng, space, length)
+    walk = numpy.cumsum(offsets)
+    last_space = _last_index(spaces)
+    walk = numpy.where(
+        last_space >= 0, walk - walk[numpy.maximum(last_space, 0)], first + walk
+    )
+    walk = _fold(walk, 127)
+    walk[spaces] = 0
+    return walk.tolist()
+
+
+def vol_pink(rng, start, finish, depth, space):
+    number_of_dice = max(5, (finish - 1).bit_length())
+    noise = pink_noise(rng, number_of_dice, depth)
+    offset = -1 * (noise.max() // 2)
+    picks = noise[numpy.arange(start, finish) - 1]
+    values = _reflect(64 + picks + offset, 127)
+    values[_chance(rng, space, len(values))] = 0
+    return values.tolist()
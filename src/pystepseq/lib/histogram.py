@@ -0,0 +1,162 @@
+"""A small fixed-size, log-linear ("HDR-style") histogram for timing
+measurements. All of the buckets are allocated up front, so recording a
+value on a hot path never grows anything."""
+
+from array import array
+
+# each power of two is split into 2 ** SUB_BITS linear sub-buckets:
+SUB_BITS = 4
+SUB_COUNT = 1 << SUB_BITS
+# values (in nanoseconds) are clamped to just under 2 ** MAX_BITS, ~68 seconds:
+MAX_BITS = 36
+
+
+def bucket_index(value):
+    """map a non-negative integer to its bucket number"""
+    if value < 2 * SUB_COUNT:
+        return value
+    shift = value.bit_length() - (SUB_BITS + 1)
+    return shift * SUB_COUNT + (value >> shift)
+
+
+def bucket_floor(index):
+    """the smallest value that lands in bucket number `index`"""
+    if index < 2 * SUB_COUNT:
+        return index
+    shift = index // SUB_COUNT - 1
+    return (index % SUB_COUNT + SUB_COUNT) << shift
+
+
+class Histogram:
+    """Count integer samples (normally nanoseconds) into log-linear buckets
+    with a relative precision of about 1/16th."""
+
+    __slots__ = ["name", "counts", "count", "total", "min", "max", "_max_value"]
+
+    def __init__(self, name=""):
+        self.name = name
+        self._max_value = (1 << MAX_BITS) - 1
+        self.counts = array("Q", bytes(8 * (bucket_index(self._max_value) + 1)))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        elif value > self._max_value:
+            value = self._max_value
+        self.counts[bucket_index(value)] += 1
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct):
+        """approximate value below which `pct` percent of samples fall"""
+        if not self.count:
+            return 0
+        target = max(1, int(round(self.count * pct / 100.0)))
+        running = 0
+        for index, num in enumerate(self.counts):
+            running += num
+            if running >= target:
+                return min(bucket_floor(index), self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "buckets": {
+                bucket_floor(i): n for i, n in enumerate(self.counts) if n
+            },
+        }
+
+    def report(self, scale=1000, unit="us"):
+        """a printable summary, by default in microseconds"""
+        if not self.count:
+            return "%s: no samples" % self.name
+        return "%s: n=%i min=%.1f%s p50=%.1f%s p99=%.1f%s max=%.1f%s mean=%.1f%s" % (
+            self.name,
+            self.count,
+            self.min / scale,
+            unit,
+            self.percentile(50) / scale,
+            unit,
+            self.percentile(99) / scale,
+            unit,
+            self.max / scale,
+            unit,
+            self.mean() / scale,
+            unit,
+        )
+
+    def buckets_report(self, scale=1000, unit="us"):
+        """one line per populated bucket, with a little bar graph"""
+        lines = []
+        peak = max(self.counts) if self.count else 0
+        for index, num in enumerate(self.counts):
+            if num:
+                bar = "#" * max(1, int(40 * num / peak))
+                lines.append(
+                    ">=%10.1f%s %8i %s" % (bucket_floor(index) / scale, unit, num, bar)
+                )
+        return "\n".join(lines)
+
+
+class LoopStats:
+    """The timing histograms of a loop that follows the clock (a voice's
+    looper, or the Scheduler): how late it woke after a tick was sent, how
+    long after the tick was sent its MIDI went out, how long each tick's
+    work took, and how long switching slots took. Everything is allocated
+    here, so recording a tick allocates nothing."""
+
+    __slots__ = ["wake", "emit", "step", "switch"]
+
+    def __init__(self):
+        self.wake = Histogram("wake latency")
+        self.emit = Histogram("receive to emit")
+        self.step = Histogram("step time")
+        self.switch = Histogram("slot switch")
+
+    def tick(self, sent_ns, woke_ns, done_ns, emitted):
+        """record a tick that was sent at time.monotonic_ns() `sent_ns`,
+        received at `woke_ns` and dealt with by `done_ns`"""
+        self.step.record(done_ns - woke_ns)
+        age = woke_ns - sent_ns
+        if 0 <= age < 1000000000:  # a timestamp from another host's clock
+            self.wake.record(age)
+            if emitted:
+                self.emit.record(done_ns - sent_ns)
+
+    def histograms(self):
+        return [getattr(self, k) for k in self.__slots__]
+
+    def reset(self):
+        for histogram in self.histograms():
+            histogram.reset()
+
+    def as_dict(self):
+        return {k: getattr(self, k).as_dict() for k in self.__slots__}
+
+    def report(self, scale=1000, unit="us"):
+        return "\n".join(h.report(scale, unit) for h in self.histograms())
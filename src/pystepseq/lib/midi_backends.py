@@ -0,0 +1,158 @@
+"""MIDI output backends for midi_functions. A backend only has to provide
+`write_short`, `write` (a list of [[status, data1, data2], timestamp]
+events, as pyportmidi takes them), `write_sys_ex`, `close`, and `time`,
+the current time in ms in the time base of its timestamps.
+
+* PortMidiBackend talks to a real device through pyportmidi.
+* NullBackend throws everything away, for running without MIDI hardware.
+* RecordingBackend keeps the most recent events, timestamped, in a ring
+  buffer, for load tests and for checking event timing.
+* TeeBackend passes everything on to another backend and also hands the
+  short messages to a recorder (see smf.SmfRecorder).
+"""
+
+import time
+from array import array
+
+
+class PortMidiBackend:
+    """With a `latency` (in ms), PortMidi holds every event back until its
+    timestamp plus the latency, so the driver does the timing."""
+
+    def __init__(self, devnum, latency=0):
+        # imported here so that the other backends work without pyportmidi:
+        from pyportmidi import pm_init, PmOutput
+        from pyportmidi import _pyportmidi as pypm
+
+        pm_init()
+        if latency:
+            self.port = PmOutput(int(devnum), latency)
+        else:
+            self.port = PmOutput(int(devnum))
+        # PortMidi's own clock, which its timestamps and latency go by:
+        self._time = pypm.Time
+
+    def time(self):
+        return self._time()
+
+    def write_short(self, status, data1, data2=0):
+        self.port.write_short(status, data1, data2)
+
+    def write(self, events):
+        self.port.write(events)
+
+    def write_sys_ex(self, when, data):
+        self.port.write_sys_ex(when, data)
+
+    def close(self):
+        self.port.close()
+
+
+class NullBackend:
+    def __init__(self, devnum=None, latency=0):
+        pass
+
+    def write_short(self, status, data1, data2=0):
+        pass
+
+    def write(self, events):
+        pass
+
+    def write_sys_ex(self, when, data):
+        pass
+
+    def close(self):
+        pass
+
+    def time(self):
+        return 0
+
+
+class RecordingBackend:
+    """Records the last `size` short messages. Each one keeps the
+    time.monotonic_ns() at which it was written and the timestamp it was
+    written with (0 for write_short)."""
+
+    def __init__(self, devnum=None, latency=0, size=65536):
+        self.size = size
+        self.times = array("q", bytes(8 * size))
+        self.stamps = array("q", bytes(8 * size))
+        self.messages = array("L", bytes(array("L").itemsize * size))
+        self.count = 0  # total number of messages ever recorded
+
+    def _record(self, status, data1, data2, stamp):
+        i = self.count % self.size
+        self.times[i] = time.monotonic_ns()
+        self.stamps[i] = stamp
+        self.messages[i] = status | (data1 << 8) | (data2 << 16)
+        self.count += 1
+
+    def write_short(self, status, data1, data2=0):
+        self._record(status, data1, data2, 0)
+
+    def write(self, events):
+        for message, stamp in events:
+            self._record(message[0], message[1], message[2], stamp)
+
+    def write_sys_ex(self, when, data):
+        pass
+
+    def close(self):
+        pass
+
+    def time(self):
+        return time.monotonic_ns() // 1000000
+
+    def clear(self):
+        self.count = 0
+
+    def events(self):
+        """the recorded messages, oldest first, as
+        (time_ns, timestamp, status, data1, data2) tuples"""
+        first = max(0, self.count - self.size)
+        out = []
+        for n in range(first, self.count):
+            i = n % self.size
+            message = self.messages[i]
+            out.append(
+                (
+                    self.times[i],
+                    self.stamps[i],
+                    message & 0xFF,
+                    (message >> 8) & 0xFF,
+                    (message >> 16) & 0xFF,
+                )
+            )
+        return out
+
+
+class TeeBackend:
+    def __init__(self, backend, recorder):
+        self.backend = backend
+        self.recorder = recorder
+
+    def write_short(self, status, data1, data2=0):
+        self.backend.write_short(status, data1, data2)
+        self.recorder.put(status, data1, data2)
+
+    def write(self, events):
+        self.backend.write(events)
+        put = self.recorder.put
+        for message, stamp in events:
+            put(message[0], message[1], message[2])
+
+    def write_sys_ex(self, when, data):
+        self.backend.write_sys_ex(when, data)
+
+    def close(self):
+        self.backend.close()
+
+    def time(self):
+        return self.backend.time()
+
+
+backends = {
+    "portmidi": PortMidiBackend,
+    "null": NullBackend,
+    "recording": RecordingBackend,
+}
@@ -1,16 +1,50 @@
+import os
+import threading
+import time
 from operator import xor
 
-from pyportmidi import *
+from pystepseq import constants
+from pystepseq.lib.histogram import Histogram
+from pystepseq.lib.midi_backends import TeeBackend, backends
 
 
+# the output backend (see midi_backends), chosen by name when the port opens:
 _outport = None
+backend_name = os.getenv("PYSTEPSEQ_MIDI_BACKEND", "portmidi")
+
+# Batched output: while batching is on, the events produced during one
+# tick are filled into preallocated [[status, data1, data2], timestamp]
+# entries (the format pyportmidi's write() takes) and queued in `_batch`,
+# note-offs ahead of everything else, which `flush` sends with a single
+# write(). A full batch is flushed early, so a write never has more than
+# BATCH_SIZE events (PortMidi's limit for one call).
+BATCH_SIZE = 1024
+_batching = False
+_batch_time = 0  # timestamp (ms) given to the events of the current batch
+_batch = []
+_num_offs = 0  # how many of the events in _batch are note-offs
+_off_entries = [[[0, 0, 0], 0] for i in range(BATCH_SIZE)]
+_on_entries = [[[0, 0, 0], 0] for i in range(BATCH_SIZE)]  # note-ons and bends
+flush_latency = Histogram("midi flush")
+# with instrumentation on, unbatched writes are timed too (from every
+# looper thread at once, so the counts are approximate):
+instrument = constants.INSTRUMENT
+write_latency = Histogram("midi write")
+
+# Lookahead: with PYSTEPSEQ_LOOKAHEAD_MS set, every event is written with
+# the timestamp of the tick it belongs to, and the port is opened with that
+# many ms of latency, so the events come out exactly one window after
+# their ticks however late Python got around to sending them. The tick's
+# time is set per batch (set_batch_time) or, for looper threads, per thread
+# (set_event_time).
+lookahead_ms = int(os.getenv("PYSTEPSEQ_LOOKAHEAD_MS", "0"))
+_event_time = threading.local()
 
 
 def open_port(devnum):
     global _outport
     if not _outport:
-        pm_init()
-        _outport = PmOutput(int(devnum))
+        _outport = backends[backend_name](devnum, lookahead_ms)
         if _outport:
             print("Open successful")
         else:
@@ -19,10 +53,126 @@ def open_port(devnum):
         print("Port already opening; ignoring")
 
 
+def set_backend(backend, devnum=0):
+    """Replace the output backend, closing the old one. `backend` can be
+    a backend object or one of the names in midi_backends.backends."""
+    global _outport, backend_name
+    if _outport:
+        flush()
+        _outport.close()
+    if isinstance(backend, str):
+        backend_name = backend
+        _outport = backends[backend](devnum, lookahead_ms)
+    else:
+        _outport = backend
+    return _outport
+
+
+def get_backend():
+    return _outport
+
+
+def start_recording(filename):
+    """tee everything sent to the port into a MIDI file until
+    `stop_recording` is called"""
+    global _outport
+    from pystepseq.lib.smf import SmfRecorder
+
+    if isinstance(_outport, TeeBackend):
+        print("Already recording to %s" % _outport.recorder.filename)
+        return
+    recorder = SmfRecorder(filename)
+    recorder.start()
+    _outport = TeeBackend(_outport, recorder)
+
+
+def stop_recording():
+    global _outport
+    if not isinstance(_outport, TeeBackend):
+        return None
+    flush()
+    tee = _outport
+    _outport = tee.backend
+    tee.recorder.close()
+    return tee.recorder.filename
+
+
+def set_batching(on):
+    """turn per-tick batching of note and bend events on or off"""
+    global _batching
+    if _batching and not on:
+        flush()
+    _batching = on
+
+
+def tick_time(timestamp_ns):
+    """The backend time (ms) of a tick that the Tempotrigger sent at
+    time.monotonic_ns() `timestamp_ns`. A timestamp from another host's
+    clock can't be compared with ours, so then the tick counts as now."""
+    if _outport is None:
+        return 0  # no port open yet
+    age = time.monotonic_ns() - timestamp_ns
+    if not 0 <= age < 1000000000:
+        age = 0
+    return _outport.time() - age // 1000000
+
+
+def set_event_time(timestamp):
+    """set the timestamp (in ms) of this thread's unbatched events"""
+    _event_time.ms = timestamp
+
+
+def _write(status, data1, data2):
+    if instrument:
+        start = time.perf_counter_ns()
+    if lookahead_ms:
+        stamp = getattr(_event_time, "ms", None)
+        if stamp is None:
+            stamp = _outport.time()
+        _outport.write([[[status, data1, data2], stamp]])
+    else:
+        _outport.write_short(status, data1, data2)
+    if instrument:
+        write_latency.record(time.perf_counter_ns() - start)
+
+
+def set_batch_time(timestamp):
+    """set the timestamp (in ms) carried by the events of this batch"""
+    global _batch_time
+    _batch_time = timestamp
+
+
+def _fill(event, status, data1, data2):
+    message = event[0]
+    message[0] = status
+    message[1] = data1
+    message[2] = data2
+    event[1] = _batch_time
+    return event
+
+
+def flush():
+    """write out everything queued since the last flush in one call"""
+    global _num_offs
+    if not _batch:
+        return
+    start = time.perf_counter_ns()
+    _outport.write(_batch)
+    _batch.clear()
+    _num_offs = 0
+    flush_latency.record(time.perf_counter_ns() - start)
+
+
 def pitch_bend(channel, bend):
     low_byte = bend & 127
     high_byte = bend >> 7
-    _outport.write_short(0xE0 + channel, low_byte, high_byte)
+    if _batching:
+        if len(_batch) == BATCH_SIZE:
+            flush()
+        event = _on_entries[len(_batch) - _num_offs]
+        _batch.append(_fill(event, 0xE0 + channel, low_byte, high_byte))
+    else:
+        _write(0xE0 + channel, low_byte, high_byte)
 
 
 def pb(channel, bend):
@@ -31,11 +181,25 @@ def pb(channel, bend):
 
 
 def note_on(channel, note, volume):
-    _outport.note_on(note, volume, channel)
+    if _batching:
+        if len(_batch) == BATCH_SIZE:
+            flush()
+        event = _on_entries[len(_batch) - _num_offs]
+        _batch.append(_fill(event, 0x90 + channel, note, volume))
+    else:
+        _write(0x90 + channel, note, volume)
 
 
 def note_off(channel, note):
-    _outport.note_off(note, channel)
+    global _num_offs
+    if _batching:
+        if len(_batch) == BATCH_SIZE:
+            flush()
+        event = _fill(_off_entries[_num_offs], 0x80 + channel, note, 0)
+        _batch.insert(_num_offs, event)  # after the other note-offs
+        _num_offs += 1
+    else:
+        _write(0x80 + channel, note, 0)
 
 
 def program_change(channel, program):
@@ -74,7 +238,10 @@ MIDI SYSEX message to the open device"""
 
 
 def close_port():
+    global _outport
+    stop_recording()
     _outport.close()
+    _outport = None
 
 
 # standard midi file functions:
@@ -105,13 +272,13 @@ def read_var_length(fp):
 
 
 def write_var_length(var):
-    """ Take a numerical value, and convert it to a 7-bit packed string
+    """ Take a numerical value, and convert it to 7-bit packed bytes
     with high bit of each byte set as a flag to indicate to the reader that
     the value that follows in the following byte is to be consumed as well.
     """
     # Result goes into an array. Since we are starting with the least
     # significant byte, we will eventually have to reverse this to correctly
-    # order the output character bytes:
+    # order the output bytes:
     result_array = []
 
     # We have at least one value, right? :
@@ -128,13 +295,7 @@ def write_var_length(var):
     # Reverse the array, after all, we *did* put the least significant byte
     # in their first!
     result_array.reverse()
-
-    # Make an empty list of to gather the values appended as characters.
-    # Return the string-joined array:
-    hex_string_array = []
-    for n in result_array:
-        hex_string_array.append(chr(n))
-    return "".join(hex_string_array)
+    return bytes(result_array)
 
 
 # range protection functions:
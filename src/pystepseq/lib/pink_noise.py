@@ -1,15 +1,17 @@
 """Different applications of pink noise, the intended application being
 to make 'starter' melodic shapes"""
 
+import random
 from itertools import product
-from random import randint
 
 
-def pink_noise(number_of_dice, size_of_die):
-    """pink_noise(number_of_dice,size_of_die)
+def pink_noise(number_of_dice, size_of_die, rng=random):
+    """pink_noise(number_of_dice,size_of_die,rng=random)
     Return an array of pink noise base on the parameters, automatically
-    re-scaled so that min=0
+    re-scaled so that min=0. Pass a `random.Random` as `rng` for a
+    reproducible stream.
     """
+    randint = rng.randint
     array = []
     dice = []
     for x in range(number_of_dice):
@@ -3,8 +3,6 @@ for use with MIDI."""
 
 from math import log2
 
-from pystepseq.lib.midi_functions import see_saw
-
 
 perc_list = list(range(28, 52))
 perc_list.extend([54, 58, 59, 61, 67, 68, 69, 70, 73, 74, 75, 77, 78, 79, 80])
@@ -60,108 +58,102 @@ def cents(x):
     return log2(x) * 1200.00
 
 
-microtonal_vectors = {}
-
-microtonal_vectors["edo5"] = [note_and_bend(x / 5.0 * 1200.0) for x in range(-15, 20)]
-
-microtonal_vectors["otonal"] = [
-    note_and_bend(x)
-    for x in [
-        cents(y)
-        for y in [
-            1 / 4.0,
-            1 / 3.0,
-            3 / 8.0,
-            1 / 2.0,
-            2 / 3.0,
-            3 / 4.0,
-            1,
-            5 / 4.0,
-            3 / 2.0,
-            7 / 4.0,
-            2,
-            9 / 4.0,
-            5 / 2.0,
-            11 / 4.0,
-            3,
-            13 / 4.0,
-            14 / 4.0,
-            15 / 4.0,
-            4.0,
-        ]
-    ]
-]
-
-microtonal_vectors["utonal"] = [
-    note_and_bend(x)
-    for x in [
-        cents(y)
-        for y in [
-            1 / 4.0,
-            1 / 3.0,
-            3 / 8.0,
-            1 / 2.0,
-            2 / 3.0,
-            3 / 4.0,
-            1,
-            6 / 5.0,
-            3 / 2.0,
-            12 / 7.0,
-            2,
-            24 / 11.0,
-            12 / 5.0,
-            8 / 3.0,
-            3,
-            16 / 5.0,
-            24 / 7.0,
-            24 / 13.0,
-            4.0,
-        ]
-    ]
-]
-
-
-# an "overtone" scale that is based on 21\34-edo 8-note scale,
-# distributed freq-wise ala an overtone series.
-microtonal_vectors["fibotonal"] = [
-    note_and_bend(x)
-    for x in [
-        cents(y)
-        for y in [
-            0.125,
-            0.25,
-            0.3835926703400558,
-            0.5,
-            0.6256941028120465,
-            0.7671853406801116,
-            0.90308968739698,
-            1.0,
-            1.1771466939089177,
-            1.251388205624093,
-            1.3856743389806951,
-            1.5343706813602231,
-            1.6311419669655505,
-            1.80617937479396,
-            2.0,
-            2.1261380796451856,
-            2.3542933878178354,
-            2.502776411248185,
-            2.7713486779613903,
-            3.0687413627204454,
-            3.262283933931101,
-            3.6123587495879192,
-            4.0,
-            4.252276159290371,
-            4.708586775635671,
-            5.00555282249637,
-            5.542697355922781,
-            6.137482725440891,
-            6.524567867862202,
-            7.2247174991758385,
-            8.0,
-        ]
-    ]
-]
+# the microtonal scales' (note, bend) vectors are only worked out when a
+# scale is first used; the just scales are given as ratios to middle C.
+_microtonal_ratios = {
+    "otonal": [
+        1 / 4.0,
+        1 / 3.0,
+        3 / 8.0,
+        1 / 2.0,
+        2 / 3.0,
+        3 / 4.0,
+        1,
+        5 / 4.0,
+        3 / 2.0,
+        7 / 4.0,
+        2,
+        9 / 4.0,
+        5 / 2.0,
+        11 / 4.0,
+        3,
+        13 / 4.0,
+        14 / 4.0,
+        15 / 4.0,
+        4.0,
+    ],
+    "utonal": [
+        1 / 4.0,
+        1 / 3.0,
+        3 / 8.0,
+        1 / 2.0,
+        2 / 3.0,
+        3 / 4.0,
+        1,
+        6 / 5.0,
+        3 / 2.0,
+        12 / 7.0,
+        2,
+        24 / 11.0,
+        12 / 5.0,
+        8 / 3.0,
+        3,
+        16 / 5.0,
+        24 / 7.0,
+        24 / 13.0,
+        4.0,
+    ],
+    # an "overtone" scale that is based on 21\34-edo 8-note scale,
+    # distributed freq-wise ala an overtone series.
+    "fibotonal": [
+        0.125,
+        0.25,
+        0.3835926703400558,
+        0.5,
+        0.6256941028120465,
+        0.7671853406801116,
+        0.90308968739698,
+        1.0,
+        1.1771466939089177,
+        1.251388205624093,
+        1.3856743389806951,
+        1.5343706813602231,
+        1.6311419669655505,
+        1.80617937479396,
+        2.0,
+        2.1261380796451856,
+        2.3542933878178354,
+        2.502776411248185,
+        2.7713486779613903,
+        3.0687413627204454,
+        3.262283933931101,
+        3.6123587495879192,
+        4.0,
+        4.252276159290371,
+        4.708586775635671,
+        5.00555282249637,
+        5.542697355922781,
+        6.137482725440891,
+        6.524567867862202,
+        7.2247174991758385,
+        8.0,
+    ],
+}
+
+
+class _MicrotonalVectors(dict):
+    """microtonal scale name -> list of (note, bend), built on first use"""
+
+    def __missing__(self, name):
+        if name == "edo5":
+            vectors = [note_and_bend(x / 5.0 * 1200.0) for x in range(-15, 20)]
+        else:
+            vectors = [note_and_bend(cents(y)) for y in _microtonal_ratios[name]]
+        self[name] = vectors
+        return vectors
+
+
+microtonal_vectors = _MicrotonalVectors()
 
 
 # a place to keep our microtonal scales:
@@ -174,18 +166,56 @@ microtonal_scales = ["edo5", "otonal", "utonal", "fibotonal"]
 def create_scale(vectors_str, min=0, max=127):
     """Create a full-range scale in MIDI note numbers
     from a vector set and a range"""
+    key = (vectors_str, min, max)
+    if key in _scale_cache:
+        return _scale_cache[key]
     notes = [min]
     cur = min
     while cur <= max:
         for v in scale_vectors[vectors_str]:
             cur += v
             notes.append(cur)
+    _scale_cache[key] = notes
     return notes
 
 
+# scales built by create_scale, which are never changed in place:
+_scale_cache = {}
+
+
+# built slaves and lookup tables, shared by every MidiScale with the same
+# (scale name, min, max, trans); min and max are None when unfiltered.
+_table_cache = {}
+
+
+def _build_table(slave, trans, microtonal):
+    """Unroll `see_saw` over one full period of the slave scale, so that
+    `table[index % len(table)]` is what the old per-note lookup computed."""
+    top = len(slave) - 1
+    table = []
+    for f in range(max(2 * top, 1)):
+        if not slave:
+            break
+        i = f if f < top else 2 * top - f
+        if microtonal:
+            note, bend = slave[i]
+        else:
+            note = slave[i]
+        note = note + trans
+        if note < 0:
+            note = 0
+        elif note > 127:
+            note = 127
+        table.append((note, bend) if microtonal else note)
+    return tuple(table)
+
+
 class MidiScale:
     """Create a master scale object so we don't have to worry about range
     issues.  Folds in the bounce method, mode and transposition, etc.
+
+    Every scale change rebuilds `table`, which maps an index straight to
+    the output: a MIDI note, or a (note, bend) pair for microtonal scales.
     """
 
     def __init__(self, vectors_str="pent", min=48, max=72, trans=0):
@@ -193,24 +223,22 @@ class MidiScale:
         self.min = min if min >= 0 else 0
         self.max = max if max <= 127 else 127
         self.trans = trans
+        self.on_change = None  # called after every table rebuild
         self.set_scl(vectors_str)
 
     def set_scl(self, vectors_str):
+        self.name = vectors_str
+        self.microtonal = vectors_str in microtonal_scales
         if vectors_str in perc_scales:
             self.master_scale = scale_vectors[vectors_str]
-            self.slave = scale_vectors[vectors_str]
-            self.size = len(self.slave)
-            self.get_note = self._get_regular_note
-        elif vectors_str in microtonal_scales:
+            self._set_slave(None, None)
+        elif self.microtonal:
             self.master_scale = microtonal_vectors[vectors_str]
-            self.slave = microtonal_vectors[vectors_str]
-            self.size = len(self.slave)
-            self.min = self.slave[0][0]
-            self.max = self.slave[-1][0]
-            self.get_note = self._get_microtonal_note
+            self.min = self.master_scale[0][0]
+            self.max = self.master_scale[-1][0]
+            self._set_slave(None, None)
         else:
             self.master_scale = create_scale(vectors_str)
-            self.get_note = self._get_regular_note
             self._update_slave()
 
     def set_min_max_trans(self, min, max, trans):
@@ -243,25 +271,36 @@ class MidiScale:
         if self.min > self.max:
             self.min = 48
             self.max = 72
-        if self.get_note != self._get_microtonal_note:
-            self.slave = [n for n in self.master_scale if self.min <= n <= self.max]
-        else:
-            self.slave = [n for n in self.master_scale if self.min <= n[0] <= self.max]
+        self._set_slave(self.min, self.max)
+
+    def _set_slave(self, min, max):
+        """pick the notes between `min` and `max` (all of them if those are
+        None) and (re)build the lookup table, or reuse a cached one"""
+        key = (self.name, min, max, self.trans)
+        if key not in _table_cache:
+            if min is None:
+                slave = list(self.master_scale)
+            elif self.microtonal:
+                slave = [n for n in self.master_scale if min <= n[0] <= max]
+            else:
+                slave = [n for n in self.master_scale if min <= n <= max]
+            _table_cache[key] = slave, _build_table(slave, self.trans, self.microtonal)
+        self.slave, self.table = _table_cache[key]
         self.size = len(self.slave)
-
-    def _get_microtonal_note(self, input_int):
-        outnote, outbend = self.slave[see_saw(input_int, self.size - 1)]
-        outnote = outnote + self.trans
-        if outnote < 0:
-            outnote = 0
-        elif outnote > 127:
-            outnote = 127
-        return outnote, outbend
-
-    def _get_regular_note(self, input_int):
-        outnote = self.slave[see_saw(input_int, self.size - 1)] + self.trans
-        if outnote < 0:
-            outnote = 0
-        elif outnote > 127:
-            outnote = 127
-        return outnote
+        self.period = len(self.table) or 1
+        if self.on_change is not None:
+            self.on_change()
+
+    def get_note(self, input_int):
+        return self.table[int(input_int) % self.period]
+
+    def nearest_index(self, note):
+        """the scale index whose note comes closest to the MIDI note `note`"""
+        best, distance = 0, None
+        for i, n in enumerate(self.slave):
+            if self.microtonal:
+                n = n[0]
+            d = abs(n + self.trans - note)
+            if distance is None or d < distance:
+                best, distance = i, d
+        return best
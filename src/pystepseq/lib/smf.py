@@ -0,0 +1,422 @@
+"""Streaming Standard MIDI File output, and a fast reader.
+
+SmfWriter writes track chunks straight to the file as events come in and
+seeks back to patch each MTrk length (and the track count in the header)
+when the track is ended, so memory use doesn't grow with the length of the
+file. Tracks are written one after another: the offline renderer writes a
+whole voice at a time, and SmfRecorder streams a live session into a single
+track from a background thread.
+
+`read_smf` goes the other way: it memory-maps a file and decodes its note
+events from a memoryview, and `quantize_notes` turns one track's notes
+into the step lists of a voice. Runs of plain four byte events (a one
+byte delta and a status byte of their own, as SmfWriter writes them) are
+split into columns with bytes slicing, and notes are paired up by
+sorting, so only the odd event goes through the byte-by-byte decoder.
+"""
+
+import _thread
+import mmap
+import struct
+import time
+from collections import deque
+from itertools import accumulate, compress, repeat
+from operator import add, itemgetter, mul
+
+from pystepseq.lib.midi_functions import write_var_length
+
+# a division of 25 frames per second and 40 ticks per frame, i.e. 1 tick is
+# a millisecond; the frame rate is stored negated in the high byte.
+SMPTE_MS = ((256 - 25) << 8) | 40
+
+_FLUSH_SIZE = 65536  # bytes buffered before they are written out
+# deltas below this (the ones that encode in one or two bytes) have their
+# encoding cached, which bounds the cache at that many entries:
+_CACHED_DELTAS = 1 << 14
+
+
+class SmfWriter:
+    def __init__(self, filename, division=24, format=1):
+        self.file = open(filename, "wb")
+        self.division = division
+        self.format = format
+        self.num_tracks = 0
+        self._data = bytearray()
+        self._track_start = None  # file offset of the open track's length
+        self._last = 0  # tick of the last event on the open track
+        self._var_lengths = {}  # encoded short deltas, most of them repeat
+        self.file.write(b"MThd" + struct.pack(">IHHH", 6, format, 0, division))
+
+    def _delta(self, tick):
+        delta = tick - self._last
+        self._last = tick
+        try:
+            return self._var_lengths[delta]
+        except KeyError:
+            encoded = write_var_length(delta)
+            if delta < _CACHED_DELTAS:
+                self._var_lengths[delta] = encoded
+            return encoded
+
+    def _flush(self):
+        self.file.write(self._data)
+        self._data.clear()
+
+    def start_track(self, name=None):
+        if self._track_start is not None:
+            self.end_track()
+        self._flush()
+        self.file.write(b"MTrk\x00\x00\x00\x00")
+        self._track_start = self.file.tell()
+        self._last = 0
+        self.num_tracks += 1
+        if name is not None:
+            self.meta(0, 0x03, str(name).encode("latin-1", "replace"))
+
+    def event(self, tick, status, data1, data2=0):
+        data = self._data
+        data += self._delta(tick)
+        if status & 0xE0 == 0xC0:  # program change and channel pressure
+            data += bytes((status, data1))
+        else:
+            data += bytes((status, data1, data2))
+        if len(data) >= _FLUSH_SIZE:
+            self._flush()
+
+    def events(self, events):
+        """write an iterable of time-ordered (tick, status, data1, data2)
+        channel messages; a quicker way of calling `event` for each"""
+        data = self._data
+        delta = self._delta
+        for tick, status, data1, data2 in events:
+            data += delta(tick)
+            data.append(status)
+            data.append(data1)
+            if status & 0xE0 != 0xC0:  # not a two-byte message
+                data.append(data2)
+            if len(data) >= _FLUSH_SIZE:
+                self._flush()
+
+    def meta(self, tick, kind, payload):
+        self._data += (
+            self._delta(tick)
+            + bytes((0xFF, kind))
+            + write_var_length(len(payload))
+            + bytes(payload)
+        )
+
+    def tempo(self, tick, bpm):
+        self.meta(tick, 0x51, int(60000000 / bpm).to_bytes(3, "big"))
+
+    def end_track(self, tick=None):
+        """end the open track (at `tick`, if given) and patch its length"""
+        if self._track_start is None:
+            return
+        self.meta(self._last if tick is None else max(tick, self._last), 0x2F, b"")
+        self._flush()
+        end = self.file.tell()
+        self.file.seek(self._track_start - 4)
+        self.file.write(struct.pack(">I", end - self._track_start))
+        self.file.seek(end)
+        self._track_start = None
+
+    def close(self):
+        self.end_track()
+        self.file.seek(10)
+        self.file.write(struct.pack(">H", self.num_tracks))
+        self.file.close()
+
+
+class SmfRecorder:
+    """Streams the MIDI messages handed to `put` into a format 0 file with
+    millisecond ticks. `put` only appends to a deque, so it is cheap enough
+    to call from the looper; a background thread drains the deque and does
+    the writing."""
+
+    def __init__(self, filename, interval=0.05):
+        self.filename = filename
+        self.interval = interval
+        self.queue = deque()
+        self.writer = SmfWriter(filename, SMPTE_MS, format=0)
+        self.writer.start_track()
+        self.runstate = 0
+        self._start_ns = time.monotonic_ns()
+        self._done = _thread.allocate_lock()
+
+    def put(self, status, data1, data2=0):
+        self.queue.append((time.monotonic_ns(), status, data1, data2))
+
+    def _drain(self):
+        queue = self.queue
+        writer = self.writer
+        start = self._start_ns
+        while queue:
+            when, status, data1, data2 = queue.popleft()
+            writer.event((when - start) // 1000000, status, data1, data2)
+
+    def _loop(self):
+        while self.runstate == 1:
+            self._drain()
+            time.sleep(self.interval)
+        self._done.release()
+
+    def start(self):
+        if self.runstate == 0:
+            self.runstate = 1
+            self._done.acquire()
+            _thread.start_new_thread(self._loop, ())
+
+    def close(self):
+        """stop the writer thread, write out what's left and close the file"""
+        if self.runstate == 1:
+            self.runstate = 0
+            self._done.acquire()
+            self._done.release()
+        self._drain()
+        self.writer.close()
+
+
+# reading:
+
+
+def _var_length(buf, pos):
+    """decode the variable-length quantity at `pos`; returns (value, pos)"""
+    value = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+# byte translation tables, for working on whole columns at once:
+_HIGH = bytes(b >= 0x80 for b in range(256))
+# not the status of a three byte channel message:
+_NOT_STATUS3 = bytes(not (0x80 <= b < 0xC0 or 0xE0 <= b < 0xF0) for b in range(256))
+_IS_NOTE = bytes(0x80 <= b < 0xA0 for b in range(256))  # note on or off
+_IS_NOTE_ON = bytes(0x90 <= b < 0xA0 for b in range(256))
+_NONZERO = bytes(b != 0 for b in range(256))
+_CHANNEL = bytes(b & 0x0F for b in range(256))
+
+
+def _plain_runs(body):
+    """For each of the four byte offsets `phase`, which of the four byte
+    groups at phase + 4 * n of `body` are NOT a plain event: a one byte
+    delta, the status of a three byte channel message and two data
+    bytes. One byte per group, 1 where it isn't."""
+    high = body.translate(_HIGH)
+    not_status = body.translate(_NOT_STATUS3)
+    runs = []
+    for phase in range(4):
+        count = (len(body) - phase) // 4
+        bad = 0
+        for column, offset in ((high, 0), (not_status, 1), (high, 2), (high, 3)):
+            start = phase + offset
+            bad |= int.from_bytes(column[start : start + 4 * count : 4], "big")
+        runs.append(bad.to_bytes(count, "big") + b"\x01")  # the end stops a run
+    return runs
+
+
+def _read_events(buf, pos, end):
+    """The channel events of one track chunk, as columns: returns the
+    tick the track ends on, a list of the events' ticks, and bytes of
+    their status bytes and first and second data bytes."""
+    body = bytes(buf[pos:end])
+    runs = _plain_runs(body)
+    ticks = []
+    statuses = bytearray()
+    data1 = bytearray()
+    data2 = bytearray()
+    tick = 0
+    status = 0
+    pos = 0
+    end = len(body)
+    while pos < end:
+        group = pos // 4
+        count = runs[pos % 4].find(b"\x01", group) - group
+        if count:
+            stop = pos + 4 * count
+            run_ticks = list(accumulate(body[pos:stop:4], initial=tick))
+            tick = run_ticks.pop()
+            ticks += run_ticks[1:] + [tick]
+            statuses += body[pos + 1 : stop : 4]
+            data1 += body[pos + 2 : stop : 4]
+            data2 += body[pos + 3 : stop : 4]
+            status = body[stop - 3]
+            pos = stop
+            continue
+        # anything else, one event at a time:
+        delta, pos = _var_length(body, pos)
+        tick += delta
+        byte = body[pos]
+        if byte == 0xFF:  # meta event
+            length, pos = _var_length(body, pos + 2)
+            pos += length
+            continue
+        if byte == 0xF0 or byte == 0xF7:  # sysex
+            length, pos = _var_length(body, pos + 1)
+            pos += length
+            continue
+        if byte >= 0x80:
+            status = byte
+            pos += 1
+        ticks.append(tick)
+        statuses.append(status)
+        data1.append(body[pos])
+        if status & 0xE0 == 0xC0:  # program change and channel pressure
+            data2.append(0)
+            pos += 1
+        else:
+            data2.append(body[pos + 1])
+            pos += 2
+    return tick, ticks, bytes(statuses), bytes(data1), bytes(data2)
+
+
+def _pair_notes(ticks, statuses, data1, data2):
+    """Pair up note-ons with their note-offs, for a track where every
+    note-on is followed by its note-off before the same note starts
+    again: by position if each note ends before the next starts, as in a
+    melody line, or else by sorting on channel and note. Returns None for
+    any other track."""
+    selected = statuses.translate(_IS_NOTE)
+    if selected.count(1) != len(selected):
+        ticks = list(compress(ticks, selected))
+        statuses = bytes(compress(statuses, selected))
+        data1 = bytes(compress(data1, selected))
+        data2 = bytes(compress(data2, selected))
+    count = len(ticks)
+    if count % 2:
+        return None
+    channels = statuses.translate(_CHANNEL)
+    ons = statuses.translate(_IS_NOTE_ON)
+    ons = (
+        int.from_bytes(ons, "big") & int.from_bytes(data2.translate(_NONZERO), "big")
+    ).to_bytes(count, "big")
+    pairs = b"\x01\x00" * (count // 2)
+    if ons == pairs and channels[0::2] == channels[1::2] and data1[0::2] == data1[1::2]:
+        notes = list(
+            zip(ticks[0::2], ticks[1::2], channels[0::2], data1[0::2], data2[0::2])
+        )
+        notes.sort()
+        return notes
+    keys = list(map(add, map(mul, channels, repeat(128)), data1))
+    # stable, so each note's events stay in time order:
+    order = sorted(range(count), key=keys.__getitem__)
+    if bytes(itemgetter(*order)(ons)) != pairs:
+        return None
+    starts = itemgetter(*order[0::2])
+    stops = itemgetter(*order[1::2])
+    if starts(keys) != stops(keys):
+        return None
+    notes = list(
+        zip(starts(ticks), stops(ticks), starts(channels), starts(data1), starts(data2))
+    )
+    notes.sort()
+    return notes
+
+
+def _read_notes(buf, pos, end):
+    """the notes of one track chunk, as (start, stop, channel, note,
+    velocity) tuples in order of their start"""
+    end_tick, ticks, statuses, data1, data2 = _read_events(buf, pos, end)
+    notes = _pair_notes(ticks, statuses, data1, data2)
+    if notes is not None:
+        return notes
+    # overlapping or unfinished notes, one event at a time:
+    notes = []
+    append = notes.append
+    sounding = {}  # channel << 8 | note -> (start, velocity)
+    for tick, status, note, velocity in zip(ticks, statuses, data1, data2):
+        kind = status & 0xF0
+        if kind == 0x90 or kind == 0x80:
+            key = (status & 0x0F) << 8 | note
+            started = sounding.pop(key, None)
+            if started is not None:  # a note-off, or re-struck before one
+                append((started[0], tick, key >> 8, note, started[1]))
+            if kind == 0x90 and velocity:
+                sounding[key] = (tick, velocity)
+    for key, (start, velocity) in sounding.items():
+        append((start, end_tick, key >> 8, key & 0x7F, velocity))
+    notes.sort()
+    return notes
+
+
+def read_smf(filename, track=None):
+    """Read a Standard MIDI File. Returns (format, division, tracks), where
+    tracks is a list with the notes of each track (see `_read_notes`). If
+    `track` is given, only that track (counting from 0) is decoded, and
+    otherwise only the tracks up to the first one with notes in it; the
+    others are skipped over by their chunk lengths and come back empty."""
+    with open(filename, "rb") as fp:
+        try:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # an empty file
+            raise ValueError("%s is not a MIDI file" % filename)
+    with mapped, memoryview(mapped) as buf:
+        if buf[:4] != b"MThd":
+            raise ValueError("%s is not a MIDI file" % filename)
+        header_len, format, num_tracks, division = struct.unpack_from(">IHHH", buf, 4)
+        pos = 8 + header_len
+        tracks = []
+        found = False
+        while pos + 8 <= len(buf) and len(tracks) < num_tracks:
+            kind, length = struct.unpack_from(">4sI", buf, pos)
+            pos += 8
+            end = min(pos + length, len(buf))
+            if kind != b"MTrk":  # unknown chunks are skipped
+                pos = end
+                continue
+            if track == len(tracks) or (track is None and not found):
+                tracks.append(_read_notes(buf, pos, end))
+                found = bool(tracks[-1])
+            else:
+                tracks.append([])
+            pos = end
+    return format, division, tracks
+
+
+def quantize_notes(notes, division, triggers_per_beat, scale):
+    """Turn notes (as from `read_smf`) into a voice's step lists, returned
+    as a dict of len_list, note_list, vol_list and gate_list. Times are
+    converted from file ticks to triggers, each note becomes the index of
+    the nearest note in `scale`, and the gap up to the next note is folded
+    into the step's length and gate. Only the highest note of a chord is
+    kept, since a voice plays one note at a time."""
+    if division & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+    ratio = triggers_per_beat / division
+    # the highest note at each start time:
+    chords = {}
+    for start, stop, channel, note, velocity in notes:
+        start = int(round(start * ratio))
+        stop = int(round(stop * ratio))
+        if start not in chords or note > chords[start][1]:
+            chords[start] = (stop, note, velocity)
+    lens, note_list, vols, gates = [], [], [], []
+    indexes = {}
+    starts = sorted(chords)
+    if starts and starts[0] > 0:
+        # a silent step for the time before the first note:
+        lens.append(starts[0])
+        note_list.append(0)
+        vols.append(0)
+        gates.append(100)
+    for i, start in enumerate(starts):
+        stop, note, velocity = chords[start]
+        if i + 1 < len(starts):
+            length = starts[i + 1] - start
+        else:
+            length = max(stop - start, 1)
+        if note not in indexes:
+            indexes[note] = scale.nearest_index(note)
+        lens.append(length)
+        note_list.append(indexes[note])
+        vols.append(velocity)
+        gates.append(max(1, min(100, int(round(100 * (stop - start) / length)))))
+    return {
+        "len_list": lens,
+        "note_list": note_list,
+        "vol_list": vols,
+        "gate_list": gates,
+    }
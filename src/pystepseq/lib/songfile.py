@@ -0,0 +1,278 @@
+"""A compact binary song format, as an alternative to the JSON that
+save_song writes.
+
+A file starts with a header (magic, format version, flags and the number
+of slots stored), followed by an index table with one entry per non-empty
+slot: the voice name, the slot number, and where the slot's record is and
+how long it is. The records follow. A record holds the slot's numbers and
+strings, then its four lists as array columns (int32, or float64 if a list
+holds anything but whole numbers) in little-endian order. With the
+compression flag set, each record is zlib-compressed on its own.
+
+Since version 2, a record also says which of its numbers are missing
+(None), and a seed too big for 64 bits is stored as text after the
+strings. Version 1 files are still read.
+
+Because of the index, a slot can be read without touching the others:
+SongFile memory-maps the file and hands out SlotRef objects, which are
+only decoded when a voice actually needs them.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from types import SimpleNamespace
+
+MAGIC = b"PSSQ"
+VERSION = 2
+FLAG_ZLIB = 1
+
+_HEADER = struct.Struct("!4sHHI")  # magic, version, flags, number of entries
+_ENTRY = struct.Struct("!HQII")  # slot, offset, stored length, raw length
+
+_INTS = [
+    "chn",
+    "end",
+    "triggers_per_beat",
+    "beats_per_measure",
+    "scl_min",
+    "scl_max",
+    "scl_trans",
+    "note_depth",
+    "note_repeat",
+    "note_tie",
+    "vol_depth",
+    "space",
+]
+_STRINGS = ["scl", "note_noise", "vol_noise"]
+_COLUMNS = ["len_list", "vol_list", "gate_list", "note_list"]
+# the ints, a bit per int that is None, how the seed is stored, the seed:
+_SCALARS = struct.Struct("!%diIBq" % len(_INTS))
+_SCALARS_V1 = struct.Struct("!%diBq" % len(_INTS))  # without the None bits
+_SEED_NONE, _SEED_INT64, _SEED_TEXT = range(3)
+_INT64_MIN, _INT64_MAX = -(2**63), 2**63 - 1
+_STRING = struct.Struct("!H")
+_COLUMN = struct.Struct("!cI")  # typecode, count
+
+_SWAP = sys.byteorder == "big"  # columns are stored little-endian
+
+
+def is_song_file(filename):
+    """whether `filename` is a binary song file (rather than JSON)"""
+    try:
+        with open(filename, "rb") as fp:
+            return fp.read(4) == MAGIC
+    except OSError:
+        return False
+
+
+def encode_slot(slot):
+    """pack the saveable fields of `slot` (anything with the DataSlot
+    attributes) into a record"""
+    ints = [getattr(slot, k) for k in _INTS]
+    missing = 0
+    for i, value in enumerate(ints):
+        if value is None:
+            missing |= 1 << i
+            ints[i] = 0
+        else:
+            ints[i] = int(value)
+    seed = slot.seed
+    if seed is None:
+        seed_kind = _SEED_NONE
+    elif _INT64_MIN <= seed <= _INT64_MAX:
+        seed_kind = _SEED_INT64
+    else:
+        seed_kind = _SEED_TEXT
+    out = bytearray(
+        _SCALARS.pack(*ints, missing, seed_kind, seed if seed_kind == _SEED_INT64 else 0)
+    )
+    strings = [str(getattr(slot, k)) for k in _STRINGS]
+    if seed_kind == _SEED_TEXT:
+        strings.append(str(seed))
+    for string in strings:
+        encoded = string.encode("utf-8")
+        out += _STRING.pack(len(encoded)) + encoded
+    for k in _COLUMNS:
+        values = getattr(slot, k)
+        if all(isinstance(v, int) or float(v).is_integer() for v in values):
+            column = array("i", [int(v) for v in values])
+        else:
+            column = array("d", values)
+        if _SWAP:
+            column.byteswap()
+        out += _COLUMN.pack(column.typecode.encode("ascii"), len(column))
+        out += column.tobytes()
+    return bytes(out)
+
+
+def _read_string(record, pos):
+    """the string at `pos` in `record`, and the position after it"""
+    (length,) = _STRING.unpack_from(record, pos)
+    pos += _STRING.size
+    return bytes(record[pos : pos + length]).decode("utf-8"), pos + length
+
+
+def decode_slot(record, version=VERSION):
+    """unpack a record (from a file of format `version`) into a dict of
+    DataSlot fields"""
+    record = memoryview(record)
+    if version == 1:
+        values = _SCALARS_V1.unpack_from(record, 0)
+        missing = 0
+        pos = _SCALARS_V1.size
+    else:
+        values = _SCALARS.unpack_from(record, 0)
+        missing = values[len(_INTS)]
+        pos = _SCALARS.size
+    fields = {}
+    for i, k in enumerate(_INTS):
+        fields[k] = None if missing & (1 << i) else values[i]
+    seed_kind, seed = values[-2:]
+    for k in _STRINGS:
+        fields[k], pos = _read_string(record, pos)
+    if seed_kind == _SEED_TEXT:
+        seed, pos = _read_string(record, pos)
+        seed = int(seed)
+    fields["seed"] = seed if seed_kind else None
+    for k in _COLUMNS:
+        typecode, count = _COLUMN.unpack_from(record, pos)
+        pos += _COLUMN.size
+        column = array(typecode.decode("ascii"))
+        size = count * column.itemsize
+        column.frombytes(record[pos : pos + size])
+        if _SWAP:
+            column.byteswap()
+        fields[k] = column.tolist()
+        pos += size
+    return fields
+
+
+class SlotRef:
+    """A slot that is still sitting in a song file. `load` reads and
+    decodes it into a dict of DataSlot fields."""
+
+    __slots__ = ["song", "name", "num"]
+
+    def __init__(self, song, name, num):
+        self.song = song
+        self.name = name
+        self.num = num
+
+    def load(self):
+        return self.song.read_slot(self.name, self.num)
+
+
+class SongFile:
+    """A binary song file opened for reading. Only the header and index
+    are read up front; slots are read from the memory-mapped file as they
+    are asked for, so it has to stay open for as long as any of its
+    SlotRefs are in use. It can be used as a context manager."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.flags, count = _HEADER.unpack_from(self._map, 0)
+        self.version = version
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("%s is not a pystepseq song file" % filename)
+        if version > VERSION:
+            self.close()
+            raise ValueError("%s is from a newer version of pystepseq" % filename)
+        self.index = {}  # voice name -> {slot: (offset, stored, raw length)}
+        pos = _HEADER.size
+        for i in range(count):
+            length = self._map[pos]
+            name = self._map[pos + 1 : pos + 1 + length].decode("utf-8")
+            pos += 1 + length
+            slot, offset, stored, raw = _ENTRY.unpack_from(self._map, pos)
+            pos += _ENTRY.size
+            self.index.setdefault(name, {})[slot] = (offset, stored, raw)
+
+    def voices(self):
+        return list(self.index)
+
+    def slot_refs(self, name, num_slots=16):
+        """a list of slots for voice `name`: a SlotRef where the file
+        has data, None elsewhere"""
+        refs = [None] * num_slots
+        for num in self.index.get(name, ()):
+            if num < num_slots:
+                refs[num] = SlotRef(self, name, num)
+        return refs
+
+    def raw_slot(self, name, num):
+        """the record of a slot as stored, compressed or not"""
+        offset, stored, raw = self.index[name][num]
+        return self._map[offset : offset + stored]
+
+    def read_slot(self, name, num):
+        record = self.raw_slot(name, num)
+        if self.flags & FLAG_ZLIB:
+            record = zlib.decompress(record)
+        return decode_slot(record, self.version)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_song(filename, voices, compress=False):
+    """Write `voices`, a dict of voice name -> list of slots, as a binary
+    song file. A slot can be a DataSlot, a SlotRef (copied across without
+    decoding it, when the compression matches), or None or an empty
+    DataSlot, which are left out. The file is written next to `filename`
+    and then moved over it, so that a SongFile still mapping the old file
+    keeps working."""
+    flags = FLAG_ZLIB if compress else 0
+    entries = []
+    records = []
+    for name, slots in voices.items():
+        for num, slot in enumerate(slots):
+            if slot is None:
+                continue
+            if isinstance(slot, SlotRef):
+                if slot.song.flags == flags and slot.song.version == VERSION:
+                    record = slot.song.raw_slot(slot.name, slot.num)
+                    raw = slot.song.index[slot.name][slot.num][2]
+                    records.append(record)
+                    entries.append((name, num, len(record), raw))
+                    continue
+                fields = slot.load()
+                record = encode_slot(SimpleNamespace(**fields))
+            elif not slot.note_list:
+                continue
+            else:
+                record = encode_slot(slot)
+            raw = len(record)
+            if compress:
+                record = zlib.compress(record)
+            records.append(record)
+            entries.append((name, num, len(record), raw))
+    index = bytearray()
+    offset = _HEADER.size
+    for name, num, stored, raw in entries:
+        offset += 1 + len(name.encode("utf-8")) + _ENTRY.size
+    for name, num, stored, raw in entries:
+        encoded = name.encode("utf-8")
+        index += bytes((len(encoded),)) + encoded
+        index += _ENTRY.pack(num, offset, stored, raw)
+        offset += stored
+    tmpname = filename + ".tmp"
+    with open(tmpname, "wb") as outfile:
+        outfile.write(_HEADER.pack(MAGIC, VERSION, flags, len(entries)))
+        outfile.write(index)
+        for record in records:
+            outfile.write(record)
+    os.replace(tmpname, filename)
+
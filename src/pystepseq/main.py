@@ -20,64 +20,190 @@
 #       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #       MA 02110-1301, USA.
 
-import pickle
-import re
-from pathlib import Path
-
-import json
-from readline import *  # noqa
+import os
+from functools import lru_cache
 
 # my modules:
+from . import constants
 from .help import help
-from .pystepseq import Pystepseq
+from .pystepseq import DataSlot, Pystepseq
+from .render import render_song
+from .scheduler import Scheduler
 from .tempotrigger import Tempotrigger
+from .transaction import Transaction
+from .workers import WorkerPool
+from pystepseq.lib import midi_functions, songfile
+from pystepseq.lib.histogram import LoopStats
 from pystepseq.lib.pink_noise import fractal_melody
-from pystepseq.lib.scales import *  # noqa
 
 # a dict which hosts object instances so we can manipulate
 # multiple parameters of multiple instances simultaneously
 active_instances = {}
 
+# in "scheduler" engine mode, one Scheduler steps every voice we create:
+scheduler = Scheduler() if constants.ENGINE == "scheduler" else None
 
-with open(Path(__file__).parent.parent.parent / "pyproject.toml") as toml_file:
-    txt = toml_file.read()
-    version_found = re.search(r'version = "(.*?)"', txt).group(1)
-    PROMPT = f"pystepseq-{version_found} ('h' for help) --> "
+# with PYSTEPSEQ_WORKERS set, the voices live in worker processes instead
+# (see workers.py), and this is the pool that hosts them:
+workers = None
 
+# the binary song file last loaded, which voices may still read slots from:
+current_song = None
+
+
+def get_version():
+    """the installed version of pystepseq, from the package metadata"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("pystepseq")
+    except PackageNotFoundError:  # running from a source tree
+        return "dev"
+
+
+# parsing values typed at the prompt. Plain literals go through
+# ast.literal_eval; anything else (like `[x^17 - 34 for x in range(32)]`)
+# must be arithmetic, comprehensions and a few harmless builtins, which is
+# checked before it is evaluated.
+_VALUE_NAMES = {
+    "range": range,
+    "len": len,
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "int": int,
+    "round": round,
+    "sum": sum,
+    "list": list,
+    "reversed": reversed,
+    "sorted": sorted,
+}
+# the ast node types (by name) that such an expression may use:
+_VALUE_NODES = [
+    "Expression",
+    "Constant",
+    "List",
+    "Tuple",
+    "Name",
+    "Load",
+    "Store",
+    "BinOp",
+    "UnaryOp",
+    "BoolOp",
+    "Compare",
+    "IfExp",
+    "operator",
+    "unaryop",
+    "boolop",
+    "cmpop",
+    "ListComp",
+    "comprehension",
+    "Call",
+    "Subscript",
+    "Slice",
+]
+# `**` is allowed too, within these bounds (see _power):
+_MAX_EXPONENT = 64
+_MAX_POWER_BITS = 1024
+
+
+@lru_cache(maxsize=512)
+def _parse_value(text):
+    import ast  # only once something needs parsing, to keep startup quick
+
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        tree = ast.parse(text.strip(), mode="eval")
+    allowed = tuple(getattr(ast, name) for name in _VALUE_NODES)
+    bound = set(_VALUE_NAMES)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.comprehension):
+            targets = ast.walk(node.target)
+            bound.update(n.id for n in targets if isinstance(n, ast.Name))
+    for node in ast.walk(tree):
+        if not isinstance(node, allowed):
+            raise ValueError("%s is not allowed here" % type(node).__name__)
+        if isinstance(node, ast.Name) and node.id not in bound:
+            raise NameError("name %r is not defined" % node.id)
+        if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+            raise ValueError("only %s can be called" % ", ".join(_VALUE_NAMES))
+    code = compile(_calls_for_powers(tree), "<input>", "eval")
+    return eval(code, {"__builtins__": {}, "_power": _power, **_VALUE_NAMES})
+
+
+def _power(base, exponent):
+    """`base ** exponent`, unless the result would be uselessly huge
+    (and slow to compute): there's no call for such numbers here"""
+    if abs(exponent) > _MAX_EXPONENT:
+        raise ValueError("exponents go up to %i" % _MAX_EXPONENT)
+    # (an int of n bits, to the power e, has at most n * e bits)
+    if isinstance(base, int) and base.bit_length() * exponent > _MAX_POWER_BITS:
+        raise ValueError("%r ** %r is too large" % (base, exponent))
+    try:
+        return base**exponent
+    except OverflowError:  # from floats
+        raise ValueError("%r ** %r is too large" % (base, exponent))
 
-def setup_drums():
-    from scales import TR808
 
+def _calls_for_powers(tree):
+    """`tree` with each `a ** b` in it turned into `_power(a, b)`"""
+    import ast
+
+    class PowersToCalls(ast.NodeTransformer):
+        def visit_BinOp(self, node):
+            self.generic_visit(node)
+            if not isinstance(node.op, ast.Pow):
+                return node
+            func = ast.Name("_power", ast.Load())
+            call = ast.Call(func, [node.left, node.right], [])
+            return ast.copy_location(call, node)
+
+    return ast.fix_missing_locations(PowersToCalls().visit(tree))
+
+
+def parse_value(text):
+    """the value of `text`, typed as a voice's list or a number.
+    Results are cached, so a macro fired over and over is only parsed
+    once; lists come back as fresh copies."""
+    value = _parse_value(text)
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, tuple):
+        return tuple(list(v) if isinstance(v, list) else v for v in value)
+    return value
+
+
+def setup_drums():
     # bass drum sound:
-    active_instances["z"] = Pystepseq(10)
+    active_instances["z"] = Pystepseq(10, scheduler=scheduler)
     z = active_instances["z"]
-    z._scl.set_scl(TR808)
+    z._scl.set_scl("TR808")
     z._scl.set_min_max_trans(36, 60, 0)
     z.len_list = [24]
     z.note_list = [0]
     z.vol_list = [80]
     # other drums:
-    active_instances["x"] = Pystepseq(10)
+    active_instances["x"] = Pystepseq(10, scheduler=scheduler)
     x = active_instances["x"]
-    x._scl.set_scl(TR808)
+    x._scl.set_scl("TR808")
     x._scl.set_min_max_trans(36, 60, 0)
     x.len_list = [6]
     x.randomize_drums()
 
 
-def change(instances, notes=1, vols=1, lengths=1, gates=1):
+def change(instances, notes=1, vols=1, lengths=1, gates=1, together=False):
     """section(instances, notes=1, vols=1, lengths=1)
-    allows for the simultaneous changing of all pystepseq objects parameters
+    allows for the simultaneous changing of all pystepseq objects parameters;
+    each switches as its pattern comes round, or with `together`, they all
+    switch at the next cycle boundary
     """
+    transaction = Transaction(trig, scheduler)
     for i in instances:
-        if notes:
-            active_instances[i].randomize_notes()
-        if vols:
-            active_instances[i].randomize_volumes()
-        if lengths:
-            active_instances[i].randomize_lengths()
-        if gates:
-            active_instances[i].randomize_gates()
+        voice = active_instances[i]
+        # a pre-rolled variation is much cheaper than generating afresh:
+        transaction.stage(voice, **voice.variation(notes, vols, lengths, gates))
+    transaction.commit(together)
 
 
 def slot_queue_save(slot_num):
@@ -85,29 +211,147 @@ def slot_queue_save(slot_num):
         i.data_slot_save(slot_num)
 
 
-def slot_queue_recall(slot_num):
+def slot_queue_recall(slot_num, together=False):
+    """switch every voice to slot `slot_num` as its pattern comes round, or
+    with `together`, all of them at the next cycle boundary"""
+    if not together:
+        for i in active_instances.values():
+            i.data_slot_recall(slot_num)
+        return
+    transaction = Transaction(trig, scheduler)
     for i in active_instances.values():
-        i.data_slot_recall(slot_num)
+        transaction.recall(i, slot_num)
+    transaction.commit(together)
+
+
+def change_command(comm):
+    together = comm.endswith("!")
+    names = comm[1:].rstrip("!").split(",")
+    change([i.strip() for i in names], together=together)
+
+
+def slot_recall(comm):
+    slot_queue_recall(int(comm.rstrip("!")), together=comm.endswith("!"))
 
 
 def save_song(filename):
-    outdict = {}
-    for insname, insobj in active_instances.items():
-        inner = [{k: getattr(ds, k) for k in ds.__slots__} for ds in insobj._data_slots]
-        outdict[insname] = inner
+    if workers is not None:
+        voices = workers.slot_fields()
+    if filename.endswith((".pss", ".pssz")):
+        if workers is not None:
+            voices = {
+                k: [DataSlot(**fields) for fields in v] for k, v in voices.items()
+            }
+        else:
+            voices = {k: v.slot_sources() for k, v in active_instances.items()}
+        songfile.write_song(filename, voices, compress=filename.endswith("z"))
+        print("wrote song to %s" % filename)
+        return
+    if workers is not None:
+        outdict = voices
+    else:
+        outdict = {}
+        for insname, insobj in active_instances.items():
+            inner = [insobj.slot_fields(i) for i in range(len(insobj._data_slots))]
+            outdict[insname] = inner
+    import json
+
     with open(filename, "w") as outfile:
         json.dump(outdict, outfile)
     print("wrote song to %s" % filename)
 
 
-def load_song(filename):
+def load_song(filename, names=None):
+    """load the voices of a song file (only those in `names`, if given)"""
     global active_instances
-    with open(filename) as infile:
-        data = json.load(infile)
+    song = None
+    if songfile.is_song_file(filename):
+        # only the index is read here; slots are read as they're recalled
+        song = songfile.SongFile(filename)
+        data = {k: song.slot_refs(k) for k in song.voices()}
+    else:
+        import json
+
+        with open(filename) as infile:
+            data = json.load(infile)
+    if workers is not None:
+        if song is not None:
+            song.close()  # the workers open it for themselves
+        workers.load(filename, list(data))
+        print("loaded song %s" % filename)
+        return
     for k, v in data.items():
+        if names is not None and k not in names:
+            continue
         if k not in active_instances:
-            active_instances[k] = Pystepseq(data_slots=v)
-    print("loaded song %s" % filename)
+            active_instances[k] = Pystepseq(data_slots=v, scheduler=scheduler)
+    if song is not None:
+        use_song(song)
+    if names is None:
+        print("loaded song %s" % filename)
+
+
+def use_song(song):
+    """Make `song` the open SongFile, and close the one before it, once
+    the voices have read in whatever slots they still had there."""
+    global current_song
+    old, current_song = current_song, song
+    if old is None or old is song:
+        return
+    for voice in active_instances.values():
+        voice.read_song_slots(old)
+    old.close()
+
+
+def render(args):
+    try:
+        filename, seconds = args.rsplit(" ", 1)
+        seconds = float(seconds)
+    except ValueError:
+        print("usage: render FILENAME SECONDS")
+        return
+    elapsed = render_song(
+        active_instances,
+        filename,
+        seconds,
+        trig.tempo,
+        trig.num_triggers_per_qn,
+        clock=trig,
+    )
+    print("rendered %gs of song to %s in %.3fs" % (seconds, filename, elapsed))
+
+
+def record(filename):
+    if filename:
+        midi_functions.start_recording(filename)
+        print("recording to %s" % filename)
+    else:
+        filename = midi_functions.stop_recording()
+        if filename:
+            print("wrote recording to %s" % filename)
+
+
+def import_midi(args):
+    try:
+        name, slot, filename = args.split(" ", 2)
+        slot = int(slot)
+    except ValueError:
+        print("usage: import VOICE SLOT FILENAME [TRACK]")
+        return
+    track = None
+    head, _, tail = filename.rpartition(" ")
+    if head and tail.isdigit() and not os.path.exists(filename):
+        filename, track = head, int(tail)
+    try:
+        voice = active_instances[name]
+    except KeyError:
+        print("no voice called %s" % name)
+        return
+    try:
+        if voice.import_smf(filename, slot, track):
+            print("imported %s into slot %i of %s" % (filename, slot, name))
+    except (OSError, ValueError) as e:
+        print("Could not import %s: %s" % (filename, e))
 
 
 def voice_create(comm):
@@ -115,9 +359,9 @@ def voice_create(comm):
         print("'t' is a reserved object for tempo, cannot use")
     else:
         if len(comm) == 2:
-            active_instances[comm[1]] = Pystepseq()
+            active_instances[comm[1]] = Pystepseq(scheduler=scheduler)
         elif len(comm) > 2:
-            active_instances[comm[1]] = Pystepseq(int(comm[2:]))
+            active_instances[comm[1]] = Pystepseq(int(comm[2:]), scheduler=scheduler)
 
 
 def voice_delete(comm):
@@ -151,9 +395,21 @@ def get_or_set_tempo(comm):
             print(trig.cycle_len)
         else:
             try:
-                trig.set_cycle_len(int(eval(comm[2:])))
+                trig.set_cycle_len(int(parse_value(comm[2:])))
             except ValueError:
                 print("cannot parse that cycle length count")
+    elif comm[1] == "s":
+        trig.report()
+        if midi_functions.flush_latency.count:
+            print(midi_functions.flush_latency.report())
+    elif comm[1] == "m":
+        if len(comm) == 2:
+            print(trig.clock_mode)
+        else:
+            try:
+                trig.set_clock_mode(comm[2:].strip())
+            except ValueError as e:
+                print(e)
     else:
         try:
             trig.set_tempo(abs(int(comm[1:])))
@@ -215,7 +471,7 @@ def randomize_lengths(comm):
     choice_list = None
     if len(comm) > 3:
         try:
-            choice_list = eval(comm[3:])
+            choice_list = parse_value(comm[3:])
         except SyntaxError:
             print("Could not parse the given list")
     active_instances[comm[0]].randomize_lengths(choice_list=choice_list)
@@ -225,7 +481,7 @@ def randomize_gates(comm):
     choice_list = None
     if len(comm) > 3:
         try:
-            choice_list = eval(comm[3:])
+            choice_list = parse_value(comm[3:])
         except SyntaxError:
             print("Could not parse the given list")
     active_instances[comm[0]].randomize_gates(choice_list=choice_list)
@@ -235,7 +491,7 @@ def randomize_volumes(comm):
     choice_list = None
     if len(comm) > 3:
         try:
-            choice_list = eval(comm[3:])
+            choice_list = parse_value(comm[3:])
         except SyntaxError:
             print("Could not parse the given list")
     active_instances[comm[0]].randomize_volumes(choice_list=choice_list)
@@ -245,7 +501,7 @@ def randomize_notes(comm):
     choice_list = None
     if len(comm) > 3:
         try:
-            choice_list = eval(comm[3:])
+            choice_list = parse_value(comm[3:])
         except SyntaxError:
             print("Could not parse the given list")
     active_instances[comm[0]].randomize_notes(choice_list=choice_list)
@@ -255,12 +511,131 @@ def randomize_drums(comm):
     choice_lists = None, None
     if len(comm) > 3:
         try:
-            choice_lists = eval(comm[3:])
+            choice_lists = parse_value(comm[3:])
         except SyntaxError:
             print("Could not parse the given lists")
     active_instances[comm[0]].randomize_drums(*choice_lists)
 
 
+def get_or_set_seed(comm):
+    if len(comm) == 3:
+        print(active_instances[comm[0]].seed)
+    else:
+        try:
+            active_instances[comm[0]].seed = int(comm[3:])
+        except ValueError:
+            print("Could not parse the seed")
+
+
+def preroll(comm):
+    try:
+        count = int(comm[3:]) if len(comm) > 3 else 16
+    except ValueError:
+        print("Could not parse the number of variations")
+        return
+    active_instances[comm[0]].preroll(count)
+
+
+def show_tick_stats(comm):
+    ticks = active_instances[comm[0]].ticks
+    print(
+        "dropped: %i, late: %i, duplicate: %i, clock restarts: %i"
+        % (ticks.dropped, ticks.late, ticks.duplicate, ticks.resyncs)
+    )
+
+
+def set_instrumentation(on):
+    """switch the timing histograms on or off, everywhere in this process"""
+    constants.INSTRUMENT = on  # for the voices made from now on
+    loops = list(active_instances.values())
+    if scheduler is not None:
+        loops.append(scheduler)
+    for loop in loops:
+        if not on:
+            loop.stats = None
+        elif loop.stats is None:
+            loop.stats = LoopStats()
+    trig.instrument = on
+    midi_functions.instrument = on
+
+
+def reset_stats():
+    trig.reset_stats()
+    midi_functions.write_latency.reset()
+    midi_functions.flush_latency.reset()
+    if scheduler is not None and scheduler.stats is not None:
+        scheduler.stats.reset()
+    for voice in active_instances.values():
+        if voice.stats is not None:
+            voice.stats.reset()
+
+
+def stats_dict():
+    """every timing histogram of this process (and of the worker
+    processes, if there are any) as a dict, ready for JSON"""
+    voices = {}
+    for name, voice in active_instances.items():
+        voices[name] = {"ticks": voice.ticks.as_dict()}
+        if voice.stats is not None:
+            voices[name].update(voice.stats.as_dict())
+    out = {
+        "clock": {
+            "jitter": trig.jitter.as_dict(),
+            "send": trig.send_time.as_dict(),
+            "drift_ns": trig.drift_ns,
+            "max_drift_ns": trig.max_drift_ns,
+        },
+        "midi": {
+            "write": midi_functions.write_latency.as_dict(),
+            "flush": midi_functions.flush_latency.as_dict(),
+        },
+        "voices": voices,
+    }
+    if scheduler is not None and scheduler.stats is not None:
+        out["scheduler"] = scheduler.stats.as_dict()
+    if workers is not None:
+        out["workers"] = workers.stats()
+    return out
+
+
+def show_stats(comm):
+    args = comm[5:].split()
+    if not args:
+        histograms = [
+            trig.jitter,
+            trig.send_time,
+            midi_functions.write_latency,
+            midi_functions.flush_latency,
+        ]
+        for histogram in histograms:
+            if histogram.count:
+                print(histogram.report())
+        if scheduler is not None and scheduler.stats is not None:
+            print("scheduler:")
+            print(scheduler.stats.report())
+        for name, voice in active_instances.items():
+            if voice.stats is None:
+                continue
+            # (under the scheduler, voices only time their slot switches)
+            if voice.stats.step.count or voice.stats.switch.count:
+                print("voice %s:" % name)
+                print(voice.stats.report())
+        if not constants.INSTRUMENT:
+            print("instrumentation is off; 'stats on' switches it on")
+    elif args[0] in ("on", "off"):
+        set_instrumentation(args[0] == "on")
+    elif args[0] == "reset":
+        reset_stats()
+    elif args[0] == "save" and len(args) == 2:
+        import json
+
+        with open(args[1], "w") as outfile:
+            json.dump(stats_dict(), outfile, indent=1)
+        print("wrote timing statistics to %s" % args[1])
+    else:
+        print("usage: stats [on|off|reset|save FILENAME]")
+
+
 def get_or_set_triggers_per_beat(comm):
     if len(comm) == 3:
         print(active_instances[comm[0]].triggers_per_beat)
@@ -287,11 +662,14 @@ def get_or_set_lengths(comm):
         print(active_instances[comm[0]].len_list)
     else:
         if "=" not in comm:
-            active_instances[comm[0]].len_list = eval(comm[2:])
+            active_instances[comm[0]].len_list = parse_value(comm[2:])
         else:
             parts = comm[2:].split("=")
             idx, val = int(parts[0]), int(parts[1])
-            active_instances[comm[0]].len_list[idx] = eval(val)
+            # lists may be shared with a data slot, so copy on write:
+            new_list = list(active_instances[comm[0]].len_list)
+            new_list[idx] = val
+            active_instances[comm[0]].len_list = new_list
 
 
 def get_or_set_gates(comm):
@@ -299,11 +677,14 @@ def get_or_set_gates(comm):
         print(active_instances[comm[0]].gate_list)
     else:
         if "=" not in comm:
-            active_instances[comm[0]].gate_list = eval(comm[2:])
+            active_instances[comm[0]].gate_list = parse_value(comm[2:])
         else:
             parts = comm[2:].split("=")
             idx, val = int(parts[0]), int(parts[1])
-            active_instances[comm[0]].gate_list[idx] = eval(val)
+            # lists may be shared with a data slot, so copy on write:
+            new_list = list(active_instances[comm[0]].gate_list)
+            new_list[idx] = val
+            active_instances[comm[0]].gate_list = new_list
 
 
 def get_or_set_volumes(comm):
@@ -311,11 +692,14 @@ def get_or_set_volumes(comm):
         print(active_instances[comm[0]].vol_list)
     else:
         if "=" not in comm:
-            active_instances[comm[0]].vol_list = eval(comm[2:])
+            active_instances[comm[0]].vol_list = parse_value(comm[2:])
         else:
             parts = comm[2:].split("=")
             idx, val = int(parts[0]), int(parts[1])
-            active_instances[comm[0]].vol_list[idx] = eval(val)
+            # lists may be shared with a data slot, so copy on write:
+            new_list = list(active_instances[comm[0]].vol_list)
+            new_list[idx] = val
+            active_instances[comm[0]].vol_list = new_list
 
 
 def get_or_set_space_chance(comm):
@@ -326,7 +710,7 @@ def get_or_set_space_chance(comm):
 
 
 def do_note_fractal(comm):
-    myargs = eval(comm[2:])
+    myargs = parse_value(comm[2:])
     active_instances[comm[0]].note_list = fractal_melody(*myargs)
 
 
@@ -335,11 +719,14 @@ def get_or_set_notes(comm):
         print(active_instances[comm[0]].note_list)
     else:
         if "=" not in comm:
-            active_instances[comm[0]].note_list = eval(comm[2:])
+            active_instances[comm[0]].note_list = parse_value(comm[2:])
         else:
             parts = comm[2:].split("=")
             idx, val = int(parts[0]), int(parts[1])
-            active_instances[comm[0]].note_list[idx] = eval(val)
+            # lists may be shared with a data slot, so copy on write:
+            new_list = list(active_instances[comm[0]].note_list)
+            new_list[idx] = val
+            active_instances[comm[0]].note_list = new_list
 
 
 def get_or_set_scale(comm):
@@ -405,113 +792,135 @@ def get_or_set_scl_mxt(comm):
             print("Cannot parse the arguments for min_max_trans")
 
 
-def command_parser(phrase):  # noqa
-    all_commands = phrase.rstrip().split(";")
-    for comm in all_commands:
+def voice_play(comm):
+    active_instances[comm[0]].play()
+
+
+def voice_play_now(comm):
+    active_instances[comm[0]].play(immediately=True)
+
+
+def voice_stop(comm):
+    active_instances[comm[0]].stop()
+
+
+def voice_stop_now(comm):
+    active_instances[comm[0]].stop(immediately=True)
+
+
+def slot_save(comm):
+    try:
+        slot_queue_save(int(comm[1:]))
+    except ValueError:
+        print("Error in numerical input")
+
+
+def not_understood(comm):
+    print("command not understood, or not implemented yet")
+
+
+# The command tables. Words are matched first, in this order; then the
+# first character; and anything else is "<voice><command>", looked up by
+# its two-letter command and then by its one-letter one (so e.g. "bb" wins
+# over "b").
+WORD_COMMANDS = [
+    ("zxdrums", lambda comm: setup_drums()),
+    ("load ", lambda comm: load_song(comm[5:])),
+    ("save ", lambda comm: save_song(comm[5:])),
+    ("render ", lambda comm: render(comm[7:].strip())),
+    ("record", lambda comm: record(comm[6:].strip())),
+    ("import ", lambda comm: import_midi(comm[7:].strip())),
+    ("tt", get_or_set_triggers_per_qn),
+    ("stats", show_stats),
+]
+FIRST_CHAR_COMMANDS = {
+    "q": slot_save,
+    "=": voice_create,
+    "-": voice_delete,
+    "`": change_command,
+    "t": get_or_set_tempo,
+}
+for digit in "1234567890":
+    FIRST_CHAR_COMMANDS[digit] = slot_recall
+VOICE_COMMANDS = {
+    # stopping and starting voices
+    "\\\\": voice_stop_now,
+    "//": voice_play_now,
+    "\\": voice_stop,
+    "/": voice_play,
+    # randomizing parameters:
+    "md": set_mode,
+    "vd": get_or_set_volume_noise_depth,
+    "vn": get_or_set_volume_noise_type,
+    "nd": get_or_set_note_noise_depth,
+    "nn": get_or_set_note_noise_type,
+    "nt": get_or_set_note_tie_chance,
+    "rl": randomize_lengths,
+    "rg": randomize_gates,
+    "rv": randomize_volumes,
+    "rn": randomize_notes,
+    "rd": randomize_drums,
+    "rs": get_or_set_seed,
+    "rp": preroll,  # pre-roll variations for 'change'
+    "bb": get_or_set_triggers_per_beat,
+    "b": get_or_set_beats_per_measure,
+    "e": get_or_set_ending_note_count,
+    "l": get_or_set_lengths,
+    "g": get_or_set_gates,
+    "v": get_or_set_volumes,
+    "p": get_or_set_space_chance,  # how much silence in a pattern
+    "s": get_or_set_scale,
+    "f": do_note_fractal,
+    "n": get_or_set_notes,
+    "m": get_or_set_scl_min,
+    "x": get_or_set_scl_max,
+    "t": get_or_set_scl_transposition,
+    "i": get_or_set_scl_mxt,
+    "k": show_tick_stats,  # clock health
+}
+
+
+def find_handler(comm):
+    """the function that handles the single command `comm`"""
+    for word, handler in WORD_COMMANDS:
+        if comm.startswith(word):
+            return handler
+    handler = FIRST_CHAR_COMMANDS.get(comm[0])
+    if handler is not None:
+        return handler
+    return (
+        VOICE_COMMANDS.get(comm[1:3])
+        or VOICE_COMMANDS.get(comm[1:2])
+        or not_understood
+    )
+
+
+@lru_cache(maxsize=256)
+def compile_line(phrase):
+    """Split a line into its commands and look up each one's handler,
+    once: the result, a tuple of (handler, command) pairs, is cached, so
+    a long macro that is fired again and again is only parsed the first
+    time. Help (which ends the line) comes back as a None handler."""
+    compiled = []
+    for comm in phrase.rstrip().split(";"):
+        if not comm:
+            continue
         if comm[0] == "h":
+            compiled.append((None, comm))
+            break
+        compiled.append((find_handler(comm), comm))
+    return tuple(compiled)
+
+
+def command_parser(phrase):
+    for handler, comm in compile_line(phrase):
+        # with worker processes, most commands are for one of them:
+        if workers is not None and workers.dispatch(comm):
+            continue
+        if handler is None:
             help()
             break
-        if comm[0] in "1234567890":
-            slot_queue_recall(int(comm))
-        elif comm[0] == "q":
-            try:
-                slot_queue_save(int(comm[1:]))
-            except ValueError:
-                print("Error in numerical input")
-        elif comm[0:7] == "zxdrums":
-            setup_drums()
-        elif comm[0:5] == "load ":
-            load_song(comm[5:])
-        elif comm[0:5] == "save ":
-            save_song(comm[5:])
-        elif comm[0] == "=":
-            voice_create(comm)
-        elif comm[0] == "-":
-            voice_delete(comm)
-        elif comm[0] == "`":
-            change([i.strip() for i in comm[1:].split(",")])
-        elif comm[0:2] == "tt":
-            get_or_set_triggers_per_qn(comm)
-        elif comm[0] == "t":
-            get_or_set_tempo(comm)
-        # stopping and starting voices (and the tempotrigger)
-        elif comm[1:3] == r"\\":
-            active_instances[comm[0]].stop(immediately=True)
-        elif comm[1:3] == "//":
-            active_instances[comm[0]].play(immediately=True)
-        elif comm[1] == "\\":
-            active_instances[comm[0]].stop()
-        elif comm[1] == "/":
-            active_instances[comm[0]].play()
-        # randomizing parameters:
-        elif comm[1:3] == "md":
-            set_mode(comm)
-        elif comm[1:3] == "vd":
-            get_or_set_volume_noise_depth(comm)
-        elif comm[1:3] == "vn":
-            get_or_set_volume_noise_type(comm)
-        elif comm[1:3] == "nd":
-            get_or_set_note_noise_depth(comm)
-        elif comm[1:3] == "nn":
-            get_or_set_note_noise_type(comm)
-        elif comm[1:3] == "nt":
-            get_or_set_note_tie_chance(comm)
-        # randomize lengths
-        elif comm[1:3] == "rl":
-            randomize_lengths(comm)
-        # randomize gate percentages
-        elif comm[1:3] == "rg":
-            randomize_gates(comm)
-        # randomize volumes
-        elif comm[1:3] == "rv":
-            randomize_volumes(comm)
-        # randomize notes
-        elif comm[1:3] == "rn":
-            randomize_notes(comm)
-        # randomize drums
-        elif comm[1:3] == "rd":
-            randomize_drums(comm)
-        # triggers per beat
-        elif comm[1:3] == "bb":
-            get_or_set_triggers_per_beat(comm)
-        # beats per measure
-        elif comm[1] == "b":
-            get_or_set_beats_per_measure(comm)
-        # ending note (by count)
-        elif comm[1] == "e":
-            get_or_set_ending_note_count(comm)
-        # lengths
-        elif comm[1] == "l":
-            get_or_set_lengths(comm)
-        # gates
-        elif comm[1] == "g":
-            get_or_set_gates(comm)
-        # volumns
-        elif comm[1] == "v":
-            get_or_set_volumes(comm)
-        # volume 'space' (how much silence in a pattern)
-        elif comm[1] == "p":
-            get_or_set_space_chance(comm)
-        # scale type
-        elif comm[1] == "s":
-            get_or_set_scale(comm)
-        # fractal note list
-        elif comm[1] == "f":
-            do_note_fractal(comm)
-        # notes
-        elif comm[1] == "n":
-            get_or_set_notes(comm)
-        # min note, max note, transposition
-        elif comm[1] == "m":
-            get_or_set_scl_min(comm)
-        elif comm[1] == "x":
-            get_or_set_scl_max(comm)
-        elif comm[1] == "t":
-            get_or_set_scl_transposition(comm)
-        elif comm[1] == "i":
-            get_or_set_scl_mxt(comm)
-        else:
-            print("command not understood, or not implemented yet")
+        handler(comm)
 
 
 # set up the global tempo sequencer object that 'ticks' the grid time:
@@ -519,22 +928,53 @@ trig = Tempotrigger(24)  # 24 is the number of triggers per beat
 trig.set_tempo(120)  # 120 BPM default
 
 
-def repl():
+# what a malformed command can raise:
+INPUT_ERRORS = (
+    TypeError,
+    KeyError,
+    ValueError,
+    IndexError,
+    SyntaxError,
+    NameError,
+)
+
+
+def start():
+    """start the clock, and the scheduler or the worker processes"""
+    global workers
     trig.run()
+    if constants.WORKERS:
+        workers = WorkerPool(constants.WORKERS)
+    elif scheduler is not None:
+        scheduler.run()
+
+
+def shutdown():
+    """silence and stop every voice, then the clock"""
+    global workers
+    if workers is not None:
+        workers.close()
+        workers = None
+    for voice in active_instances.values():
+        voice.stop(immediately=True)
+    if scheduler is not None:
+        scheduler.stop()
+    trig.stop()
+    trig.close()
+
+
+def repl():
+    import readline  # noqa: F401 (line editing for input())
+
+    prompt = "pystepseq-%s ('h' for help) --> " % get_version()
+    start()
     while True:
         try:
-            phrase = input(PROMPT)
+            phrase = input(prompt)
             if len(phrase) == 0:
                 continue
             command_parser(phrase)
-        except (
-            TypeError,
-            KeyError,
-            ValueError,
-            IndexError,
-            SyntaxError,
-            NameError,
-        ) as e:
+        except INPUT_ERRORS as e:
             print("Error due to malformed input: %s Please try again." % e)
         except (EOFError, KeyboardInterrupt):
             banner = '''
@@ -23,48 +23,154 @@
 # modules needed:
 import _thread
 import os
-from copy import deepcopy
+import time
 from math import ceil, log
-from random import randint, choice
+import random
 
 # my modules:
+from pystepseq.lib.histogram import LoopStats
+from pystepseq.lib import midi_functions
 from pystepseq.lib.midi_functions import (
     close_port,
-    note_off,
-    note_on,
     open_port,
-    pitch_bend,
+    set_event_time,
+    tick_time,
 )
-from pystepseq.lib.scales import *  # noqa
+from pystepseq.lib.scales import MidiScale
 from pystepseq.lib.pink_noise import pink_noise
+from pystepseq.lib import contours
+from pystepseq.lib.smf import quantize_notes, read_smf
+from pystepseq.lib.songfile import SlotRef
+from pystepseq.tempotrigger import TickTracker, open_tick_receiver
+
+
+def _splice(lst, start, finish, values):
+    """replace positions start..finish-1 of a list with new values"""
+    return list(lst[:start]) + values + list(lst[finish:])
+
+
+# the saveable settings of a voice, i.e. what goes in a DataSlot:
+SLOT_FIELDS = [
+    "chn",
+    "end",
+    "triggers_per_beat",
+    "beats_per_measure",
+    "scl",
+    "scl_min",
+    "scl_max",
+    "scl_trans",
+    "len_list",
+    "vol_list",
+    "gate_list",
+    "note_list",
+    "note_noise",
+    "note_depth",
+    "note_repeat",
+    "note_tie",
+    "vol_noise",
+    "vol_depth",
+    "space",
+    "seed",
+]
+
+# attributes that Pystepseq keeps in a private slot behind a property:
+_PRIVATE_FIELDS = ["end", "len_list", "vol_list", "gate_list", "note_list", "seed"]
+_SLOT_TARGETS = [(k, "_" + k if k in _PRIVATE_FIELDS else k) for k in SLOT_FIELDS]
+# a slot holds these as tuples, but a voice's own are lists, to edit freely:
+_LIST_FIELDS = ["len_list", "vol_list", "gate_list", "note_list"]
+_SCALAR_TARGETS = [(k, target) for k, target in _SLOT_TARGETS if k not in _LIST_FIELDS]
+# the "tick" of a staged switch that waits for the voice's own pattern to
+# come round, rather than for a tick of the clock (see Pystepseq.stage):
+PATTERN_END = -1
+
+
+def compile_steps(end, lens, vols, gates, notes, get_note):
+    """Compile lists and a scale lookup into a step program: an immutable
+    tuple with one (length, gate cutoff, note, bend, velocity) row per step.
+    """
+    program = []
+    for step in range(end):
+        length = int(lens[step % len(lens)])
+        gate = gates[step % len(gates)]
+        cutoff = int(round(length * (gate / 100)))
+        # protect against < 0
+        if length < 1:
+            length = 1
+        note = get_note(notes[step % len(notes)])
+        if isinstance(note, tuple):
+            note, bend = note
+        else:
+            bend = 8192
+        vol = int(vols[step % len(vols)])
+        program.append((length, cutoff, int(note), int(bend), vol))
+    return tuple(program)
 
 
 class DataSlot:
-    __slots__ = [
-        "chn",
-        "end",
-        "triggers_per_beat",
-        "beats_per_measure",
-        "scl",
-        "scl_min",
-        "scl_max",
-        "scl_trans",
-        "len_list",
-        "vol_list",
-        "gate_list",
-        "note_list",
-        "note_noise",
-        "note_depth",
-        "note_repeat",
-        "note_tie",
-        "vol_noise",
-        "vol_depth",
-        "space",
-    ]
+    """An immutable snapshot of a voice's saveable settings, with the lists
+    held as tuples. `prepare` builds the slot's scale and step program
+    once, ahead of time, so that switching a voice to the slot is only a
+    matter of swapping references.
+    """
+
+    __slots__ = SLOT_FIELDS + ["scale", "program"]
+
+    def __init__(self, **fields):
+        for slot in SLOT_FIELDS:
+            val = fields.get(slot)
+            if isinstance(val, list):
+                val = tuple(val)
+            object.__setattr__(self, slot, val)
+        object.__setattr__(self, "scale", None)
+        object.__setattr__(self, "program", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DataSlot is immutable")
+
+    def prepare(self):
+        """build the scale and step program, unless that's already done"""
+        if not self.note_list:
+            return
+        if self.scale is None:
+            scale = MidiScale(self.scl, self.scl_min, self.scl_max, self.scl_trans)
+            object.__setattr__(self, "scale", scale)
+        if self.program is None:
+            program = compile_steps(
+                self.end,
+                self.len_list,
+                self.vol_list,
+                self.gate_list,
+                self.note_list,
+                self.scale.get_note,
+            )
+            object.__setattr__(self, "program", program)
+
+    def take_scale(self):
+        """Hand the prepared scale over to a voice, which may go on to
+        change it; the next `prepare` builds a fresh one for this slot."""
+        scale = self.scale
+        object.__setattr__(self, "scale", None)
+        if scale is None:
+            scale = MidiScale(self.scl, self.scl_min, self.scl_max, self.scl_trans)
+        return scale
+
+
+_EMPTY_SLOT = DataSlot()
+
 
-    def __init__(self):
-        for slot in self.__slots__:
-            setattr(self, slot, None)
+def _program_attr(name):
+    """A public attribute that is stored in a private slot, and recompiles
+    the step program whenever it is assigned."""
+    private = "_" + name
+
+    def getter(self):
+        return getattr(self, private)
+
+    def setter(self, value):
+        setattr(self, private, value)
+        self.compile_program()
+
+    return property(getter, setter)
 
 
 class Pystepseq:
@@ -74,23 +180,47 @@ class Pystepseq:
 
     # fmt: off
     __slots__ = [
-        "chn", "end", "triggers_per_beat", "beats_per_measure", "_triggers_per_measure",
-        "scl", "scl_min", "scl_max", "scl_trans", "len_list", "vol_list", "gate_list", "note_list",
+        "chn", "_end", "triggers_per_beat", "beats_per_measure", "_triggers_per_measure",
+        "scl", "scl_min", "scl_max", "scl_trans",
+        "_len_list", "_vol_list", "_gate_list", "_note_list",
         "note_noise", "note_depth", "note_repeat", "note_tie",
         "vol_noise", "vol_depth", "space",
-        "_scl", "_note", "_note_index", "_note_length", "_bend", "_old_note",
-        "_gate", "_gate_cutoff", "_gate_list", "_vol",
+        "_scl", "_program", "_note_length", "_bend", "_old_note", "_gate_cutoff",
         "_cycle_idx",  "_step", "_trigger_count",
         "_MYGROUP", "_MYPORT", "_receiver",  "_open_port_exists",
-        "_data_slots", "_requested_slot", "_current_slot",
-        "_saveable_attrs", "_runstate",
+        "_data_slots", "_slots_lock", "_requested_slot", "_current_slot", "_staged", "_pending",
+        "_saveable_attrs", "_runstate", "_scheduler",
+        "_seed", "_rng", "_np_rng", "_pool", "_prefetch", "ticks", "stats", "_midi",
     ]
     # fmt: on
-    def __init__(self, chn=0, data_slots={}):
+
+    # changing any of these recompiles the step program:
+    end = _program_attr("end")
+    len_list = _program_attr("len_list")
+    vol_list = _program_attr("vol_list")
+    gate_list = _program_attr("gate_list")
+    note_list = _program_attr("note_list")
+
+    @property
+    def seed(self):
+        return self._seed
+
+    @seed.setter
+    def seed(self, value):
+        """reseed this voice's random streams; None picks a fresh seed"""
+        if value is None:
+            value = random.randrange(2**32)
+        self._seed = value
+        self._rng = random.Random(value)
+        if self._np_rng is not None:
+            self._np_rng = contours.new_rng(value)
+
+    def __init__(self, chn=0, data_slots={}, scheduler=None, seed=None):
         from . import constants
-        from .tempotrigger import openmcastsock
 
-        self._saveable_attrs = [x for x in self.__slots__ if not x.startswith("_")]
+        self._saveable_attrs = SLOT_FIELDS
+        self._scl = None
+        self._program = ()
         self.chn = chn
         self._step = -1
         self.end = 16  # num of note events, distinguished from beats
@@ -115,11 +245,29 @@ class Pystepseq:
         self.space = 0
         self._MYGROUP = "225.0.0.250"
         self._MYPORT = constants.DEFAULT_MULTICAST_PORT
-        self._receiver = openmcastsock(self._MYGROUP, self._MYPORT)
+        self._receiver = None  # opened when the voice first plays
+        self.ticks = TickTracker()  # lost, late and duplicate tick counts
+        # timing histograms, with PYSTEPSEQ_INSTRUMENT (or 'stats on') only:
+        self.stats = LoopStats() if constants.INSTRUMENT else None
         self._open_port_exists = False
-        self._data_slots = [DataSlot() for x in range(16)]
+        # where note_on, note_off and pitch_bend go (see render.py):
+        self._midi = midi_functions
+        # None for an empty slot; a slot loaded from a song stays a
+        # placeholder (see _slot) until it is first used:
+        self._data_slots = [None] * 16
+        # taken to store into _data_slots, which the prefetch thread also does:
+        self._slots_lock = _thread.allocate_lock()
+        self._prefetch = False  # not while loading, see below
         self._requested_slot = 0
         self._current_slot = 0
+        self._staged = None
+        self._pending = None  # (seq, tick, staged, edits) from a Transaction
+        self._scheduler = scheduler
+        # every voice draws from its own seedable random streams; with
+        # NumPy around, contours are generated in one go:
+        self._np_rng = contours.new_rng() if constants.USE_NUMPY else None
+        self.seed = seed
+        self._pool = []
         # automatic init:
         # on a Mac, the variable is a dummy...
         self.init_scl()
@@ -130,16 +278,14 @@ class Pystepseq:
             self._init_data_slots(data_slots)
         else:
             self.init_random_lists()
+        self._prefetch = constants.PREFETCH_SLOTS
 
     def _init_data_slots(self, data_slots):
         for i, ds in enumerate(data_slots):
             if ds:
-                local_slot = DataSlot()
-                for k, v in ds.items():
-                    setattr(local_slot, k, v)
-                self._data_slots[i] = local_slot
-        for i, ds in enumerate(self._data_slots):
-            if ds.note_list:
+                self._data_slots[i] = ds  # read in when first used
+        for i in range(len(self._data_slots)):
+            if self._slot_has_data(i):
                 self.data_slot_recall(i)
                 self._data_update()
                 break
@@ -149,31 +295,228 @@ class Pystepseq:
 
     def init_scl(self):
         self._scl = MidiScale(self.scl, self.scl_min, self.scl_max, self.scl_trans)
+        # any later change to the scale's range or transposition recompiles:
+        self._scl.on_change = self.compile_program
+        self.compile_program()
+
+    def compile_program(self):
+        """Compile the lists and scale into the step program that the looper
+        walks: an immutable tuple with one (length, gate cutoff, note, bend,
+        velocity) row per step. Call this after changing a list in place.
+        """
+        if not (self._scl and self._len_list and self._vol_list):
+            return  # still being set up
+        if not (self._gate_list and self._note_list):
+            return
+        self._program = compile_steps(
+            self._end,
+            self._len_list,
+            self._vol_list,
+            self._gate_list,
+            self._note_list,
+            self._scl.get_note,
+        )
 
     def data_slot_save(self, num):
         self._requested_slot, self._current_slot = num, num
-        data_slot = DataSlot()
-        for attr in self._saveable_attrs:
-            val = deepcopy(getattr(self, attr))
-            setattr(data_slot, attr, val)
-        self._data_slots[num] = data_slot
-
-    def _data_update(self):
-        data_slot = self._data_slots[self._requested_slot]
-        for k in data_slot.__slots__:
-            val = deepcopy(getattr(data_slot, k))
-            setattr(self, k, val)
-        self.init_scl()
+        data_slot = self.snapshot()
+        with self._slots_lock:
+            self._data_slots[num] = data_slot
+
+    def snapshot(self, **changes):
+        """a DataSlot of this voice's settings, with `changes` applied"""
+        fields = {attr: getattr(self, attr) for attr in self._saveable_attrs}
+        fields.update(changes)
+        return DataSlot(**fields)
+
+    def _data_update(self, staged=None):
+        """Switch to the slot staged by `data_slot_recall` (or to `staged`,
+        in the same form, from a Transaction). Everything was prepared
+        there, so this is only reference assignments, and copies of the
+        lists (the step program itself comes ready-made from the slot)."""
+        start = time.perf_counter_ns()
+        num, data_slot, rng, np_rng = self._staged if staged is None else staged
+        seed = self._seed
+        for k, target in _SCALAR_TARGETS:
+            setattr(self, target, getattr(data_slot, k))
+        for k in _LIST_FIELDS:
+            values = getattr(data_slot, k)
+            setattr(self, "_" + k, values if values is None else list(values))
+        scale = data_slot.take_scale()
+        scale.on_change = self.compile_program
+        self._scl = scale
+        self._program = data_slot.program
+        if rng is not None:
+            self._rng, self._np_rng = rng, np_rng
+        else:
+            self._seed = seed  # slots saved before seeds existed
         self._triggers_per_measure = self.triggers_per_beat * self.beats_per_measure
-        self._current_slot = self._requested_slot
+        if num is not None:
+            self._requested_slot = self._current_slot = num
+        if self.stats is not None:
+            self.stats.switch.record(time.perf_counter_ns() - start)
+
+    def import_smf(self, filename, num, track=None):
+        """Quantize a track of a MIDI file (the first one with notes, by
+        default) against this voice's scale, and store it in slot `num`.
+        The voice's other settings are kept."""
+        format, division, tracks = read_smf(filename, track)
+        notes = [t for t in tracks if t]
+        if not notes:
+            print("no notes found in %s" % filename)
+            return False
+        lists = quantize_notes(
+            notes[0], division, self.triggers_per_beat, self._scl
+        )
+        fields = {attr: getattr(self, attr) for attr in self._saveable_attrs}
+        fields.update(lists)
+        fields["end"] = len(lists["note_list"])
+        data_slot = DataSlot(**fields)
+        with self._slots_lock:
+            self._data_slots[num] = data_slot
+        return True
+
+    def _slot_has_data(self, num):
+        ds = self._data_slots[num]
+        if ds is None:
+            return False
+        if isinstance(ds, dict):
+            return bool(ds.get("note_list"))
+        return isinstance(ds, SlotRef) or bool(ds.note_list)
+
+    def _slot(self, num):
+        """Slot `num` as a DataSlot. Slots of a loaded song start out as
+        placeholders, a SlotRef into a binary song file or a dict from a
+        JSON one, and are only turned into a DataSlot here, when first used.
+        """
+        ds = self._data_slots[num]
+        if ds is None:
+            return _EMPTY_SLOT
+        if not isinstance(ds, (SlotRef, dict)):
+            return ds
+        # decode without the lock, then store the result only if the slot
+        # still holds that placeholder (it may have been saved over since):
+        if isinstance(ds, SlotRef):
+            decoded = DataSlot(**ds.load())
+        else:
+            decoded = DataSlot(**{k: v for k, v in ds.items() if k in SLOT_FIELDS})
+        with self._slots_lock:
+            if self._data_slots[num] is ds:
+                self._data_slots[num] = decoded
+        return self._slot(num)
+
+    def read_song_slots(self, song):
+        """decode the slots still sitting in SongFile `song`, so that it
+        can be closed"""
+        for num, ds in enumerate(self._data_slots):
+            if isinstance(ds, SlotRef) and ds.song is song:
+                self._slot(num)
+
+    def _prefetch_slot(self, num):
+        """materialize and prepare a slot ahead of its recall"""
+        self._slot(num).prepare()
+
+    def slot_fields(self, num):
+        """the saveable fields of slot `num` as a dict, without turning a
+        placeholder into a DataSlot"""
+        ds = self._data_slots[num]
+        if isinstance(ds, SlotRef):
+            ds = ds.load()
+        if ds is None or isinstance(ds, dict):
+            return {k: (ds or {}).get(k) for k in SLOT_FIELDS}
+        return {k: getattr(ds, k) for k in SLOT_FIELDS}
+
+    def slot_sources(self):
+        """the slots the way songfile.write_song wants them: SlotRefs as
+        they are (so they can be copied across undecoded), None for empty
+        slots and DataSlots for the rest"""
+        return [
+            ds if ds is None or isinstance(ds, SlotRef) else self._slot(i)
+            for i, ds in enumerate(self._data_slots)
+        ]
 
     def data_slot_recall(self, num):
+        """switch to slot `num` when the pattern next comes round"""
+        staged = self.stage_slot(num)
+        if staged is not None:
+            self._staged = staged
+            self._requested_slot = staged[0]
+
+    def stage_slot(self, num):
+        """Get slot `num` ready to be switched to; returns it in the form
+        `_data_update` takes, or None if there's no data to switch to."""
         # check that the slot has data:
-        if getattr(self._data_slots[num], "note_list"):
-            self._requested_slot = num
-        else:
+        if not self._slot_has_data(num):
             print(f"slot {num} has no data, defaulting to slot 0...")
-            self._requested_slot = 0
+            num = 0
+            if not self._slot_has_data(num):
+                return None
+        # get everything ready here, rather than on the timing thread:
+        data_slot = self._slot(num)
+        following = (num + 1) % len(self._data_slots)
+        if self._prefetch and isinstance(self._data_slots[following], (SlotRef, dict)):
+            _thread.start_new_thread(self._prefetch_slot, (following,))
+        data_slot.prepare()
+        rng = np_rng = None
+        if data_slot.seed is not None:
+            rng = random.Random(data_slot.seed)
+            if self._np_rng is not None:
+                np_rng = contours.new_rng(data_slot.seed)
+        return num, data_slot, rng, np_rng
+
+    def stage_fields(self, **fields):
+        """Get a change of `fields` (any DataSlot fields) ready to be
+        switched to, in the form `stage` takes, on top of the voice's
+        other settings as they are now."""
+        data_slot = self.snapshot(**fields)
+        data_slot.prepare()
+        return None, data_slot, None, None
+
+    def stage(self, staged, seq=0, tick=None, fields=None):
+        """Switch to `staged` (see `stage_slot`) on the tick with sequence
+        number `seq`, or if that isn't known (0), on the next tick with
+        cycle index `tick` (None for any tick; PATTERN_END waits for the
+        pattern to come round instead). The pattern then starts over from
+        its first step. A voice that isn't playing, or stops before then,
+        switches right away. `fields` are the ones changed, if `staged` came from
+        `stage_fields`, so that edits made to the others in the meantime
+        aren't undone. Returns whether the switch is still pending."""
+        if self._runstate == 0 and self._step == -1:
+            self._data_update(staged)
+            return False
+        edits = None if fields is None else (fields, self._settings())
+        self._pending = seq, tick, staged, edits  # one reference for the looper
+        return True
+
+    def _pending_due(self, seq, triggernum):
+        target, tick, staged, edits = self._pending
+        if target:
+            return seq >= target
+        return tick is None or triggernum == tick
+
+    def _settings(self):
+        """the objects the voice's settings are now, to tell later whether
+        any of them has been assigned"""
+        return [getattr(self, target) for k, target in _SLOT_TARGETS]
+
+    def _edited_since(self, fields, settings):
+        """whether a setting outside `fields` was assigned since `settings`"""
+        now = self._settings()
+        for (k, target), old, new in zip(_SLOT_TARGETS, settings, now):
+            if new is not old and k not in fields:
+                return True
+        return False
+
+    def _apply_pending(self):
+        """switch to the pending settings and start the pattern over"""
+        staged, edits = self._pending[2:]
+        self._pending = None
+        if edits is not None and self._edited_since(*edits):
+            # apply only the changed fields, over the edits (the slow path):
+            staged = self.stage_fields(**edits[0])
+        self._data_update(staged)
+        self._step = -1
+        self._trigger_count = 0
 
     def init_midi_port(self, midiport=None):
         if self._open_port_exists:
@@ -182,10 +525,31 @@ class Pystepseq:
         self._open_port_exists = True
 
     # randomize functions:
-    def _note_white(self, start, finish=None):
+    def _previous(self, lst, start, default):
+        """the value a repeat at `start` copies, as the Python versions do"""
+        idx = (start - 1) % self.end
+        return lst[idx] if idx < len(lst) else default
+
+    # The contour generators fill positions start..finish-1 of a copy of
+    # `lst` (the voice's current list by default) and return it, leaving
+    # the voice itself untouched.
+    def _note_white(self, start, finish=None, lst=None):
         """create white noise shaped note contour"""
         if finish is None:
             finish = len(self.len_list)
+        lst = list(self._note_list if lst is None else lst)
+        if self._np_rng is not None:
+            values = contours.note_white(
+                self._np_rng,
+                finish - start,
+                self._scl.size,
+                self.note_depth,
+                self.note_repeat,
+                self.note_tie,
+                self._previous(lst, start, self._scl.size // 2),
+            )
+            return _splice(lst, start, finish, values)
+        randint = self._rng.randint
         var = self.note_depth
         chance_repeat = self.note_repeat
         chance_tie = self.note_tie
@@ -200,16 +564,33 @@ class Pystepseq:
                 if chance_tie >= randint(1, 100):  # for space
                     randnum = -1
                 else:
-                    randnum = self.note_list[(blah - 1) % self.end]
+                    randnum = self._previous(lst, blah, scale_midpoint)
             try:
-                self.note_list[blah] = randnum
+                lst[blah] = randnum
             except IndexError:
-                self.note_list.append(randnum)
+                lst.append(randnum)
+        return lst
 
-    def _note_brown(self, start, finish=None):
+    def _note_brown(self, start, finish=None, lst=None):
         """create brown noise shaped note contour"""
         if finish is None:
             finish = len(self.len_list)
+        lst = list(self._note_list if lst is None else lst) or [self._scl.size // 2]
+        if self._np_rng is not None:
+            if start == 0:
+                start = 1
+            first = self._previous(lst, start, self._scl.size // 2)
+            values = contours.note_brown(
+                self._np_rng,
+                finish - start,
+                self._scl.size,
+                self.note_depth,
+                self.note_repeat,
+                self.note_tie,
+                first,
+            )
+            return _splice(lst, start, finish, values)
+        randint = self._rng.randint
         var = self.note_depth
         chance_repeat = self.note_repeat
         chance_tie = self.note_tie
@@ -218,7 +599,7 @@ class Pystepseq:
             finish = 2
         for blah in range(start, finish + 1):
             offset = randint(-var, var)
-            current = self.note_list[blah - 1]
+            current = lst[blah - 1]
             new = current + offset
             if new > self._scl.size:
                 new = current - offset
@@ -228,22 +609,37 @@ class Pystepseq:
                 if chance_tie >= randint(1, 100):  # for tie
                     new = -1
                 else:
-                    new = self.note_list[(blah - 1) % self.end]
+                    new = self._previous(lst, blah, current)
             try:
-                self.note_list[blah] = new
+                lst[blah] = new
             except IndexError:
-                self.note_list.append(new)
+                lst.append(new)
+        return lst
 
-    def _note_pink(self, start, finish=None):
+    def _note_pink(self, start, finish=None, lst=None):
         """create pink noise shaped note contour"""
         if finish is None:
             finish = len(self.len_list)
+        lst = list(self._note_list if lst is None else lst)
+        if self._np_rng is not None:
+            values = contours.note_pink(
+                self._np_rng,
+                start,
+                finish,
+                self._scl.size,
+                self.note_depth,
+                self.note_repeat,
+                self.note_tie,
+                self._previous(lst, start, self._scl.size // 2),
+            )
+            return _splice(lst, start, finish, values)
+        randint = self._rng.randint
         var = self.note_depth
         chance_repeat = self.note_repeat
         chance_tie = self.note_tie
         scale_midpoint = self._scl.size // 2
         finish_pow = int(ceil(log(finish, 2)))
-        result_list = pink_noise(finish_pow, var)
+        result_list = pink_noise(finish_pow, var, self._rng)
         offset = -1 * (max(result_list) // 2)
         for blah in range(start, finish):
             randnum = scale_midpoint + (result_list[blah - 1] + offset)
@@ -255,16 +651,24 @@ class Pystepseq:
                 if chance_tie >= randint(1, 100):  # for tie
                     randnum = -1
                 else:
-                    randnum = self.note_list[(blah - 1) % self.end]
+                    randnum = self._previous(lst, blah, scale_midpoint)
             try:
-                self.note_list[blah] = randnum
+                lst[blah] = randnum
             except IndexError:
-                self.note_list.append(randnum)
+                lst.append(randnum)
+        return lst
 
-    def _vol_white(self, start, finish=None):
+    def _vol_white(self, start, finish=None, lst=None):
         """create white noise shaped volume contour"""
         if finish is None:
             finish = len(self.len_list)
+        lst = list(self._vol_list if lst is None else lst)
+        if self._np_rng is not None:
+            values = contours.vol_white(
+                self._np_rng, finish - start, self.vol_depth, self.space
+            )
+            return _splice(lst, start, finish, values)
+        randint = self._rng.randint
         var = self.vol_depth
         chance = self.space
         for blah in range(start, finish):
@@ -276,14 +680,25 @@ class Pystepseq:
             if chance >= randint(1, 100):  # for space
                 randnum = 0
             try:
-                self.vol_list[blah] = randnum
+                lst[blah] = randnum
             except IndexError:
-                self.vol_list.append(randnum)
+                lst.append(randnum)
+        return lst
 
-    def _vol_brown(self, start, finish=None):
+    def _vol_brown(self, start, finish=None, lst=None):
         """create brown noise shaped volume contour"""
         if finish is None:
             finish = len(self.len_list)
+        lst = list(self._vol_list if lst is None else lst) or [64]
+        if self._np_rng is not None:
+            if start == 0:
+                start = 1
+            first = self._previous(lst, start, 64)
+            values = contours.vol_brown(
+                self._np_rng, finish - start, self.vol_depth, self.space, first
+            )
+            return _splice(lst, start, finish, values)
+        randint = self._rng.randint
         var = self.vol_depth
         chance = self.space
         if start == 0 and finish == 1:
@@ -291,7 +706,7 @@ class Pystepseq:
             finish = 2
         for blah in range(start, finish):
             offset = randint(-var, var)
-            current = self.vol_list[blah - 1]
+            current = lst[blah - 1]
             if chance >= randint(1, 100):
                 new = 0
             else:
@@ -301,17 +716,25 @@ class Pystepseq:
             if new < 0:
                 new = current - offset
             try:
-                self.vol_list[blah] = new
+                lst[blah] = new
             except IndexError:
-                self.vol_list.append(blah)
+                lst.append(new)
+        return lst
 
-    def _vol_pink(self, start, finish=None):
+    def _vol_pink(self, start, finish=None, lst=None):
         """create pink noise shaped volume contour"""
         if finish is None:
             finish = len(self.len_list)
+        lst = list(self._vol_list if lst is None else lst)
+        if self._np_rng is not None:
+            values = contours.vol_pink(
+                self._np_rng, start, finish, self.vol_depth, self.space
+            )
+            return _splice(lst, start, finish, values)
+        randint = self._rng.randint
         var = self.vol_depth
         chance = self.space
-        result_list = pink_noise(5, var)
+        result_list = pink_noise(5, var, self._rng)
         offset = -1 * (max(result_list) // 2)
         for blah in range(start, finish):
             randnum = 64 + (result_list[blah - 1] + offset)
@@ -322,12 +745,12 @@ class Pystepseq:
             if chance >= randint(1, 100):  # for space
                 randnum = 0
             try:
-                self.vol_list[blah] = randnum
+                lst[blah] = randnum
             except IndexError:
-                self.vol_list.append(randnum)
+                lst.append(randnum)
+        return lst
 
-    def randomize_lengths(self, choice_list=None):
-        """randomize lengths"""
+    def _make_lengths(self, choice_list=None):
         # give a sensible default if none is given:
         if choice_list is None:
             choice_list = [6, 6, 6, 6, 6, 6, 6, 6, 12, 12, 12, 18, 18, 24]
@@ -345,38 +768,46 @@ class Pystepseq:
             if not choice_list:
                 pick = leftover
             else:
-                pick = choice(choice_list)
+                pick = self._rng.choice(choice_list)
             outarr.append(pick)
             total += pick
+        return outarr
+
+    def _make_gates(self, count, choice_list=None):
+        if choice_list is None:
+            return [100 for x in range(count)]
+        return [self._rng.choice(choice_list) for i in range(count)]
+
+    def _make_volumes(self, count, choice_list=None):
+        if choice_list is None:
+            start = 1 if self.vol_noise == "brown" else 0
+            return getattr(self, "_vol_%s" % self.vol_noise)(start, count)
+        return [self._rng.choice(choice_list) for i in range(count)]
+
+    def _make_notes(self, count, choice_list=None):
+        if choice_list is None:
+            start = 1 if self.note_noise == "brown" else 0
+            return getattr(self, "_note_%s" % self.note_noise)(start, count)
+        return [self._rng.choice(choice_list) for i in range(count)]
+
+    def randomize_lengths(self, choice_list=None):
+        """randomize lengths"""
         # we now have a replacement rhythm list. Set it!
-        self.len_list = outarr
+        self.len_list = self._make_lengths(choice_list)
         # set the endpoint
         self.end = len(self.len_list)
 
     def randomize_gates(self, choice_list=None):
         """randomize gate lengths"""
-        if choice_list is None:
-            self.gate_list = [100 for x in self.len_list]
-        else:
-            self.gate_list = [choice(choice_list) for i in self.len_list]
+        self.gate_list = self._make_gates(len(self.len_list), choice_list)
 
     def randomize_volumes(self, choice_list=None):
         """randomize volumes"""
-        if choice_list is None:
-            start = 1 if self.vol_noise == "brown" else 0
-            finish = len(self.len_list)
-            getattr(self, "_vol_%s" % self.vol_noise)(start, finish)
-        else:
-            self.vol_list = [choice(choice_list) for i in self.len_list]
+        self.vol_list = self._make_volumes(len(self.len_list), choice_list)
 
     def randomize_notes(self, choice_list=None):
         """randomize notes"""
-        if choice_list is None:
-            start = 1 if self.note_noise == "brown" else 0
-            finish = len(self.len_list)
-            getattr(self, "_note_%s" % self.note_noise)(start, finish)
-        else:
-            self.note_list = [choice(choice_list) for i in self.len_list]
+        self.note_list = self._make_notes(len(self.len_list), choice_list)
 
     def randomize_drums(self, notes=None, vols=None):
         """special method for drum sounds (snare, cymbals, etc.)"""
@@ -385,8 +816,8 @@ class Pystepseq:
             notes = [2, 3, 4, 5]
         if vols is None:
             vols = [25, 30, 40, 50, 60, 70, 80, 50, 40]
-        self.note_list = [choice(notes) for x in range(32)]
-        self.vol_list = [choice(vols) for x in range(32)]
+        self.note_list = [self._rng.choice(notes) for x in range(32)]
+        self.vol_list = [self._rng.choice(vols) for x in range(32)]
 
     def init_random_lists(self):
         self.randomize_lengths()
@@ -394,71 +825,177 @@ class Pystepseq:
         self.randomize_volumes()
         self.randomize_notes()
 
-    def looper(self):
-        """The looper is the heart of the sequencer"""
-        trigger = 0
+    def preroll(self, count):
+        """Generate `count` candidate variations (lengths, gates, volumes
+        and notes) ahead of time, so that `variation` during a
+        performance is only a pop from the pool.
+        """
+        pool = []
+        for i in range(count):
+            lens = self._make_lengths()
+            pool.append(
+                (
+                    lens,
+                    self._make_gates(len(lens)),
+                    self._make_volumes(len(lens)),
+                    self._make_notes(len(lens)),
+                )
+            )
+        self._pool = pool
+
+    def variation(self, notes=1, vols=1, lengths=1, gates=1):
+        """The selected lists of a new variation, as a dict of fields to
+        stage (see `snapshot`): the next pre-rolled one if there is one and
+        new lengths are wanted (the pool's lists fit its own lengths only),
+        otherwise freshly generated. The voice itself isn't changed."""
+        if self._pool and lengths:
+            lens, gate_list, vol_list, note_list = self._pool.pop()
+        else:
+            lens = self._make_lengths() if lengths else self._len_list
+            count = len(lens)
+            gate_list = self._make_gates(count) if gates else None
+            vol_list = self._make_volumes(count) if vols else None
+            note_list = self._make_notes(count) if notes else None
+        fields = {}
+        if lengths:
+            fields["len_list"] = lens
+            fields["end"] = len(lens)
+        if gates:
+            fields["gate_list"] = gate_list
+        if vols:
+            fields["vol_list"] = vol_list
+        if notes:
+            fields["note_list"] = note_list
+        return fields
+
+    def _looper_init(self):
         self._trigger_count = 0
         self._step = -1
         self._cycle_idx = -1
         self._old_note = 60  # dummy
         self._bend = 8192
         self._note_length = 24  # init dummy
+
+    def _note_start(self, sound=True):
+        """advance to the next step and sound its note (or, when catching
+        up on lost ticks, only silence the old one)"""
+        program = self._program
+        self._step = (self._step + 1) % len(program)
+        # do we have to change slots?
+        if (self._requested_slot != self._current_slot) and (self._step == 0):
+            self._data_update()
+            program = self._program
+        elif self._step == 0 and self._pending is not None:
+            if self._pending[1] == PATTERN_END:
+                self._apply_pending()
+                self._step = 0
+                program = self._program
+        #####
+        self._note_length, self._gate_cutoff, note, bend, vol = program[self._step]
+        chn, midi = self.chn, self._midi
+        midi.note_off(chn, self._old_note)
+        if sound:
+            if bend != self._bend:
+                midi.pitch_bend(chn, bend)
+                self._bend = bend
+            midi.note_on(chn, note, vol)
+        self._old_note = note
+
+    def _looper_tick(self, cyclen, sound=True):
+        """process a single trigger from the tempotrigger"""
+        # proceed if it's the first of a note length, and we're running
+        if self._trigger_count == 0:
+            self._note_start(sound)
+        # turn note off if the gate value indicates:
+        elif self._trigger_count == self._gate_cutoff:
+            self._midi.note_off(self.chn, self._old_note)
+        self._trigger_count = (self._trigger_count + 1) % self._note_length
+        self._cycle_idx = (self._cycle_idx + 1) % cyclen
+
+    def _next_event(self, sound=True):
+        """Process the event that is due at the current trigger, and return
+        how many triggers will pass before this voice needs attention again.
+        This is what the Scheduler uses instead of `_looper_tick`.
+        """
+        if self._trigger_count == 0:
+            self._note_start(sound)
+        else:
+            self._midi.note_off(self.chn, self._old_note)
+        if self._trigger_count < self._gate_cutoff < self._note_length:
+            delta = self._gate_cutoff - self._trigger_count
+        else:
+            delta = self._note_length - self._trigger_count
+        self._trigger_count = (self._trigger_count + delta) % self._note_length
+        return delta
+
+    def _looper_finish(self):
+        self._midi.note_off(self.chn, self._old_note)
+        self._step = -1
+        if self._pending is not None:  # stopped before it came due
+            self._apply_pending()
+
+    def looper(self):
+        """The looper is the heart of the sequencer"""
+        self._looper_init()
+        receiver = self._receiver
+        ticks = self.ticks
+        ticks.restart()
         while (self._runstate == 1) or (self._cycle_idx != 0):
-            trigger = self._receiver.recv(9)
-            triggernum, cyclen = trigger.split(b"|")
-            # proceed if it's the first of a note length, and we're running
-            if self._trigger_count == 0:
-                self._step = (self._step + 1) % self.end
-                # do we have to change slots?
-                if (self._requested_slot != self._current_slot) and (self._step == 0):
-                    self._data_update()
-                #####
-                self._note_length = int(self.len_list[self._step % len(self.len_list)])
-                self._vol = self.vol_list[self._step % len(self.vol_list)]
-                self._gate = self.gate_list[self._step % len(self.gate_list)]
-                self._gate_cutoff = int(round(self._note_length * (self._gate / 100)))
-                self._note_index = self.note_list[self._step % len(self.note_list)]
-                # protect against < 0
-                if self._note_length < 1:
-                    self._note_length = 1
-                note_off(int(self.chn), int(self._old_note))
-                self._note = self._scl.get_note(self._note_index)
-                if isinstance(self._note, tuple):
-                    self._note, self._bend = self._note[0], self._note[1]
-                    if self._vol > 0:
-                        pitch_bend(int(self.chn), int(self._bend))
-                    note_on(int(self.chn), int(self._note), int(self._vol))
-                else:
-                    if self._bend != 8192:
-                        pitch_bend(int(self.chn), int(self._bend))
-                        self._bend = 8192
-                    note_on(int(self.chn), int(self._note), int(self._vol))
-                self._old_note = self._note
-            # turn note off if the gate value indicates:
-            elif self._trigger_count == self._gate_cutoff:
-                note_off(int(self.chn), int(self._old_note))
-            self._trigger_count = (self._trigger_count + 1) % self._note_length
-            self._cycle_idx = (self._cycle_idx + 1) % int(cyclen)
+            triggernum, cyclen = receiver.recv()
+            stats = self.stats
+            if stats is not None:
+                woke = time.monotonic_ns()
+            count = ticks.check(receiver.seq)
+            if count == 0:
+                continue  # late or duplicate
+            pending = self._pending
+            if pending is not None and self._pending_due(receiver.seq, triggernum):
+                self._apply_pending()
+            set_event_time(tick_time(receiver.timestamp))
+            # catch up on lost ticks without sounding them, to stay in phase:
+            for i in range(count - 1):
+                self._looper_tick(cyclen, sound=False)
+            if stats is None:
+                self._looper_tick(cyclen)
+            else:
+                trigger_count = self._trigger_count
+                emitted = trigger_count == 0 or trigger_count == self._gate_cutoff
+                self._looper_tick(cyclen)
+                stats.tick(receiver.timestamp, woke, time.monotonic_ns(), emitted)
 
         # upon receiving a kill signal:
-        note_off(self.chn, self._old_note)
-        self._step = -1
+        self._looper_finish()
+
+    def play(self, immediately=False, done=None):
+        """Start playing at the next cycle boundary, or right away. `done`
+        is called once the voice has started (only with a scheduler)."""
+        if self._runstate != 0:
+            if done is not None:
+                done()
+            return
+        self._runstate = 1
+        if self._scheduler is not None:
+            # the scheduler waits for the boundary, so we don't block here:
+            self._scheduler.add(self, at_boundary=not immediately, done=done)
+            return
+        if self._receiver is None:
+            self._receiver = open_tick_receiver(self._MYGROUP, self._MYPORT)
+        if not immediately:
+            while True:
+                num, cyclen = self._receiver.recv()
+                if num == cyclen - 1:
+                    break
+        _thread.start_new_thread(self.looper, ())
 
-    def play(self, immediately=False):
-        if self._runstate == 0:
-            self._runstate = 1
-            if not immediately:
-                while True:
-                    packet = self._receiver.recv(9)
-                    num, cyclen = packet.split(b"|")
-                    if int(num) == int(cyclen) - 1:
-                        break
-            _thread.start_new_thread(self.looper, ())
-
-    def stop(self, immediately=False):
+    def stop(self, immediately=False, done=None):
         if self._runstate == 0:
+            if done is not None:
+                done()
             return
-        if not immediately:
+        if self._scheduler is not None:
+            self._runstate = 0
+            self._scheduler.remove(self, immediately, done)
+        elif not immediately:
             self._runstate = 0
         else:
             self._runstate = 0
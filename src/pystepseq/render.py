@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#       render.py
+#
+#       Copyright 2013-2019 Aaron Krister Johnson <akjmicro@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+"""Offline rendering of voices to a Standard MIDI File, as fast as the
+CPU allows rather than in real time. Instead of listening to the multicast
+Tempotrigger, a copy of each voice is stepped through `_next_event`, the
+way the Scheduler steps it, against a virtual clock counted in triggers,
+which become the file's ticks. Slot switches queued on the voice, and
+settings a Transaction has left pending on it, happen in the file where
+they would happen when played.
+"""
+
+# modules needed:
+import copy
+import time
+
+# my modules:
+from pystepseq.lib.smf import SmfWriter
+from pystepseq.pystepseq import SLOT_FIELDS, DataSlot
+
+
+class _Recorder:
+    """Stands in for midi_functions as a rendered voice's output, and
+    collects its events as (tick, status, data1, data2) tuples. Note-offs
+    for notes that aren't sounding (the looper sends those freely) are
+    left out."""
+
+    __slots__ = ["tick", "events", "_sounding"]
+
+    def __init__(self):
+        self.tick = 0
+        self.events = []
+        self._sounding = set()
+
+    def note_on(self, channel, note, volume):
+        self.events.append((self.tick, 0x90 | channel, note, volume))
+        self._sounding.add(note)
+
+    def note_off(self, channel, note):
+        if note in self._sounding:
+            self._sounding.discard(note)
+            self.events.append((self.tick, 0x80 | channel, note, 0))
+
+    def pitch_bend(self, channel, bend):
+        self.events.append((self.tick, 0xE0 | channel, bend & 127, bend >> 7))
+
+
+def _own_copy(staged):
+    """`staged` (see Pystepseq.stage_slot) with a DataSlot of its own:
+    switching to a slot takes its scale, which the voice itself still
+    needs for when it switches."""
+    if staged is None:
+        return None
+    num, data_slot, rng, np_rng = staged
+    data_slot = DataSlot(**{k: getattr(data_slot, k) for k in SLOT_FIELDS})
+    data_slot.prepare()
+    return num, data_slot, rng, np_rng
+
+
+def render_voice(voice, total_ticks, seq=0, cycle_idx=-1, cycle_len=192):
+    """The (tick, status, data1, data2) events that `voice` would play
+    over `total_ticks` triggers from its first step, in time order.
+    Tick 0 of the render stands for the clock tick after the one with
+    sequence number `seq` and cycle index `cycle_idx` (those of the
+    Tempotrigger, for when pending changes are due). The voice itself
+    isn't changed; notes still sounding are turned off at the end."""
+    out = _Recorder()
+    render = copy.copy(voice)
+    render._midi = out
+    render.stats = None
+    render._staged = _own_copy(voice._staged)
+    if voice._pending is not None:
+        target, tick, staged, edits = voice._pending
+        render._pending = target, tick, _own_copy(staged), edits
+    render._looper_init()
+    now = due = 0
+    while now < total_ticks:
+        if render._pending is not None:
+            triggernum = (cycle_idx + 1 + now) % cycle_len
+            if render._pending_due(seq + 1 + now, triggernum):
+                render._apply_pending()
+                due = now  # the pattern starts over
+        if now == due:
+            out.tick = now
+            due = now + render._next_event()
+        # with nothing pending, skip straight to the next event:
+        now = now + 1 if render._pending is not None else due
+    out.tick = total_ticks
+    render._looper_finish()
+    return out.events
+
+
+def render_song(
+    instances, filename, seconds, tempo=120, triggers_per_qn=24, clock=None
+):
+    """Render `seconds` of every voice in `instances` (a dict, like
+    main.active_instances) into a format 1 Standard MIDI File: a tempo
+    track, then one track per voice. With the Tempotrigger as `clock`,
+    changes pending on the voices come in on the ticks they're due.
+    Returns the time taken."""
+    start = time.perf_counter()
+    total_ticks = int(round(seconds * tempo / 60.0 * triggers_per_qn))
+    position = {}
+    if clock is not None:
+        position = {
+            "seq": clock.seq,
+            "cycle_idx": clock.cycle_idx,
+            "cycle_len": clock.cycle_len,
+        }
+    writer = SmfWriter(filename, triggers_per_qn)
+    writer.start_track()
+    writer.tempo(0, tempo)
+    for name, voice in instances.items():
+        if not voice._program:
+            continue
+        writer.start_track(name)
+        writer.events(render_voice(voice, total_ticks, **position))
+    writer.close()
+    return time.perf_counter() - start
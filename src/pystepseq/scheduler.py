@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#       scheduler.py
+#
+#       Copyright 2013-2019 Aaron Krister Johnson <akjmicro@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+# modules needed:
+import _thread
+import time
+from collections import deque
+
+# my modules:
+from . import constants
+from .lib import midi_functions
+from .lib.histogram import LoopStats
+from .tempotrigger import TickTracker, open_tick_receiver
+
+
+class Scheduler:
+    """A single thread that receives every Tempotrigger tick once and steps
+    all of the playing voices, instead of running one looper thread (and
+    one socket read) per voice.
+
+    Voices are kept on a timing wheel keyed by tick count, so a tick only
+    costs work for the voices that actually have an event due on it. The
+    MIDI events of a tick are batched and written out with one call.
+    """
+
+    def __init__(self, group="225.0.0.250", port=None):
+        self.runstate = 0
+        self._MYGROUP = group
+        self._MYPORT = port if port is not None else constants.DEFAULT_MULTICAST_PORT
+        self._receiver = None  # opened by `run`; AsyncRuntime feeds ticks itself
+        self._now = 0  # ticks received since the scheduler started
+        self._wheel = {}  # tick -> [(voice, token), ...] due on that tick
+        self._tokens = {}  # voice -> token of its live wheel entry
+        self._serial = 0
+        self._starting = []  # (voice, done) to start on the next cycle boundary
+        self._stopping = {}  # voice -> done, to retire on the next cycle boundary
+        self._applying = []  # voices with a Transaction's settings pending
+        self.seq = 0  # sequence number of the tick being stepped
+        # play/stop requests from the REPL thread; deque ops are atomic:
+        self._requests = deque()
+        self.ticks = TickTracker()
+        self.stats = LoopStats() if constants.INSTRUMENT else None
+
+    def add(self, voice, at_boundary=False, done=None):
+        """Start stepping `voice` on the next tick, or on the next cycle
+        boundary. `done` is called once it has started."""
+        action = "play_at_boundary" if at_boundary else "play"
+        self._requests.append((voice, action, done))
+
+    def remove(self, voice, immediately=False, done=None):
+        """Stop stepping `voice`, at the next cycle boundary by default.
+        `done` is called once it has stopped."""
+        self._requests.append((voice, "stop_now" if immediately else "stop", done))
+
+    def apply(self, voice):
+        """Switch `voice` to its pending settings (see Pystepseq.stage) on
+        the tick they are due."""
+        self._requests.append((voice, "apply", None))
+
+    def _start(self, voice, done):
+        voice._looper_init()
+        self._serial += 1
+        self._tokens[voice] = self._serial
+        self._wheel.setdefault(self._now, []).append((voice, self._serial))
+        self._stopping.pop(voice, None)
+        if done is not None:
+            done()
+
+    def _handle_requests(self, boundary):
+        while self._requests:
+            voice, action, done = self._requests.popleft()
+            if action == "play":
+                self._start(voice, done)
+            elif action == "apply":
+                self._applying.append(voice)
+            elif action == "play_at_boundary":
+                self._starting.append((voice, done))
+            else:
+                # a voice still waiting to start doesn't start after all:
+                self._starting = [(v, d) for v, d in self._starting if v is not voice]
+                if action == "stop_now":
+                    self._retire(voice)
+                    if done is not None:
+                        done()
+                else:
+                    self._stopping[voice] = done
+        if boundary:
+            if self._stopping:
+                for voice, done in self._stopping.items():
+                    self._retire(voice)
+                    if done is not None:
+                        done()
+                self._stopping.clear()
+            if self._starting:
+                starting, self._starting = self._starting, []
+                for voice, done in starting:
+                    self._start(voice, done)
+
+    def _apply_due(self, triggernum):
+        waiting = []
+        for voice in self._applying:
+            if voice._pending is None:
+                continue
+            if not voice._pending_due(self.seq, triggernum):
+                waiting.append(voice)
+                continue
+            voice._apply_pending()
+            if voice in self._tokens:
+                # the pattern starts over, so its next event is now:
+                self._serial += 1
+                self._tokens[voice] = self._serial
+                self._wheel.setdefault(self._now, []).append((voice, self._serial))
+        self._applying = waiting
+
+    def _retire(self, voice):
+        # dropping the token orphans whatever wheel entry the voice still has
+        if self._tokens.pop(voice, None) is not None:
+            voice._looper_finish()
+
+    def tick(self, triggernum, cyclen, sound=True):
+        """step every voice that has an event due on this tick; returns
+        whether any was due"""
+        self._handle_requests(triggernum == 0)
+        if self._applying:
+            self._apply_due(triggernum)
+        due = self._wheel.pop(self._now, None)
+        if due:
+            now, wheel, tokens = self._now, self._wheel, self._tokens
+            for voice, token in due:
+                if tokens.get(voice) != token:
+                    continue
+                when = now + voice._next_event(sound)
+                if when in wheel:
+                    wheel[when].append((voice, token))
+                else:
+                    wheel[when] = [(voice, token)]
+        midi_functions.flush()
+        self._now += 1
+        return bool(due)
+
+    def receive(self, triggernum, cyclen, seq):
+        """Step a tick from the clock. Ticks that were lost are stepped
+        first, silently, so the voices stay in phase; late and duplicate
+        ticks are dropped. Either is also counted on each playing voice.
+        Returns whether anything was due on the tick."""
+        ticks = self.ticks
+        late, duplicate = ticks.late, ticks.duplicate
+        count = ticks.check(seq)
+        if count != 1:
+            for voice in self._tokens:
+                voice.ticks.dropped += max(count - 1, 0)
+                voice.ticks.late += ticks.late - late
+                voice.ticks.duplicate += ticks.duplicate - duplicate
+        for k in range(count - 1, 0, -1):
+            self.seq = seq - k
+            self.tick((triggernum - k) % cyclen, cyclen, sound=False)
+        if count:
+            self.seq = seq
+            return self.tick(triggernum, cyclen)
+        return False
+
+    def loop(self):
+        receiver = self._receiver
+        self.ticks.restart()
+        midi_functions.set_batching(True)
+        while self.runstate == 1:
+            triggernum, cyclen = receiver.recv()
+            stats = self.stats
+            if stats is not None:
+                woke = time.monotonic_ns()
+            midi_functions.set_batch_time(midi_functions.tick_time(receiver.timestamp))
+            emitted = self.receive(triggernum, cyclen, receiver.seq)
+            if stats is not None:
+                stats.tick(receiver.timestamp, woke, time.monotonic_ns(), emitted)
+        midi_functions.set_batching(False)
+
+    def run(self):
+        if self.runstate == 0:
+            if self._receiver is None:
+                self._receiver = open_tick_receiver(self._MYGROUP, self._MYPORT)
+            self.runstate = 1
+            _thread.start_new_thread(self.loop, ())
+
+    def stop(self):
+        if self.runstate == 1:
+            self.runstate = 0
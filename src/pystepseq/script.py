@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#       script.py
+#
+#       Copyright 2013-2019 Aaron Krister Johnson <akjmicro@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+"""Headless mode: running a script of commands instead of the REPL, for
+unattended installations. A script has one line of commands per line, in
+the same syntax as at the prompt, plus these directives:
+
+    @section NAME   name the part that follows, for the log
+    @wait SECONDS   pause; waits are kept to an absolute timeline, so
+                    lateness doesn't build up over a long run
+    @cycles COUNT   pause until COUNT more cycle boundaries have gone by
+    @loop           start again from the top, forever
+
+Blank lines and lines starting with '#' are skipped. Every section start
+is logged with a timestamp, and timing statistics are logged after each
+pass through the script and when it ends.
+"""
+
+# modules needed:
+import signal
+import sys
+import time
+
+# my modules:
+from . import main
+from .lib.histogram import Histogram
+
+DIRECTIVES = ["section", "wait", "cycles", "loop"]
+
+
+def read_script(filename):
+    """Parse a script into a list of (line number, directive, argument)
+    entries; a line of commands has None as its directive. Mistakes are
+    reported now, rather than hours into a run."""
+    entries = []
+    with open(filename) as infile:
+        for lineno, line in enumerate(infile, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if not line.startswith("@"):
+                entries.append((lineno, None, line))
+                continue
+            directive, _, arg = line[1:].partition(" ")
+            arg = arg.strip()
+            if directive not in DIRECTIVES:
+                raise ValueError(
+                    "%s:%i: unknown directive @%s" % (filename, lineno, directive)
+                )
+            if directive in ("wait", "cycles"):
+                try:
+                    arg = float(arg) if directive == "wait" else int(arg)
+                except ValueError:
+                    raise ValueError(
+                        "%s:%i: @%s needs a number" % (filename, lineno, directive)
+                    )
+            entries.append((lineno, directive, arg))
+    return entries
+
+
+class ScriptRunner:
+    """Runs the entries of a script, keeping time and logging as it goes."""
+
+    def __init__(self, filename, out=None):
+        self.filename = filename
+        self.entries = read_script(filename)
+        self.out = out if out is not None else sys.stdout
+        self.passes = 0
+        self.errors = 0
+        self.command_time = Histogram("command time")
+        self.wait_late = Histogram("wait lateness")
+        self.cycle_late = Histogram("cycle wait lateness")
+        self._start_ns = 0
+        self._deadline_ns = 0  # where the timeline of @waits has got to
+
+    def log(self, message):
+        elapsed = (time.monotonic_ns() - self._start_ns) / 1e9
+        self.out.write("[%12.3fs] %s\n" % (elapsed, message))
+        self.out.flush()
+
+    def report(self):
+        self.log("pass %i done, %i command errors" % (self.passes, self.errors))
+        for histogram in (self.command_time, self.wait_late, self.cycle_late):
+            self.log(histogram.report(scale=1000000, unit="ms"))
+
+    def wait(self, seconds):
+        """sleep until `seconds` after the last wait's deadline"""
+        self._deadline_ns += int(seconds * 1e9)
+        while True:
+            left = self._deadline_ns - time.monotonic_ns()
+            if left <= 0:
+                break
+            time.sleep(left / 1e9)
+        self.wait_late.record(time.monotonic_ns() - self._deadline_ns)
+
+    def wait_cycles(self, count):
+        """sleep until `count` more cycle boundaries have gone by; the
+        timeline of @waits starts over from there"""
+        trig = main.trig
+        target = trig.seq_of(0, 1)
+        if not target:
+            self.log("the clock isn't running; not waiting for cycles")
+            return
+        target += (count - 1) * trig.cycle_len
+        while True:
+            left = target - trig.seq
+            if left <= 0:
+                break
+            # sleep most of the way, then look more often:
+            time.sleep(max((left - 1.5) * trig.sleep_time, 0.0005))
+        now = time.monotonic_ns()
+        self.cycle_late.record(now - trig._last_send_ns)
+        self._deadline_ns = now
+
+    def run_command(self, lineno, line):
+        start = time.perf_counter_ns()
+        try:
+            main.command_parser(line)
+        except main.INPUT_ERRORS as e:
+            self.errors += 1
+            self.log("line %i: error in %r: %s" % (lineno, line, e))
+        self.command_time.record(time.perf_counter_ns() - start)
+
+    def run(self):
+        """run the script through (over and over, with @loop)"""
+        self._start_ns = self._deadline_ns = time.monotonic_ns()
+        self.log("running %s" % self.filename)
+        while True:
+            looping = False
+            for lineno, directive, arg in self.entries:
+                if directive is None:
+                    self.run_command(lineno, arg)
+                elif directive == "section":
+                    self.log("section %s" % arg)
+                elif directive == "wait":
+                    self.wait(arg)
+                elif directive == "cycles":
+                    self.wait_cycles(arg)
+                elif directive == "loop":
+                    looping = True
+                    break
+            self.passes += 1
+            self.report()
+            if not looping:
+                return
+
+
+def run_script(filename):
+    """start up, run the script at `filename`, and shut down"""
+    runner = ScriptRunner(filename)
+    # a service manager stops us with SIGTERM; shut down cleanly for that too:
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    main.start()
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        runner.log("interrupted")
+        runner.report()
+    finally:
+        main.shutdown()
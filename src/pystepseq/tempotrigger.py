@@ -28,50 +28,175 @@ import time
 
 # my modules:
 from . import constants
+from .lib.histogram import Histogram
+
+# The tick packet: version, tick index, cycle length, tempo, the sender's
+# time.monotonic_ns() at send, and a sequence number that never wraps.
+TICK_VERSION = 1
+TICK_PACKET = struct.Struct("!B3xIIdqQ")
+
+# The shared memory clock block: a seqlock counter, which is odd while the
+# Tempotrigger is writing, then the latest tick packet, then the
+# monotonic_ns() by which the next tick is due.
+SHM_LOCK = struct.Struct("=Q")
+SHM_NEXT = struct.Struct("=q")
+SHM_PACKET_AT = SHM_LOCK.size
+SHM_NEXT_AT = SHM_PACKET_AT + TICK_PACKET.size
+SHM_SIZE = SHM_NEXT_AT + SHM_NEXT.size
+SHM_POLL = 0.00005  # seconds between looks once the next tick is due
 
 
 class Tempotrigger:
-    def __init__(self, num_triggers_per_qn=24, cycle_len=24 * 8):
+    def __init__(
+        self,
+        num_triggers_per_qn=24,
+        cycle_len=24 * 8,
+        clock_mode=constants.CLOCK_MODE,
+        spin_window=constants.CLOCK_SPIN_WINDOW,
+        transport=constants.CLOCK_TRANSPORT,
+    ):
         self.runstate = 0
         self.num_triggers_per_qn = num_triggers_per_qn
         self.cycle_len = cycle_len
         self.cycle_len_flag = self.cycle_len - 1
+        self.cycle_idx = self.cycle_len_flag  # just before 0
         self.tempo = 120
         self.sleep_time = 60.0 / (self.tempo * self.num_triggers_per_qn)
+        # "legacy" sleeps tick-to-tick, "deadline" schedules every tick against
+        # an absolute monotonic deadline so that error can't accumulate:
+        self.clock_mode = clock_mode
+        self.spin_window = spin_window  # seconds spent polling before a deadline
+        self.jitter = Histogram("tick jitter")
+        self.instrument = constants.INSTRUMENT
+        self.send_time = Histogram("tick send")  # with `instrument` on
+        self.drift_ns = 0
+        self.max_drift_ns = 0
+        self._reanchor = True
+        self._last_send_ns = 0
+        self._start_ns = 0
+        self._ideal_ns = 0
         # mcast sender stuff (for sending sync timestamps):
         self.MYPORT = constants.DEFAULT_MULTICAST_PORT
         self.MYGROUP = "225.0.0.250"
-        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender = None  # the socket is opened by `run`
         self.mygroup = self.MYGROUP
         self.ttl = struct.pack("b", 1)  # Time-to-live
+        self._packet = bytearray(TICK_PACKET.size)  # reused for every send
+        self.seq = 0
+        # same-host voices can read ticks from shared memory instead:
+        self.transport = transport
+        self._shm = None
+        self._shm_lock = 0  # the block is opened by `run`
+
+    def _open_shm(self, name):
+        from multiprocessing import shared_memory
+
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True, size=SHM_SIZE)
+        except FileExistsError:  # left over from an earlier run
+            self._shm = shared_memory.SharedMemory(name)
+        (lock,) = SHM_LOCK.unpack_from(self._shm.buf, 0)
+        self._shm_lock = lock + (lock & 1)
+
+    def _open_socket(self):
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
 
+    def _publish(self, next_ns):
+        """write the packet into the shared memory block under the seqlock"""
+        buf = self._shm.buf
+        self._shm_lock += 1  # odd: readers will retry
+        SHM_LOCK.pack_into(buf, 0, self._shm_lock)
+        buf[SHM_PACKET_AT:SHM_NEXT_AT] = self._packet
+        SHM_NEXT.pack_into(buf, SHM_NEXT_AT, next_ns)
+        self._shm_lock += 1
+        SHM_LOCK.pack_into(buf, 0, self._shm_lock)
+
+    def close(self):
+        """remove the shared memory block, if there is one"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
     def set_num_triggers(self, numtriggers):
         self.num_triggers_per_qn = numtriggers
         self.sleep_time = 60.0 / float(self.tempo * self.num_triggers_per_qn)
+        self._reanchor = True
 
     def set_tempo(self, tempo):
         self.tempo = tempo
         self.sleep_time = 60.0 / float(tempo * self.num_triggers_per_qn)
+        self._reanchor = True
 
     def set_cycle_len(self, cycle_len):
         self.cycle_len = cycle_len
         self.cycle_len_flag = self.cycle_len - 1
 
+    def set_clock_mode(self, clock_mode):
+        if clock_mode not in ("legacy", "deadline"):
+            raise ValueError("clock mode must be legacy or deadline")
+        if clock_mode != self.clock_mode and self.runstate == 1:
+            # let the running thread finish before starting the new loop:
+            self.stop()
+            time.sleep(2 * self.sleep_time)
+            self.clock_mode = clock_mode
+            self.run()
+        else:
+            self.clock_mode = clock_mode
+
+    def seq_of(self, tick=None, margin=2):
+        """The sequence number of the first tick at least `margin` ticks
+        from now whose cycle index is `tick` (or of the tick `margin` from
+        now, for None); 0 if the clock isn't running."""
+        if self.runstate != 1:
+            return 0
+        seq, cycle_idx = self.seq, self.cycle_idx
+        if tick is None:
+            return seq + margin
+        return seq + margin + (tick - cycle_idx - margin) % self.cycle_len
+
+    def _send(self):
+        self.cycle_idx = (self.cycle_idx + 1) % self.cycle_len
+        self.seq += 1
+        now = time.monotonic_ns()
+        TICK_PACKET.pack_into(
+            self._packet,
+            0,
+            TICK_VERSION,
+            self.cycle_idx,
+            self.cycle_len,
+            self.tempo,
+            now,
+            self.seq,
+        )
+        # measure against where an ideal clock would be:
+        period_ns = int(self.sleep_time * 1e9)
+        if self._shm is not None:
+            self._publish(now + period_ns)
+        else:
+            self.sender.sendto(self._packet, (self.mygroup, self.MYPORT))
+        if self._last_send_ns:
+            self.jitter.record(abs(now - self._last_send_ns - period_ns))
+            self._ideal_ns += period_ns
+        else:
+            self._start_ns = now
+        self._last_send_ns = now
+        self.drift_ns = (now - self._start_ns) - self._ideal_ns
+        if abs(self.drift_ns) > abs(self.max_drift_ns):
+            self.max_drift_ns = self.drift_ns
+        if self.instrument:
+            self.send_time.record(time.monotonic_ns() - now)
+
     def trigger(self):
-        self.cycle_idx = self.cycle_len_flag  # just before 0
+        self._last_send_ns = 0
+        self._ideal_ns = 0
+        if self.clock_mode == "deadline":
+            self._trigger_deadline()
+            return
         while self.runstate == 1:
             self.target = time.time() + self.sleep_time
-            self.cycle_idx = (self.cycle_idx + 1) % self.cycle_len
-            self.sender.sendto(
-                bytes(
-                    "".join(
-                        [repr(self.cycle_idx).zfill(4), "|", repr(self.cycle_len)]
-                    ).zfill(4),
-                    "ascii",
-                ),
-                (self.mygroup, self.MYPORT),
-            )
+            self._send()
             time.sleep(self.sleep_time - 0.006)
             # accuracy tweak loop:
             nowtime = time.time()  # starting point
@@ -79,8 +204,54 @@ class Tempotrigger:
                 time.sleep(0.0001)
                 nowtime = time.time()  # get new moving point
 
+    def _trigger_deadline(self):
+        """Send every tick at `anchor + ticks * period` on the monotonic
+        clock. We sleep until `spin_window` before the deadline and only
+        poll for that last stretch, so no core gets pinned.
+        """
+        self._reanchor = True
+        ticks = 0
+        while self.runstate == 1:
+            if self._reanchor:
+                # (re)start the deadline series, e.g. after a tempo change:
+                self._reanchor = False
+                period_ns = int(self.sleep_time * 1e9)
+                anchor_ns = time.monotonic_ns()
+                ticks = 0
+            deadline = anchor_ns + ticks * period_ns
+            spin_ns = int(self.spin_window * 1e9)
+            remaining = deadline - time.monotonic_ns()
+            if remaining > spin_ns:
+                time.sleep((remaining - spin_ns) / 1e9)
+            while time.monotonic_ns() < deadline:
+                pass
+            self._send()
+            ticks += 1
+
+    def report(self):
+        """print the clock accuracy statistics"""
+        print("clock mode: %s" % self.clock_mode)
+        print(
+            "drift: %.3fms (worst %.3fms)"
+            % (self.drift_ns / 1e6, self.max_drift_ns / 1e6)
+        )
+        print(self.jitter.report())
+        print(self.jitter.buckets_report())
+
+    def reset_stats(self):
+        self.jitter.reset()
+        self.send_time.reset()
+        self.max_drift_ns = 0
+
     def run(self):
         if self.runstate == 0:
+            if self.transport == "shm":
+                if self._shm is None:
+                    self._open_shm(constants.CLOCK_SHM_NAME)
+            elif self.sender is None:
+                self._open_socket()
+            # set before runstate, for seq_of:
+            self.cycle_idx = self.cycle_len_flag  # just before 0
             self.runstate = 1
             _thread.start_new_thread(self.trigger, ())
 
@@ -89,6 +260,194 @@ class Tempotrigger:
             self.runstate = 0
 
 
+class TickReceiver:
+    """Receives tick packets from a Tempotrigger, decoding each one out of
+    a single reusable buffer. The fields of the latest tick are kept as
+    attributes; `recv` returns just the two the loopers need.
+    """
+
+    __slots__ = ["sock", "_buf", "tick", "cycle_len", "tempo", "timestamp", "seq"]
+
+    def __init__(self, group, port):
+        self.sock = openmcastsock(group, port)
+        self._buf = bytearray(TICK_PACKET.size)
+        self.tick = -1
+        self.cycle_len = 0
+        self.tempo = 0.0
+        self.timestamp = 0
+        self.seq = 0
+
+    def recv(self):
+        """block until the next tick arrives, return (tick, cycle_len)"""
+        while True:
+            nbytes = self.sock.recv_into(self._buf)
+            if nbytes == TICK_PACKET.size and self._buf[0] == TICK_VERSION:
+                break
+            # ignore anything that isn't a tick packet we understand
+        (
+            _,
+            self.tick,
+            self.cycle_len,
+            self.tempo,
+            self.timestamp,
+            self.seq,
+        ) = TICK_PACKET.unpack_from(self._buf)
+        return self.tick, self.cycle_len
+
+    def close(self):
+        self.sock.close()
+
+
+class ShmTickReceiver:
+    """Reads ticks from the shared memory block of a Tempotrigger on the
+    same host (PYSTEPSEQ_CLOCK_TRANSPORT=shm), in this or another process,
+    with the same interface as TickReceiver. Fields are unpacked straight
+    out of the block and kept only if the seqlock didn't move meanwhile.
+    Between ticks, `recv` sleeps until shortly before the published time of
+    the next one, and only polls from there on.
+    """
+
+    # fmt: off
+    __slots__ = [
+        "name", "spin_window", "_shm", "_lock",
+        "tick", "cycle_len", "tempo", "timestamp", "seq",
+    ]
+    # fmt: on
+
+    def __init__(self, name=None, spin_window=constants.CLOCK_SPIN_WINDOW):
+        self.name = name or constants.CLOCK_SHM_NAME
+        self.spin_window = spin_window
+        self._shm = None  # attached on the first recv
+        self._lock = 0
+        self.tick = -1
+        self.cycle_len = 0
+        self.tempo = 0.0
+        self.timestamp = 0
+        self.seq = 0
+
+    def _attach(self):
+        while self._shm is None:
+            try:
+                self._shm = _attach_shm(self.name)
+            except FileNotFoundError:  # no Tempotrigger yet
+                time.sleep(0.1)
+
+    def recv(self):
+        """block until the next tick is published, return (tick, cycle_len)"""
+        if self._shm is None:
+            self._attach()
+        buf = self._shm.buf
+        spin_ns = int(self.spin_window * 1e9)
+        while True:
+            (lock,) = SHM_LOCK.unpack_from(buf, 0)
+            if lock != self._lock and not lock & 1:
+                fields = TICK_PACKET.unpack_from(buf, SHM_PACKET_AT)
+                if SHM_LOCK.unpack_from(buf, 0)[0] != lock:
+                    continue  # torn read, the writer got in
+                if fields[0] == TICK_VERSION:
+                    break
+                self._lock = lock  # not a packet we understand
+            (next_ns,) = SHM_NEXT.unpack_from(buf, SHM_NEXT_AT)
+            remaining = next_ns - time.monotonic_ns()
+            if remaining > spin_ns:
+                time.sleep((remaining - spin_ns) / 1e9)
+            elif remaining < -10000000:  # overdue: the clock is stopped
+                time.sleep(0.001)
+            else:
+                time.sleep(SHM_POLL)
+        self._lock = lock
+        _, self.tick, self.cycle_len, self.tempo, self.timestamp, self.seq = fields
+        return self.tick, self.cycle_len
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+
+class TickTracker:
+    """Follows the sequence numbers of the ticks a receiver gets, to spot
+    lost ticks (a gap), late ones (older than one already seen, i.e.
+    reordered) and duplicates, and counts each kind.
+    """
+
+    __slots__ = ["last_seq", "dropped", "late", "duplicate", "resyncs"]
+
+    # a jump forward bigger than this means the clock was restarted, not
+    # that we missed that many ticks:
+    RESYNC = 1000
+    # packets are only ever reordered by a few places, so one further back
+    # than this is from a restarted clock too, whatever seq it had reached:
+    REORDER = 16
+
+    def __init__(self):
+        self.last_seq = None
+        self.dropped = 0
+        self.late = 0
+        self.duplicate = 0
+        self.resyncs = 0
+
+    def restart(self):
+        """forget the last tick, e.g. when a voice starts playing again"""
+        self.last_seq = None
+
+    def check(self, seq):
+        """How many ticks to advance for a packet with sequence number
+        `seq`: 1 normally, more after a gap (the ticks that were lost, plus
+        this one), and 0 for a late or duplicate packet, which is ignored.
+        """
+        last = self.last_seq
+        if last is None:
+            self.last_seq = seq
+            return 1
+        gap = seq - last
+        if gap == 1:
+            self.last_seq = seq
+            return 1
+        if gap > self.RESYNC or gap < -self.REORDER or seq == 1:
+            # (a clock's first tick has seq 1, so that's always a restart)
+            self.resyncs += 1
+            self.last_seq = seq
+            return 1
+        if gap == 0:
+            self.duplicate += 1
+            return 0
+        if gap < 0:
+            self.late += 1
+            return 0
+        self.dropped += gap - 1
+        self.last_seq = seq
+        return gap
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__[1:]}
+
+
+def _attach_shm(name):
+    """Attach to an existing shared memory block without handing it to the
+    resource tracker, which would otherwise remove the block, that belongs
+    to the Tempotrigger, when this process exits."""
+    from multiprocessing import resource_tracker, shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+def open_tick_receiver(group, port):
+    """a tick receiver for the configured clock transport"""
+    if constants.CLOCK_TRANSPORT == "shm":
+        return ShmTickReceiver()
+    return TickReceiver(group, port)
+
+
 def openmcastsock(group, port):
     """create a network mcast connection for our rhythmic metronome pulse"""
     # Import modules used only here
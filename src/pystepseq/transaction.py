@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#       transaction.py
+#
+#       Copyright 2013-2019 Aaron Krister Johnson <akjmicro@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+"""Changing many voices at once. A Transaction collects edits (new lists,
+or a data slot to recall) for any number of voices and prepares them all
+up front; `commit` then hands each voice its prepared settings as a single
+reference, together with when to switch: as its own pattern comes round,
+or (with `together`) on a given tick. The looper (or the Scheduler) swaps
+them in then, so no voice ever plays a half-updated pattern, and voices
+switched together all change on the same tick.
+"""
+
+# my modules:
+from .pystepseq import PATTERN_END
+
+
+class Transaction:
+    def __init__(self, clock=None, scheduler=None):
+        self.clock = clock  # the Tempotrigger, to work out sequence numbers
+        self.scheduler = scheduler
+        self._edits = {}  # voice -> dict of changed fields
+        self._recalls = {}  # voice -> slot number
+
+    def stage(self, voice, **fields):
+        """stage changes to `voice`'s settings (any DataSlot fields)"""
+        self._recalls.pop(voice, None)
+        self._edits.setdefault(voice, {}).update(fields)
+
+    def recall(self, voice, num):
+        """stage a switch of `voice` to data slot `num`"""
+        self._edits.pop(voice, None)
+        self._recalls[voice] = num
+
+    def commit(self, together=False, tick=0, margin=2):
+        """Switch every staged voice when its pattern next comes round, or
+        with `together`, all on the next tick with cycle index `tick` (0,
+        by default, is the cycle boundary; None is simply the next tick)
+        that is at least `margin` ticks away."""
+        staged = []
+        # the slow part, before anything is handed over:
+        for voice, fields in self._edits.items():
+            staged.append((voice, voice.stage_fields(**fields), fields))
+        for voice, num in self._recalls.items():
+            slot = voice.stage_slot(num)
+            if slot is not None:
+                staged.append((voice, slot, None))
+        self._edits.clear()
+        self._recalls.clear()
+        if not together:
+            seq, tick = 0, PATTERN_END  # the voices see to that themselves
+        elif self.clock is not None:
+            seq = self.clock.seq_of(tick, margin)
+        else:
+            seq = 0
+        for voice, slot, fields in staged:
+            if voice.stage(slot, seq, tick, fields) and together:
+                if self.scheduler is not None:
+                    self.scheduler.apply(voice)
+        return len(staged)
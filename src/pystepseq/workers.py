@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#       workers.py
+#
+#       Copyright 2013-2019 Aaron Krister Johnson <akjmicro@gmail.com>
+#
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 2 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#       MA 02110-1301, USA.
+
+
+"""Spreading voices over worker processes, so that they aren't all held
+back by one interpreter's GIL. Each worker runs its own copy of the
+command parser, with its own voices and its own MIDI output, and follows
+the clock on its own (multicast and shared memory ticks reach every
+process). The main process keeps the Tempotrigger and the REPL, and sends
+each command over a pipe to the worker that hosts the voice it names.
+"""
+
+# modules needed:
+import sys
+
+# my modules:
+from . import constants
+
+
+def _worker_loop(conn):
+    """the body of a worker process: run the commands that come in"""
+    constants.WORKERS = 0  # a worker hosts voices, it doesn't shard them
+    from . import main
+
+    if main.scheduler is not None:
+        main.scheduler.run()
+    while True:
+        kind, arg = conn.recv()
+        reply = None
+        try:
+            if kind == "command":
+                main.command_parser(arg)
+            elif kind == "load":
+                filename, names = arg
+                main.load_song(filename, names)
+            elif kind == "stats":
+                reply = main.stats_dict()
+            elif kind == "slots":
+                reply = {
+                    name: [voice.slot_fields(i) for i in range(len(voice._data_slots))]
+                    for name, voice in main.active_instances.items()
+                }
+            elif kind == "quit":
+                for voice in main.active_instances.values():
+                    voice.stop(immediately=True)
+                break
+        except main.INPUT_ERRORS as e:
+            print("Error due to malformed input: %s Please try again." % e)
+        except Exception as e:  # keep the worker, and its voices, alive
+            print("Error in worker process: %r" % e)
+        sys.stdout.flush()
+        conn.send(reply)
+    conn.send(None)
+
+
+class WorkerPool:
+    """The main process's side of the workers: starts them, remembers which
+    worker hosts which voice, and routes commands accordingly."""
+
+    def __init__(self, count):
+        import multiprocessing
+
+        context = multiprocessing.get_context("spawn")
+        self.conns = []
+        self.processes = []
+        self.voices = {}  # voice name -> index of the worker hosting it
+        for i in range(count):
+            conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_loop, args=(child_conn,), daemon=True
+            )
+            process.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def _request(self, workers, kind, arg=None):
+        """send a request to some workers, wait for all of them to answer"""
+        for i in workers:
+            self.conns[i].send((kind, arg))
+        return [self.conns[i].recv() for i in workers]
+
+    def send(self, worker, comm):
+        self._request([worker], "command", comm)
+
+    def broadcast(self, comm):
+        self._request(range(len(self.conns)), "command", comm)
+
+    def assign(self, name):
+        """the worker hosting voice `name`, picking the least busy worker
+        for a new voice"""
+        if name not in self.voices:
+            counts = [0] * len(self.conns)
+            for i in self.voices.values():
+                counts[i] += 1
+            self.voices[name] = counts.index(min(counts))
+        return self.voices[name]
+
+    def dispatch(self, comm):
+        """Send a command to the worker(s) it concerns. Returns False for
+        the commands that the main process handles itself."""
+        if comm[0] in "ht" or comm[0:5] in ("load ", "save "):
+            return False
+        if comm[0:5] == "stats":
+            # the workers print (or switch on, or reset) their own, while
+            # saving gathers everything in the main process:
+            if comm[5:].split()[:1] != ["save"]:
+                self.broadcast(comm)
+            return False
+        if comm[0:7] == "render " or comm[0:6] == "record":
+            print("'%s' isn't available with worker processes" % comm.split()[0])
+        elif comm[0] in "1234567890" or comm[0] == "q":
+            self.broadcast(comm)
+        elif comm[0:7] == "zxdrums":
+            self.voices["x"] = self.assign("z")
+            self.send(self.voices["z"], comm)
+        elif comm[0:7] == "import ":
+            self.send(self.voices[comm[7:].split()[0]], comm)
+        elif comm[0] == "=":
+            if comm[1] == "t":
+                return False  # reserved, the main process says so
+            self.send(self.assign(comm[1]), comm)
+        elif comm[0] == "-":
+            if comm[1] in self.voices:
+                self.send(self.voices.pop(comm[1]), comm)
+            else:
+                print("No such active voice")
+        elif comm[0] == "`":
+            groups = {}
+            for name in comm[1:].rstrip("!").split(","):
+                name = name.strip()
+                groups.setdefault(self.voices[name], []).append(name)
+            together = "!" if comm.endswith("!") else ""
+            for worker, names in groups.items():
+                self.send(worker, "`" + ",".join(names) + together)
+        else:
+            self.send(self.voices[comm[0]], comm)
+        return True
+
+    def load(self, filename, names):
+        """have the workers load the voices `names` of a song file"""
+        by_worker = {}
+        for name in names:
+            if name not in self.voices:
+                by_worker.setdefault(self.assign(name), []).append(name)
+        for worker, worker_names in by_worker.items():
+            self.conns[worker].send(("load", (filename, worker_names)))
+        for worker in by_worker:
+            self.conns[worker].recv()
+
+    def slot_fields(self):
+        """the slot fields of every voice, as Pystepseq.slot_fields gives them"""
+        out = {}
+        for reply in self._request(range(len(self.conns)), "slots"):
+            out.update(reply)
+        return out
+
+    def stats(self):
+        """every worker's timing histograms, as main.stats_dict gives them"""
+        return self._request(range(len(self.conns)), "stats")
+
+    def close(self):
+        self._request(range(len(self.conns)), "quit")
+        for process in self.processes:
+            process.join()
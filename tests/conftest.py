@@ -0,0 +1,4 @@
+import os
+
+# no MIDI hardware (or pyportmidi) is needed to run the tests:
+os.environ.setdefault("PYSTEPSEQ_MIDI_BACKEND", "null")
@@ -0,0 +1,101 @@
+import pytest
+
+from pystepseq import main
+
+
+@pytest.fixture
+def voices(monkeypatch):
+    monkeypatch.setattr(main, "active_instances", {})
+    return main.active_instances
+
+
+def test_words_come_before_first_characters_and_voices():
+    assert main.find_handler("tt") is main.get_or_set_triggers_per_qn
+    assert main.find_handler("tt48") is main.get_or_set_triggers_per_qn
+    assert main.find_handler("t120") is main.get_or_set_tempo
+    assert main.find_handler("stats on") is main.show_stats
+
+
+def test_digits_recall_slots():
+    for comm in ("1", "0", "12", "4!"):
+        assert main.find_handler(comm) is main.slot_recall
+    assert main.find_handler("q3") is main.slot_save
+
+
+def test_two_letter_voice_commands_win_over_one_letter_ones():
+    assert main.find_handler("abb") is main.get_or_set_triggers_per_beat
+    assert main.find_handler("ab4") is main.get_or_set_beats_per_measure
+    assert main.find_handler("ard") is main.randomize_drums
+    assert main.find_handler("ar") is main.not_understood
+
+
+def test_stop_and_play_suffixes():
+    assert main.find_handler("a\\") is main.voice_stop
+    assert main.find_handler("a\\\\") is main.voice_stop_now
+    assert main.find_handler("a/") is main.voice_play
+    assert main.find_handler("a//") is main.voice_play_now
+
+
+def test_voices_named_like_commands(voices, capsys):
+    # voice names that start a command word or a first-character
+    # command can't be reached as voices, whatever follows:
+    assert main.find_handler("ttl[6]") is main.get_or_set_triggers_per_qn
+    assert main.find_handler("q/") is main.slot_save
+    main.command_parser("=t")
+    assert "reserved" in capsys.readouterr().out
+    assert "t" not in voices
+    # any other name is fine, even that of a command:
+    main.command_parser("=l;=n")
+    main.command_parser("ll[6];nnn white;nl[3]")
+    assert voices["l"].len_list == [6]
+    assert voices["n"].note_noise == "white"
+    assert voices["n"].len_list == [3]
+
+
+def test_lists_typed_at_the_prompt(voices):
+    main.command_parser("=a")
+    main.command_parser("al[2**3];an[6]*2**2")
+    assert voices["a"].len_list == [8]
+    assert voices["a"].note_list == [6, 6, 6, 6]
+    main.command_parser("av[x * 10 for x in range(4)]")
+    assert voices["a"].vol_list == [0, 10, 20, 30]
+
+
+@pytest.mark.parametrize(
+    "text, value",
+    [
+        ("[1, 2, 3]", [1, 2, 3]),
+        ("([1], [2, 3])", ([1], [2, 3])),
+        ("[x^17 - 34 for x in range(4)]", [-17, -18, -19, -20]),
+        ("[2**3]", [8]),
+        ("[6]*2**2", [6, 6, 6, 6]),
+        ("[2**x for x in range(4)]", [1, 2, 4, 8]),
+        ("2**64", 2**64),
+        ("2**-1", 0.5),
+        ("max(len([1, 2]), 1) if 1 < 2 else 0", 2),
+        ("sorted([3, 1, 2])[::-1]", [3, 2, 1]),
+    ],
+)
+def test_parse_value_accepts(text, value):
+    assert main.parse_value(text) == value
+
+
+@pytest.mark.parametrize(
+    "text, error",
+    [
+        ("2**65", ValueError),
+        ("(2**40)**40", ValueError),
+        ("(2**64)**64", ValueError),
+        ("1e300**2", ValueError),
+        ("().__class__", ValueError),
+        ("[1].append(2)", ValueError),
+        ("lambda: 0", ValueError),
+        ("__import__('os')", NameError),
+        ("open('x')", NameError),
+        ("_power(2, 3)", NameError),
+        ("[1, 2", SyntaxError),
+    ],
+)
+def test_parse_value_rejects(text, error):
+    with pytest.raises(error):
+        main.parse_value(text)
@@ -0,0 +1,22 @@
+from pystepseq.pystepseq import Pystepseq
+
+
+def test_recalled_lists_can_be_edited():
+    voice = Pystepseq(chn=0)
+    voice.note_list = [0, 1, 2, 3]
+    voice.data_slot_save(1)
+    voice.note_list = [5, 5, 5, 5]
+    voice.data_slot_save(2)
+    voice.data_slot_recall(1)
+    voice._data_update()
+    assert voice.note_list == [0, 1, 2, 3]
+    voice.note_list.append(4)
+    voice.note_list[0] = 7
+    voice.compile_program()
+    edited = voice._program
+    voice.note_list = [7, 1, 2, 3, 4]
+    assert edited == voice._program
+    # the slot itself is left as it was:
+    assert voice._slot(1).note_list == (0, 1, 2, 3)
+    for name in ("len_list", "vol_list", "gate_list"):
+        assert type(getattr(voice, name)) is list
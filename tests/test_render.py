@@ -0,0 +1,58 @@
+from pystepseq.pystepseq import Pystepseq
+from pystepseq.render import render_voice
+from pystepseq.transaction import Transaction
+
+
+def make_voice():
+    voice = Pystepseq(chn=1)
+    voice.len_list = [6]
+    voice.gate_list = [50]
+    voice.vol_list = [80]
+    voice.note_list = [0, 1, 2, 3]
+    voice.end = 4
+    return voice
+
+
+def note_ons(events):
+    return [(tick, note) for tick, status, note, vol in events if status == 0x91]
+
+
+def test_steps_and_gates():
+    events = render_voice(make_voice(), 12)
+    assert events == [
+        (0, 0x91, 48, 80),
+        (3, 0x81, 48, 0),
+        (6, 0x91, 50, 80),
+        (9, 0x81, 50, 0),
+    ]
+
+
+def test_note_off_clamped_to_the_end():
+    voice = make_voice()
+    voice.gate_list = [100]
+    voice.len_list = [40]
+    assert render_voice(voice, 30) == [(0, 0x91, 48, 80), (30, 0x81, 48, 0)]
+
+
+def test_queued_slot_switch():
+    voice = make_voice()
+    voice.data_slot_save(1)
+    voice.note_list = [4, 4, 4, 4]
+    voice.data_slot_save(2)
+    voice._step = 1  # mid-pattern
+    voice.data_slot_recall(1)
+    events = render_voice(voice, 48)
+    assert note_ons(events)[:4] == [(0, 48), (6, 50), (12, 52), (18, 53)]
+    assert voice._requested_slot == 1 and voice._current_slot == 2
+
+
+def test_pending_transaction():
+    voice = make_voice()
+    voice._runstate = 1  # as if playing
+    voice._step = 2
+    transaction = Transaction()
+    transaction.stage(voice, note_list=[4, 4, 4, 4])
+    transaction.commit(together=True, tick=10)
+    events = render_voice(voice, 24, cycle_idx=-1, cycle_len=192)
+    assert note_ons(events) == [(0, 48), (6, 50), (10, 55), (16, 55), (22, 55)]
+    assert voice._pending is not None
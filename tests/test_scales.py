@@ -0,0 +1,30 @@
+import pytest
+
+from pystepseq.lib.midi_functions import see_saw
+from pystepseq.lib.scales import MidiScale, microtonal_scales, scale_vectors
+
+
+def old_get_note(scale, index):
+    """the per-note lookup MidiScale did before it had tables"""
+    note = scale.slave[see_saw(index, scale.size - 1)]
+    bend = None
+    if scale.microtonal:
+        note, bend = note
+    note = min(max(note + scale.trans, 0), 127)
+    return note if bend is None else (note, bend)
+
+
+@pytest.mark.parametrize("name", list(scale_vectors) + microtonal_scales)
+@pytest.mark.parametrize("lo, hi, trans", [(48, 72, 0), (0, 127, 12), (30, 90, -40)])
+def test_table_matches_see_saw(name, lo, hi, trans):
+    scale = MidiScale(name, lo, hi, trans)
+    scale.set_min_max_trans(lo, hi, trans)
+    if scale.size < 2:
+        pytest.skip("see_saw needs at least two notes")
+    for index in range(-3 * scale.size, 3 * scale.size + 256):
+        assert scale.get_note(index) == old_get_note(scale, index), index
+
+
+def test_float_index():
+    scale = MidiScale("modal", 48, 72, 0)
+    assert scale.get_note(5.0) == scale.get_note(5)
@@ -0,0 +1,118 @@
+import random
+
+import pytest
+
+from pystepseq.lib import midi_functions
+from pystepseq.lib.midi_backends import RecordingBackend
+from pystepseq.pystepseq import Pystepseq
+from pystepseq.scheduler import Scheduler
+
+CYCLE = 96
+
+
+@pytest.fixture
+def recorder():
+    old = midi_functions.get_backend()
+    recorder = midi_functions.set_backend(RecordingBackend())
+    yield recorder
+    midi_functions.set_batching(False)
+    midi_functions.set_backend(old)
+
+
+def random_voices(count, seed=0):
+    rng = random.Random(seed)
+    voices = []
+    for i in range(count):
+        voice = Pystepseq(chn=i % 16, seed=rng.randrange(1 << 30))
+        steps = rng.randint(1, 12)
+        voice.len_list = [rng.choice([1, 2, 3, 6, 8, 12, 24]) for i in range(steps)]
+        voice.gate_list = [rng.choice([0, 10, 50, 90, 100]) for i in range(steps)]
+        voice.end = steps
+        voices.append(voice)
+    return voices
+
+
+def messages(recorder):
+    """what `recorder` got since the last call, in a comparable order"""
+    out = sorted(event[2:] for event in recorder.events())
+    recorder.clear()
+    return out
+
+
+def looper_run(voices, recorder, ticks):
+    """what the voices' looper threads would play, tick by tick"""
+    for voice in voices:
+        voice._looper_init()
+    out = []
+    for n in range(ticks):
+        for voice in voices:
+            voice._looper_tick(CYCLE)
+        out.append(messages(recorder))
+    for voice in voices:
+        voice._looper_finish()
+    recorder.clear()
+    return out
+
+
+def scheduler_run(scheduler, recorder, ticks, first=0, drop=()):
+    """feed `ticks` clock ticks (but not those in `drop`) to `scheduler`,
+    returning the messages of each tick"""
+    midi_functions.set_batching(True)
+    out = []
+    for n in range(first, first + ticks):
+        if n not in drop:
+            scheduler.receive(n % CYCLE, CYCLE, n + 1)
+        out.append(messages(recorder))
+    return out
+
+
+def test_same_events_as_the_loopers(recorder):
+    voices = random_voices(50)
+    expected = looper_run(voices, recorder, 400)
+    assert sum(map(len, expected)) > 1000
+    scheduler = Scheduler()
+    for voice in voices:
+        scheduler.add(voice)
+    assert scheduler_run(scheduler, recorder, 400) == expected
+
+
+def test_play_and_stop_at_the_boundary(recorder):
+    voice = random_voices(1)[0]
+    voice.len_list = [6]
+    voice.end = 1
+    scheduler = Scheduler()
+    scheduler_run(scheduler, recorder, 10)
+    scheduler.add(voice, at_boundary=True)
+    out = scheduler_run(scheduler, recorder, 2 * CYCLE, first=10)
+    note_on = 0x90 | voice.chn
+    starts = [n for n, tick in enumerate(out, 10) if any(m[0] == note_on for m in tick)]
+    assert starts[0] == CYCLE
+    scheduler.remove(voice)
+    out = scheduler_run(scheduler, recorder, 2 * CYCLE, first=10 + 2 * CYCLE)
+    sounding = [n for n, tick in enumerate(out, 10 + 2 * CYCLE) if tick]
+    # the voice plays on to the next boundary, where its last note ends:
+    assert sounding[-1] == 3 * CYCLE
+    assert out[3 * CYCLE - 10 - 2 * CYCLE] == [(0x80 | voice.chn, voice._old_note, 0)]
+
+
+def test_catching_up_on_dropped_ticks(recorder):
+    voices = random_voices(10, seed=1)
+    scheduler = Scheduler()
+    for voice in voices:
+        scheduler.add(voice)
+    expected = scheduler_run(scheduler, recorder, 300)
+    # the same again from the clock's start, but losing three ticks:
+    scheduler = Scheduler()
+    for voice in voices:
+        scheduler.add(voice)
+    out = scheduler_run(scheduler, recorder, 300, drop=(100, 101, 102))
+    assert out[:100] == expected[:100]
+    assert out[100:103] == [[], [], []]
+    # the lost ticks' note-offs come late, but no notes, and then the
+    # voices carry on in phase:
+    assert [m for m in out[103] if m[0] >= 0x90] == [
+        m for m in expected[103] if m[0] >= 0x90
+    ]
+    assert out[104:] == expected[104:]
+    assert scheduler.ticks.dropped == 3
+    assert all(voice.ticks.dropped == 3 for voice in voices)
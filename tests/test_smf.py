@@ -0,0 +1,133 @@
+from pystepseq.lib import smf
+from pystepseq.lib.smf import SmfWriter, read_smf
+
+EVENTS = [
+    (0, 0xC0, 5, 0),  # program change: two bytes
+    (0, 0x90, 60, 100),
+    (12, 0xD0, 40, 0),  # channel pressure: two bytes
+    (24, 0x80, 60, 0),
+    (24 + 2**20, 0x90, 62, 90),
+    (24 + 2**20 + 6, 0x80, 62, 0),
+]
+
+
+def write(filename, batched):
+    writer = SmfWriter(filename, 24)
+    writer.start_track("a")
+    if batched:
+        writer.events(EVENTS)
+    else:
+        for event in EVENTS:
+            writer.event(*event)
+    writer.close()
+    return writer
+
+
+def test_events_matches_event(tmp_path):
+    one, many = str(tmp_path / "one.mid"), str(tmp_path / "many.mid")
+    write(one, False)
+    writer = write(many, True)
+    with open(one, "rb") as a, open(many, "rb") as b:
+        assert a.read() == b.read()
+    assert max(writer._var_lengths) < smf._CACHED_DELTAS
+    format, division, tracks = read_smf(many)
+    assert [note[3:] for note in tracks[0]] == [(60, 100), (62, 90)]
+
+
+def reference_notes(events):
+    """the notes of (tick, status, data1, data2) events, paired up one
+    event at a time"""
+    notes = []
+    sounding = {}
+    for tick, status, note, velocity in events:
+        kind = status & 0xF0
+        if kind == 0x90 or kind == 0x80:
+            key = (status & 0x0F) << 8 | note
+            started = sounding.pop(key, None)
+            if started is not None:
+                notes.append((started[0], tick, key >> 8, note, started[1]))
+            if kind == 0x90 and velocity:
+                sounding[key] = (tick, velocity)
+    end = events[-1][0] if events else 0
+    for key, (start, velocity) in sounding.items():
+        notes.append((start, end, key >> 8, key & 0x7F, velocity))
+    return sorted(notes)
+
+
+def random_events(rng, count, chords, max_delta):
+    events = []
+    tick = 0
+    sounding = []
+    for i in range(count):
+        tick += rng.randrange(max_delta)
+        roll = rng.random()
+        if roll < 0.05:
+            events.append((tick, 0xC0 | rng.randrange(16), rng.randrange(128), 0))
+        elif roll < 0.1:
+            events.append((tick, 0xE0, rng.randrange(128), rng.randrange(128)))
+        elif sounding and (roll < 0.55 or len(sounding) > chords):
+            chn, note = sounding.pop(rng.randrange(len(sounding)))
+            if rng.random() < 0.5:
+                events.append((tick, 0x80 | chn, note, 0))
+            else:
+                events.append((tick, 0x90 | chn, note, 0))
+        else:
+            chn, note = rng.randrange(2), rng.randrange(128)
+            sounding.append((chn, note))
+            events.append((tick, 0x90 | chn, note, rng.randrange(1, 128)))
+    return events
+
+
+def test_read_notes_matches_event_by_event(tmp_path):
+    import random
+
+    rng = random.Random(5)
+    filename = str(tmp_path / "random.mid")
+    for chords, max_delta in ((0, 30), (0, 300), (3, 30), (3, 1000)):
+        for count in (0, 1, 2, 50, 2000):
+            events = random_events(rng, count, chords, max_delta)
+            writer = SmfWriter(filename, 96)
+            writer.start_track("a")
+            writer.meta(0, 0x01, b"some text")
+            writer.events(events[: count // 2])
+            writer.meta(events[count // 2][0] if events else 0, 0x06, b"marker")
+            writer.events(events[count // 2 :])
+            writer.close()
+            format, division, tracks = read_smf(filename, 0)
+            assert tracks[0] == reference_notes(events), (chords, max_delta, count)
+
+
+def test_running_status(tmp_path):
+    filename = str(tmp_path / "running.mid")
+    with open(filename, "wb") as fp:
+        track = bytes(
+            [0, 0x90, 60, 100, 10, 60, 0, 0, 62, 90, 0, 0xF0, 0x01, 0xF7, 0x81, 0x00]
+            + [62, 0, 0, 0xFF, 0x2F, 0]
+        )
+        fp.write(b"MThd" + bytes([0, 0, 0, 6, 0, 0, 0, 1, 0, 24]))
+        fp.write(b"MTrk" + len(track).to_bytes(4, "big") + track)
+    format, division, tracks = read_smf(filename)
+    assert tracks == [[(0, 10, 0, 60, 100), (10, 138, 0, 62, 90)]]
+
+
+def test_import_reads_only_the_first_track_with_notes(tmp_path):
+    import time
+
+    filename = str(tmp_path / "big.mid")
+    writer = SmfWriter(filename, 24)
+    writer.start_track()
+    writer.tempo(0, 120)
+    for chn in range(8):
+        writer.start_track("v%d" % chn)
+        events = []
+        for i in range(40000):
+            events.append((6 * i, 0x90 | chn, 60 + i % 12, 100))
+            events.append((6 * i + 3, 0x80 | chn, 60 + i % 12, 0))
+        writer.events(events)
+    writer.close()
+    start = time.perf_counter()
+    format, division, tracks = read_smf(filename)
+    elapsed = time.perf_counter() - start
+    assert [len(notes) for notes in tracks] == [0, 40000] + [0] * 7
+    assert tracks[1][:2] == [(0, 3, 0, 60, 100), (6, 9, 0, 61, 100)]
+    assert elapsed < 0.1, elapsed
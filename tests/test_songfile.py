@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+from pystepseq.lib import songfile
+from pystepseq.pystepseq import SLOT_FIELDS, DataSlot
+
+
+def slot(**changes):
+    fields = {
+        "chn": 1,
+        "end": 4,
+        "triggers_per_beat": 24,
+        "beats_per_measure": 4,
+        "scl": "modal",
+        "scl_min": 48,
+        "scl_max": 72,
+        "scl_trans": 0,
+        "len_list": [6, 12],
+        "vol_list": [80],
+        "gate_list": [50.5],
+        "note_list": [0, 1, 2, 3],
+        "note_noise": "white",
+        "note_depth": 5,
+        "note_repeat": 0,
+        "note_tie": 0,
+        "vol_noise": "white",
+        "vol_depth": 20,
+        "space": 0,
+        "seed": 1234,
+    }
+    fields.update(changes)
+    assert set(fields) == set(SLOT_FIELDS)
+    return DataSlot(**fields)
+
+
+def round_trip(data_slot):
+    fields = songfile.decode_slot(songfile.encode_slot(data_slot))
+    return {k: getattr(data_slot, k) for k in SLOT_FIELDS}, fields
+
+
+def test_round_trip():
+    before, after = round_trip(slot())
+    assert after == {k: list(v) if isinstance(v, tuple) else v for k, v in before.items()}
+
+
+def test_seeds():
+    for seed in (None, 0, -(2**63), 2**63 - 1, 2**63, -(2**80), 3**90):
+        assert round_trip(slot(seed=seed))[1]["seed"] == seed
+
+
+def test_missing_ints():
+    after = round_trip(slot(note_depth=None, space=None))[1]
+    assert after["note_depth"] is None and after["space"] is None
+    assert after["vol_depth"] == 20
+
+
+def test_version_1_records():
+    old = SimpleNamespace(**{k: getattr(slot(), k) for k in SLOT_FIELDS})
+    ints = [getattr(old, k) for k in songfile._INTS]
+    record = bytearray(songfile._SCALARS_V1.pack(*ints, True, old.seed))
+    record += songfile.encode_slot(old)[songfile._SCALARS.size :]
+    fields = songfile.decode_slot(bytes(record), version=1)
+    assert fields["seed"] == 1234 and fields["note_list"] == [0, 1, 2, 3]
+
+
+def test_song_file_context_manager(tmp_path):
+    filename = str(tmp_path / "song.pss")
+    songfile.write_song(filename, {"a": [None, slot(seed=2**70)]})
+    with songfile.SongFile(filename) as song:
+        ref = song.slot_refs("a")[1]
+        assert ref.load()["seed"] == 2**70
+    assert song._map.closed
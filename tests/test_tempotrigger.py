@@ -0,0 +1,166 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from pystepseq import tempotrigger
+from pystepseq.tempotrigger import (
+    TICK_PACKET,
+    TICK_VERSION,
+    ShmTickReceiver,
+    Tempotrigger,
+    TickReceiver,
+    TickTracker,
+)
+
+
+class _Sender:
+    """stands in for the Tempotrigger's multicast socket"""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def sendto(self, data, address):
+        self.sock.send(data)
+
+
+@pytest.fixture
+def link(monkeypatch):
+    """a Tempotrigger and a TickReceiver joined by a datagram socket pair"""
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    monkeypatch.setattr(tempotrigger, "openmcastsock", lambda group, port: theirs)
+    clock = Tempotrigger(transport="multicast")
+    clock.sender = _Sender(ours)
+    receiver = TickReceiver(clock.MYGROUP, clock.MYPORT)
+    yield clock, receiver, ours
+    ours.close()
+    theirs.close()
+
+
+def test_in_order():
+    ticks = TickTracker()
+    assert [ticks.check(seq) for seq in range(1, 6)] == [1, 1, 1, 1, 1]
+    assert ticks.as_dict()["dropped"] == 0
+
+
+def test_gap_late_and_duplicate():
+    ticks = TickTracker()
+    ticks.check(10)
+    assert ticks.check(13) == 3
+    assert ticks.check(12) == 0
+    assert ticks.check(13) == 0
+    assert (ticks.dropped, ticks.late, ticks.duplicate) == (2, 1, 1)
+
+
+def test_restart_early_in_a_session():
+    # the clock is restarted well before seq reaches RESYNC; its ticks must
+    # be followed again at once, not all counted as late:
+    ticks = TickTracker()
+    for seq in range(1, 501):
+        ticks.check(seq)
+    assert [ticks.check(seq) for seq in range(1, 5)] == [1, 1, 1, 1]
+    assert (ticks.late, ticks.resyncs) == (0, 1)
+    assert ticks.last_seq == 4
+
+
+def test_restart_with_first_tick_lost():
+    ticks = TickTracker()
+    for seq in range(1, 41):
+        ticks.check(seq)
+    assert ticks.check(3) == 1
+    assert ticks.check(4) == 1
+    assert (ticks.late, ticks.resyncs) == (0, 1)
+
+
+def test_restart_far_ahead():
+    ticks = TickTracker()
+    ticks.check(5)
+    assert ticks.check(5 + TickTracker.RESYNC + 1) == 1
+    assert (ticks.dropped, ticks.resyncs) == (0, 1)
+
+
+def test_seq_of_right_after_run():
+    clock = Tempotrigger(transport="shm")
+    assert clock.seq_of(0) == 0  # not running
+    clock.runstate = 1  # as run() leaves it, before the first tick is sent
+    assert clock.seq_of() == 2
+    assert clock.seq_of(0, margin=1) == 1  # the very next tick starts the cycle
+    assert clock.seq_of(0, margin=2) == 193
+
+
+def test_packet_round_trip(link):
+    clock, receiver, sock = link
+    clock.tempo = 97.5
+    for n in range(3):
+        clock._send()
+        assert receiver.recv() == (n, clock.cycle_len)
+        assert receiver.seq == n + 1
+        assert receiver.tempo == 97.5
+        assert receiver.timestamp == clock._last_send_ns
+
+
+def test_legacy_and_unknown_packets_are_ignored(link):
+    clock, receiver, sock = link
+    # ticks of the old ASCII format, "<cycle index>|<cycle length>":
+    sock.send(b"0012|1536")
+    sock.send(b"0012|192")
+    sock.send(TICK_PACKET.pack(TICK_VERSION + 1, 5, 192, 120.0, 0, 7))
+    sock.send(TICK_PACKET.pack(TICK_VERSION, 5, 192, 120.0, 0, 7)[:-1])
+    clock._send()
+    assert receiver.recv() == (0, 192)
+    assert receiver.seq == 1
+
+
+def test_long_cycles(link):
+    clock, receiver, sock = link
+    clock.set_cycle_len(24 * 4 * 1000)
+    clock.cycle_idx = 12344
+    clock._send()
+    assert receiver.recv() == (12345, 96000)
+
+
+def test_shared_memory_ticks():
+    clock = Tempotrigger(transport="shm")
+    clock._open_shm("pystepseq_test_%i" % os.getpid())
+    clock.sleep_time = 0.0001  # so that the reader never waits long
+    receiver = ShmTickReceiver(clock._shm.name, spin_window=0.001)
+    ticks = TickTracker()
+    published = threading.Semaphore(0)
+    read = threading.Semaphore(0)
+
+    def publish(count, in_step):
+        for n in range(count):
+            if clock.seq == 150:
+                clock.seq += 1  # a tick lost on the way
+            clock._send()
+            if in_step:
+                published.release()
+                read.acquire()
+
+    # the reader takes every tick, in turn with the writer:
+    thread = threading.Thread(target=publish, args=(200, True))
+    thread.start()
+    seqs = []
+    try:
+        for n in range(200):
+            published.acquire()
+            receiver.recv()
+            seqs.append(receiver.seq)
+            ticks.check(receiver.seq)
+            read.release()
+        thread.join()
+        assert seqs == list(range(1, 151)) + list(range(152, 202))
+        assert receiver.tick == 199 % clock.cycle_len
+        assert (ticks.dropped, ticks.late, ticks.duplicate) == (1, 0, 0)
+        # and with the writer going flat out, whatever it reads is whole:
+        thread = threading.Thread(target=publish, args=(20000, False))
+        thread.start()
+        while receiver.seq < 20201:
+            receiver.recv()
+            assert receiver.tick == (receiver.seq - 2) % clock.cycle_len
+            assert ticks.check(receiver.seq) >= 1
+    finally:
+        thread.join()
+        receiver.close()
+        clock.close()
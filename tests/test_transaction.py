@@ -0,0 +1,90 @@
+from pystepseq.pystepseq import Pystepseq
+from pystepseq.transaction import Transaction
+
+
+def playing_voice():
+    voice = Pystepseq(chn=0)
+    voice._runstate = 1  # as if its looper were running
+    voice._step = 3
+    return voice
+
+
+def test_commit_is_pending_until_applied():
+    voice = playing_voice()
+    notes = [1, 2, 3] * 6
+    transaction = Transaction()
+    transaction.stage(voice, note_list=notes)
+    assert transaction.commit() == 1
+    assert voice.note_list != notes
+    voice._apply_pending()
+    assert voice.note_list == notes
+    assert voice._step == -1
+
+
+def test_edits_before_the_switch_are_kept():
+    voice = playing_voice()
+    notes = [1, 2, 3] * 6
+    transaction = Transaction()
+    transaction.stage(voice, note_list=notes)
+    transaction.commit()
+    vols = [50] * 16
+    voice.vol_list = vols  # edited at the prompt before the boundary
+    voice._apply_pending()
+    assert voice.note_list == notes
+    assert voice.vol_list == vols
+    assert voice._program[0][4] == 50
+
+
+def test_variation_without_lengths_fits_current_lengths():
+    voice = playing_voice()
+    voice.preroll(4)
+    lens = voice.len_list
+    fields = voice.variation(lengths=0)
+    assert "len_list" not in fields
+    assert len(fields["note_list"]) == len(lens)
+    assert len(voice._pool) == 4
+
+
+def test_unedited_voice_uses_the_prepared_slot():
+    voice = playing_voice()
+    transaction = Transaction()
+    transaction.stage(voice, note_list=[4] * 16)
+    transaction.commit()
+    prepared = voice._pending[2][1].program
+    voice._apply_pending()
+    assert voice._program is prepared
+
+
+def test_switch_waits_for_the_pattern_to_come_round():
+    voice = playing_voice()
+    voice._looper_init()
+    voice._step = 3
+    notes = [1, 2, 3] * 6
+    transaction = Transaction()
+    transaction.stage(voice, note_list=notes)
+    transaction.commit()
+    while voice._step != len(voice._program) - 1:
+        voice._note_start()
+        assert voice.note_list != notes
+    voice._note_start()
+    assert voice.note_list == notes
+    assert voice._step == 0
+    assert voice._pending is None
+
+
+def test_pending_switch_while_stopping():
+    voice = playing_voice()
+    voice._looper_init()
+    notes = [1, 2, 3] * 6
+    transaction = Transaction()
+    transaction.stage(voice, note_list=notes)
+    transaction.commit(together=True)
+    voice.stop()  # the looper plays on to the cycle boundary
+    assert voice._pending is not None
+    voice._looper_finish()
+    assert voice.note_list == notes
+    assert voice._pending is None
+    # and once stopped, it switches right away:
+    transaction.stage(voice, vol_list=[50] * 16)
+    assert transaction.commit(together=True) == 1
+    assert voice.vol_list == [50] * 16
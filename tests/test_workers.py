@@ -0,0 +1,36 @@
+import pytest
+
+from pystepseq.workers import WorkerPool
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(2)
+    yield pool
+    pool.close()
+
+
+def test_dispatch(pool, capsys):
+    for comm in ("=a", "=b", "al[6, 12]", "bn[3]"):
+        assert pool.dispatch(comm)
+    assert pool.voices == {"a": 0, "b": 1}
+    assert pool.dispatch("q1")  # every worker saves its voices' slot 1
+    assert pool.dispatch("zxdrums")
+    assert pool.voices["z"] == pool.voices["x"] == 0
+    slots = pool.slot_fields()
+    assert sorted(slots) == ["a", "b", "x", "z"]
+    assert list(slots["a"][1]["len_list"]) == [6, 12]
+    assert list(slots["b"][1]["note_list"]) == [3]
+    assert slots["z"][1]["len_list"] is None  # made after the save
+    # the main process handles these itself:
+    assert not pool.dispatch("t120")
+    assert not pool.dispatch("h")
+
+
+def test_delete(pool, capsys):
+    pool.dispatch("=a")
+    assert pool.dispatch("-a")
+    assert pool.voices == {}
+    assert pool.slot_fields() == {}
+    assert pool.dispatch("-a")
+    assert "No such active voice" in capsys.readouterr().out